@@ -0,0 +1,110 @@
+"""
+Benchmarks of the CSSE transforms and of every CSSEReader read path on
+synthetic data (see conftest.py for the --scales option).
+
+Run with `make benchmark`.
+"""
+import timeit
+import pytest
+import synthetic
+from src.data.reader import CSSEReader, BACKENDS
+from src.data.transform import CSSETransformer
+
+# a selection as used by the notebooks: one state, one month
+STATES = ['New York']
+START, END = '2020-03-15', '2020-04-15'
+
+
+def transformer(root, backend='csv'):
+    return synthetic.relocate(CSSETransformer('csse', backend=backend), root)
+
+
+def reader(root, backend='csv'):
+    return synthetic.relocate(CSSEReader('csse', backend=backend), root)
+
+
+# transforms
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_raw2processed(run, csse_root, backend):
+    run(transformer(csse_root, backend).raw2processed)
+
+
+def test_processed2ds(run, csse_root):
+    run(transformer(csse_root).processed2ds, append=False)
+
+
+def test_raw2ds(run, csse_root):
+    run(transformer(csse_root).raw2ds, append=False)
+
+
+# read paths
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize('variable', ['confirmed', 'deaths'])
+def test_read_raw(run, csse_root, variable):
+    df = run(reader(csse_root).read_raw, variable=variable)
+    assert len(df)
+
+
+def test_read_raw_selection(run, csse_root):
+    df = run(reader(csse_root).read_raw, states=STATES, start=START, end=END)
+    assert len(df)
+
+
+def test_read_raw_timeseries(run, csse_root):
+    df = run(reader(csse_root).read_raw_timeseries)
+    assert len(df)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_read_processed(run, csse_root, backend):
+    df = run(reader(csse_root, backend).read_processed)
+    assert len(df)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_read_processed_selection(run, csse_root, backend):
+    df = run(reader(csse_root, backend).read_processed, states=STATES,
+             start=START, end=END)
+    assert len(df)
+
+
+QUERIES = {'all': {},
+           'counties': {'counties': [36061, 6037], 'start': START},
+           'state': {'states': STATES, 'start': START}}
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize('query', QUERIES.values(), ids=QUERIES.keys())
+def test_parquet_beats_csv(csse_root, query):
+    """
+    The Parquet backend reads faster than the csv files it replaces.
+    """
+    seconds = {}
+    for backend in BACKENDS:
+        read = reader(csse_root, backend).read_processed
+        seconds[backend] = min(timeit.repeat(lambda: read(**query),
+                                             number=1, repeat=5))
+    assert seconds['parquet'] < seconds['csv']
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_read_ancillary(run, csse_root, backend):
+    df = run(reader(csse_root, backend).read_ancillary, states=STATES)
+    assert len(df)
+
+
+def test_read_processed2ds(run, csse_root):
+    def load():
+        with reader(csse_root).read_processed2ds() as ds:
+            return ds.load()
+    ds = run(load)
+    assert ds.dims['county']
+
+
+def test_read_processed2ds_selection(run, csse_root):
+    def load():
+        with reader(csse_root).read_processed2ds() as ds:
+            return ds.sel(time=slice(START, END)).load()
+    ds = run(load)
+    assert ds.dims['time']
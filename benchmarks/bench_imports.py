@@ -0,0 +1,53 @@
+"""
+Import time budgets. Modules imported by tools and worker processes must not
+load NLP models or other heavy resources at import time.
+
+Run with `make benchmark`.
+"""
+import sys
+import subprocess
+import pytest
+from src.utils.paths import get_parent_dir
+
+# cumulative import time budgets in seconds
+BUDGETS = {'src.features.sentiments': 0.5}
+
+
+def import_time(module, repeat=3):
+    """
+    Cumulative import time of a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str
+        Dotted module name.
+    repeat : int
+        Number of measurements. The fastest one is returned.
+
+    Returns
+    -------
+    float
+        Import time in seconds, as reported by python -X importtime.
+    """
+    timings = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            cwd=get_parent_dir(up=2), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        # lines read "import time: self [us] | cumulative | package"
+        for line in proc.stderr.splitlines():
+            fields = [f.strip() for f in line.split('|')]
+            if len(fields) == 3 and fields[2] == module:
+                timings.append(int(fields[1]) / 1e6)
+    return min(timings)
+
+
+@pytest.mark.timing
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module, record_property):
+    seconds = import_time(module)
+    # reported in the junit xml (--junitxml)
+    record_property('import_time', seconds)
+    record_property('budget', BUDGETS[module])
+    assert seconds <= BUDGETS[module]
@@ -0,0 +1,49 @@
+"""
+Benchmarks of the text features on a synthetic corpus (see conftest.py for
+the --scales option). Skipped if the NLTK data or the spaCy model are not
+installed.
+"""
+import pytest
+from src.features import sentiments
+
+
+def require(*names):
+    """
+    Load resources of src.features.sentiments or skip the benchmark.
+    """
+    for name in names:
+        try:
+            sentiments.get_resource(name)
+        except (LookupError, OSError, ImportError) as e:
+            pytest.skip('{} is not available: {}'.format(name, e))
+
+
+def test_normalize_text(run, corpus):
+    require('stopwords', 'stemmer', 'stem_cache')
+    tokens = run(lambda: [sentiments.normalize_text(doc) for doc in corpus])
+    assert len(tokens) == len(corpus)
+
+
+def test_get_nouns_adj(run, corpus):
+    require('tagger', 'word_tokenize')
+    shares = run(lambda: [sentiments.get_nouns_adj(doc) for doc in corpus])
+    assert len(shares) == len(corpus)
+
+
+def test_compute_sentiment(run, corpus):
+    require('sid')
+    scores = run(lambda: [sentiments.compute_sentiment(doc, all=True)
+                          for doc in corpus])
+    assert len(scores) == len(corpus)
+
+
+def test_compute_sentiment_batch(run, corpus):
+    require('sid')
+    scores = run(sentiments.compute_sentiment_batch, corpus)
+    assert len(scores) == len(corpus)
+
+
+def test_iter_text_features(run, corpus):
+    require('nlp_tagger', 'stopwords', 'stemmer', 'stem_cache')
+    features = run(lambda: list(sentiments.iter_text_features(corpus)))
+    assert len(features) == len(corpus)
@@ -0,0 +1,76 @@
+"""
+Options and fixtures of the benchmarks.
+
+The data benchmarks run on synthetic data (see synthetic.py) at one or more
+scales of the bundled data, e.g.
+
+    python -m pytest benchmarks --scales 1,10,100 --benchmark-autosave
+
+Data of each scale is generated once per session. Saved runs can be
+compared with --benchmark-compare (see the pytest-benchmark docs).
+"""
+import os
+import pytest
+import synthetic
+from src.data.transform import CSSETransformer
+
+
+def pytest_addoption(parser):
+    parser.addoption('--scales', default='1',
+                     help='Comma separated scale factors of the synthetic '
+                          'data relative to the bundled data (default: 1).')
+
+
+def pytest_generate_tests(metafunc):
+    if 'scale' in metafunc.fixturenames:
+        scales = [float(s) for s in
+                  metafunc.config.getoption('scales').split(',')]
+        scales = [int(s) if s.is_integer() else s for s in scales]
+        metafunc.parametrize('scale', scales, scope='session',
+                             ids=['{}x'.format(s) for s in scales])
+
+
+def rounds(scale):
+    """
+    Number of benchmark rounds: fewer for the large scales.
+    """
+    return 3 if scale <= 10 else 1
+
+
+@pytest.fixture
+def run(benchmark, scale):
+    """
+    Benchmark one call per round of a function on data of a scale.
+    """
+    benchmark.extra_info['scale'] = scale
+
+    def run(func, *args, **kwargs):
+        return benchmark.pedantic(func, args=args, kwargs=kwargs,
+                                  rounds=rounds(scale), iterations=1)
+    return run
+
+
+@pytest.fixture(scope='session')
+def csse_root(scale, tmp_path_factory):
+    """
+    Project directory with scaled raw CSSE files, the processed time series
+    in both backends and the processed dataset.
+    """
+    root = str(tmp_path_factory.mktemp('csse_{}x'.format(scale)))
+    synthetic.make_csse(root, scale)
+    for backend in ['parquet', 'csv']:
+        transformer = synthetic.relocate(
+            CSSETransformer('csse', backend=backend), root)
+        transformer.raw2processed()
+    transformer.processed2ds(append=False)
+    assert os.path.exists(os.path.join(transformer.processed_dir_csse, 'US',
+                                       transformer.fname_ds))
+    return root
+
+
+@pytest.fixture(scope='session')
+def corpus(scale):
+    """
+    Synthetic articles, BASE_ARTICLES times scale.
+    """
+    return synthetic.make_corpus(scale)
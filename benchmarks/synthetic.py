@@ -0,0 +1,219 @@
+"""
+Synthetic data for the benchmarks, scaled relative to the bundled data.
+
+The CSSE generator grows the county x date grid of the bundled raw files by
+a scale factor: counties are replicated under new FIPS codes and the time
+series are continued with Poisson increments at each county's recent daily
+rate. The corpus generator draws articles from a Zipf distributed
+vocabulary of news words, including VADER sentiment words, numbers and
+punctuation. Both are seeded and therefore reproducible.
+"""
+import os
+import numpy as np
+import pandas as pd
+from src.data.structure import CSSE
+from src.data.reader import date_columns, clean_fips
+
+# articles of a day of scraped newspaper tweets, corpus size at scale 1
+BASE_ARTICLES = 1000
+WORDS_PER_ARTICLE = 400
+
+VOCABULARY = """
+the of and to a in that is for it on was with as he be by at have are this
+from his not but or which they has had an been were their said would who
+will more one there all she we about up its new year people than when out
+other also state county health officials virus coronavirus covid pandemic
+cases deaths hospital patients testing tests vaccine governor president
+city school schools students workers businesses economy jobs unemployment
+lockdown order orders reopening masks social distancing week weeks day days
+reported confirmed number rate increase decrease spread outbreak public
+federal local government department data study researchers doctors nurses
+care home homes residents community emergency response plan relief funding
+good great best better hope support safe success recovery improve improved
+positive strong help helped bad worse worst crisis death dying fear afraid
+panic risk risks threat concern concerns worried struggle lost loss tragic
+terrible sad angry failure failed critical severe serious surge spike
+""".split()
+
+PUNCTUATION = ['.', ',', '.', ',', ';', ':', '!', '?', '"', "'s"]
+
+
+def grid_factors(scale):
+    """
+    Split a scale factor of the county x date grid into a date factor and a
+    county factor.
+
+    Parameters
+    ----------
+    scale : float
+        Factor of the number of cells, e.g. 10 or 100.
+
+    Returns
+    -------
+    date_factor : int
+        round(sqrt(scale)), at least 1.
+    county_factor : float
+        scale / date_factor.
+    """
+    date_factor = max(int(round(np.sqrt(scale))), 1)
+    return date_factor, scale / date_factor
+
+
+def scale_raw(raw, scale, seed=0):
+    """
+    Scale a raw CSSE frame (as read with index_col=0).
+
+    Parameters
+    ----------
+    raw : pd.DataFrame
+        Raw CSSE data.
+    scale : float
+        Factor of the number of counties x dates.
+    seed : int
+        Seed of the random increments.
+
+    Returns
+    -------
+    pd.DataFrame
+        Raw CSSE data with about scale times as many cells.
+    """
+    rng = np.random.RandomState(seed)
+    date_factor, county_factor = grid_factors(scale)
+    dates = date_columns(raw.columns)
+    date_cols = list(dates.index)
+
+    # counties: copy k gets FIPS and UID shifted by k * 100000
+    n_counties = int(round(len(raw) * county_factor))
+    rows = np.resize(np.arange(len(raw)), n_counties)
+    copy = np.repeat(np.arange(int(np.ceil(county_factor))), len(raw))
+    copy = copy[:n_counties]
+    df = raw.iloc[rows].reset_index(drop=True)
+    df['FIPS'] = clean_fips(raw).values[rows] + copy * 100000
+    df['UID'] = df['UID'] + copy * 100000
+
+    # dates: continue the cumulative counts at the rate of the last week
+    n_new = len(dates) * (date_factor - 1)
+    if n_new:
+        values = df[date_cols].values.astype(np.int64)
+        week = min(7, len(date_cols) - 1)
+        rate = np.clip((values[:, -1] - values[:, -1 - week]) / week, 0, None)
+        increments = rng.poisson(rate, size=(n_new, len(df))).T
+        new = values[:, -1:] + np.cumsum(increments, axis=1)
+        new_dates = pd.date_range(dates.iloc[-1] + pd.Timedelta(days=1),
+                                  periods=n_new)
+        new_cols = ['{}/{}/{}'.format(d.month, d.day, d.strftime('%y'))
+                    for d in new_dates]
+        df = pd.concat([df, pd.DataFrame(new.astype(np.int32),
+                                         columns=new_cols)], axis=1)
+    return df
+
+
+def make_csse(root, scale, seed=0):
+    """
+    Write scaled raw CSSE files below root, in the layout of the data
+    directory ("data/raw/csse/US").
+
+    Parameters
+    ----------
+    root : str
+        Project directory of the synthetic data.
+    scale : float
+        Factor of the number of counties x dates.
+    seed : int
+        Seed of the random increments.
+
+    Returns
+    -------
+    dict
+        Shape (n_counties, n_dates) of the raw files per variable.
+    """
+    csse = CSSE('csse')
+    fdir = os.path.join(root, 'data', 'raw', 'csse', 'US')
+    if not os.path.exists(fdir):
+        os.makedirs(fdir)
+    shapes = {}
+    for var, fname in [('confirmed', csse.fname_confirmed_raw),
+                       ('deaths', csse.fname_deaths_raw)]:
+        raw = pd.read_csv(os.path.join(csse.raw_dir_csse, 'US', fname),
+                          index_col=0)
+        df = scale_raw(raw, scale, seed)
+        df.to_csv(os.path.join(fdir, fname))
+        shapes[var] = (len(df), len(date_columns(df.columns)))
+    return shapes
+
+
+def relocate(obj, root):
+    """
+    Point a CSSE data object to the data directories below root.
+
+    Parameters
+    ----------
+    obj : CSSE
+        E.g. a CSSEReader or CSSETransformer.
+    root : str
+        Project directory of the synthetic data.
+
+    Returns
+    -------
+    obj
+    """
+    obj.project_dir = root
+    obj.raw_dir = os.path.join(root, 'data', 'raw')
+    obj.processed_dir = os.path.join(root, 'data', 'processed')
+    obj.raw_dir_csse = os.path.join(obj.raw_dir, obj.dirname)
+    obj.processed_dir_csse = os.path.join(obj.processed_dir, obj.dirname)
+    fdir = os.path.join(obj.processed_dir_csse, 'US')
+    if not os.path.exists(fdir):
+        os.makedirs(fdir)
+    return obj
+
+
+def make_corpus(scale, seed=0, words=WORDS_PER_ARTICLE):
+    """
+    Synthetic newspaper articles.
+
+    Parameters
+    ----------
+    scale : float
+        Factor of the number of articles relative to BASE_ARTICLES.
+    seed : int
+        Seed of the random words.
+    words : int
+        Mean number of words per article.
+
+    Returns
+    -------
+    list of str
+    """
+    rng = np.random.RandomState(seed)
+    vocab = VOCABULARY + [str(n) for n in range(10)] + \
+        [str(n) for n in range(1990, 2021)]
+    # Zipf distributed word frequencies
+    p = 1. / np.arange(1, len(vocab) + 1)
+    p /= p.sum()
+
+    # forms of each word: plain or capitalized (sentence start), without
+    # or with one of the punctuation marks
+    suffixes = [''] + PUNCTUATION
+    forms = [form + suffix for word in vocab
+             for form in [word, word.capitalize()] for suffix in suffixes]
+    n_forms = 2 * len(suffixes)
+
+    n_docs = int(round(BASE_ARTICLES * scale))
+    lengths = np.maximum(rng.poisson(words, size=n_docs), 1)
+    offsets = np.append(0, np.cumsum(lengths))
+    docs = []
+    for start in range(0, n_docs, BASE_ARTICLES):
+        stop = min(start + BASE_ARTICLES, n_docs)
+        n_tokens = offsets[stop] - offsets[start]
+        # capitalized sentence starts, punctuation after about every 8th
+        # word
+        capitalized = rng.rand(n_tokens) < 1. / 12
+        suffix = np.where(rng.rand(n_tokens) < 1. / 8,
+                          rng.randint(1, len(suffixes), size=n_tokens), 0)
+        codes = (rng.choice(len(vocab), size=n_tokens, p=p) * n_forms +
+                 capitalized * len(suffixes) + suffix).tolist()
+        bounds = offsets[start:stop + 1] - offsets[start]
+        docs += [' '.join([forms[c] for c in codes[a:b]]) + '.'
+                 for a, b in zip(bounds[:-1], bounds[1:])]
+    return docs
@@ -1,12 +1,11 @@
 from tweepy import OAuthHandler
-import datetime
 import sys
 import tweepy
 import GetOldTweets3 as got
-import urllib
-from bs4 import BeautifulSoup # package for parsing HTML
-import pandas as pd
 from configparser import ConfigParser
+from src.data.articles import ArticleFetcher, tweet_requests
+from src.data.article_cache import ArticleCache, canonical_url
+from src.data.article_store import ArticleStore
 
 
 def log_in():
@@ -43,39 +42,20 @@ def scrape_twitter():
     return tweets
 
 def get_articles(tweets,api):
-
-    articles = {}
-    e=0
-    for tweet_scrape in tweets:
-        e=e+1
-        if e<3:
-            tweet = api.get_status(tweet_scrape.id,tweet_mode='extended')
-            a = tweet._json['entities']
-            b = a['urls']
-            c = b[0]
-            url = c['expanded_url']
-            page = urllib.request.urlopen(url)  # open the web page
-            html = page.read()  # read web page contents as a string
-            soup = BeautifulSoup(html, 'html.parser')  # parse html of web page
-            p_class = soup.find_all('p')
-            article = ""
-            for i in p_class:
-                article = article + i.get_text()
-
-            date_time_str = tweet._json['created_at']
-            date_time_obj = datetime.datetime.strptime(date_time_str, '%a %b %d %H:%M:%S %z %Y')
-            date = date_time_obj.date()
-
-        print(date)
-       # articles['Articles'].append(article)
-        articles.setdefault(date, []).append(article)
-        #print(articles)
-
-
-
-    df = pd.DataFrame.from_dict({'Articles': articles})
-    df=df
-    df.to_csv("./file.csv", sep=',')
+    # look up tweets in batches, then download and parse the linked
+    # articles concurrently (see src/data/articles.py). Pages already in
+    # the article cache are neither downloaded nor parsed again. Articles
+    # are written to the date-partitioned article store as they arrive;
+    # URLs stored by an earlier (possibly interrupted) run are skipped.
+    requests = tweet_requests(api, [tweet.id for tweet in tweets])
+    with ArticleStore() as store, ArticleCache() as cache:
+        stored = {canonical_url(url) for url in store.urls()}
+        requests = (r for r in requests
+                    if canonical_url(r['url']) not in stored)
+        counts = ArticleFetcher(cache=cache).fetch_articles(
+            requests, on_result=store.append)
+    print("Stored {ok} of {requests} articles".format(**counts))
+    return store
 
 
 
@@ -0,0 +1,308 @@
+"""
+Content-addressed on-disk cache of scraped article pages.
+
+Pages are stored once per content hash (sha1 of the raw HTML), as gzip
+compressed HTML next to their extracted paragraph text. A sqlite index maps
+canonicalized URLs, both the requested and the final (redirected) URL, to
+the content hash, together with the HTTP validators of the last response.
+
+Hence tweets that link to the same article, or to redirect and tracking
+variants of it, share one entry, and a page whose content is already known
+is not parsed again. Entries younger than `max_age` are served without any
+request. Older entries are revalidated with a conditional request. The
+total size of the stored objects is capped; least recently used objects are
+evicted first.
+"""
+import os
+import gzip
+import time
+import hashlib
+import sqlite3
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from src.data.structure import Data
+
+# query parameters that only track where a click came from
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'mc_cid', 'mc_eid', 'smid',
+                   'smtyp', 'cmpid', 'ref', 'ref_src', 'ocid', 'ncid',
+                   'igshid'}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    final_url TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    checked REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_hash ON urls (hash);
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    text TEXT,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_accessed ON objects (accessed);
+"""
+
+
+def canonical_url(url):
+    """
+    Canonical form of a URL: lower case scheme and host, no default port, no
+    fragment, no tracking parameters (utm_*, fbclid, ...) and sorted query
+    parameters.
+
+    Parameters
+    ----------
+    url : str
+
+    Returns
+    -------
+    str
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = '{}:{}'.format(host, parts.port)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    query = sorted((k, v) for k, v in params
+                   if not k.lower().startswith('utm_') and
+                   k.lower() not in TRACKING_PARAMS)
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def content_hash(html):
+    """
+    Content address of a page: sha1 hex digest of the raw HTML.
+    """
+    return hashlib.sha1(html).hexdigest()
+
+
+class ArticleCache(Data):
+    """
+    On-disk cache of article pages and their extracted text.
+    """
+    def __init__(self, dirname="article_cache", max_bytes=2 * 1024 ** 3,
+                 max_age=30 * 24 * 3600):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the sub directory of "data/interim" holding the cache.
+        max_bytes : int
+            Size cap of the stored objects (compressed HTML plus text).
+        max_age : float
+            Seconds during which an entry is used without revalidation.
+        """
+        Data.__init__(self)
+        self.cache_dir = os.path.join(self.project_dir, "data/interim",
+                                      dirname)
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        if not os.path.exists(self.objects_dir):
+            os.makedirs(self.objects_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, "index.db"))
+        self.db.executescript(SCHEMA)
+        # running total of the objects' sizes, summed once and then kept up
+        # to date by store and evict
+        self._size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fpath(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest + '.html.gz')
+
+    def lookup(self, url):
+        """
+        Cache entry of a URL.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        dict or None
+            Keys 'hash', 'final_url', 'etag', 'last_modified', 'text' and
+            'fresh' (no revalidation needed). None if the URL is not cached.
+        """
+        row = self.db.execute(
+            "SELECT u.hash, u.final_url, u.etag, u.last_modified, u.checked, "
+            "o.text FROM urls u JOIN objects o ON u.hash = o.hash "
+            "WHERE u.url = ?", (canonical_url(url),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        digest, final_url, etag, last_modified, checked, text = row
+        fresh = time.time() - checked < self.max_age
+        if fresh:
+            self.hits += 1
+            self._touch(digest)
+        return {'hash': digest, 'final_url': final_url, 'etag': etag,
+                'last_modified': last_modified, 'text': text, 'fresh': fresh}
+
+    def text(self, digest):
+        """
+        Extracted text of a stored object, or None if it is not stored.
+        """
+        row = self.db.execute("SELECT text FROM objects WHERE hash = ?",
+                              (digest,)).fetchone()
+        return None if row is None else row[0]
+
+    def html(self, digest):
+        """
+        Raw HTML of a stored object, or None if it is not stored.
+        """
+        try:
+            with gzip.open(self._fpath(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def revalidated_ok(self, url):
+        """
+        Record that a cached URL was revalidated (304 Not Modified).
+        """
+        self.revalidated += 1
+        row = self.db.execute("SELECT hash FROM urls WHERE url = ?",
+                              (canonical_url(url),)).fetchone()
+        with self.db:
+            self.db.execute("UPDATE urls SET checked = ? WHERE url = ?",
+                            (time.time(), canonical_url(url)))
+        if row is not None:
+            self._touch(row[0])
+
+    def store(self, url, html, text, final_url=None, etag=None,
+              last_modified=None):
+        """
+        Store a page and map its URLs to it.
+
+        Parameters
+        ----------
+        url : str
+            Requested URL.
+        html : bytes
+            Raw page contents.
+        text : str
+            Extracted text.
+        final_url : str, optional
+            URL after redirects, mapped to the same object.
+        etag, last_modified : str, optional
+            HTTP validators of the response.
+
+        Returns
+        -------
+        str
+            Content hash.
+        """
+        digest = content_hash(html)
+        now = time.time()
+        fpath = self._fpath(digest)
+        if not os.path.exists(fpath):
+            if not os.path.exists(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            with gzip.open(fpath + '.tmp', 'wb') as f:
+                f.write(html)
+            os.replace(fpath + '.tmp', fpath)
+        size = os.path.getsize(fpath) + len((text or '').encode('utf-8'))
+
+        urls = {canonical_url(url)}
+        if final_url:
+            urls.add(canonical_url(final_url))
+        row = self.db.execute("SELECT size FROM objects WHERE hash = ?",
+                              (digest,)).fetchone()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO objects (hash, text, size, accessed) "
+                "VALUES (?, ?, ?, ?)", (digest, text, size, now))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO urls (url, hash, final_url, etag, "
+                "last_modified, checked) VALUES (?, ?, ?, ?, ?, ?)",
+                [(u, digest, final_url, etag, last_modified, now)
+                 for u in urls])
+        self._size += size - (0 if row is None else row[0])
+        self.evict()
+        return digest
+
+    def _touch(self, digest):
+        with self.db:
+            self.db.execute("UPDATE objects SET accessed = ? WHERE hash = ?",
+                            (time.time(), digest))
+
+    def size(self):
+        """
+        Total size of the stored objects in bytes.
+        """
+        return self._size
+
+    def evict(self, max_bytes=None):
+        """
+        Remove least recently used objects (and their URLs) until the cache
+        is below the size cap.
+
+        Returns
+        -------
+        int
+            Number of evicted objects.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.size() - max_bytes
+        if excess <= 0:
+            return 0
+
+        evicted = []
+        freed = 0
+        for digest, size in self.db.execute(
+                "SELECT hash, size FROM objects ORDER BY accessed"):
+            if freed >= excess:
+                break
+            evicted.append(digest)
+            freed += size
+        with self.db:
+            self.db.executemany("DELETE FROM urls WHERE hash = ?",
+                                [(d,) for d in evicted])
+            self.db.executemany("DELETE FROM objects WHERE hash = ?",
+                                [(d,) for d in evicted])
+        self._size -= freed
+        for digest in evicted:
+            try:
+                os.remove(self._fpath(digest))
+            except FileNotFoundError:
+                pass
+        logging.getLogger(__name__).info(
+            'Evicted {} objects from the article cache.'.format(len(evicted)))
+        return len(evicted)
+
+    def stats(self):
+        """
+        Cache statistics.
+
+        Returns
+        -------
+        dict
+            hits (fresh entries), revalidated (304), misses, n_urls,
+            n_objects and size in bytes.
+        """
+        n_urls = self.db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        n_objects = self.db.execute(
+            "SELECT COUNT(*) FROM objects").fetchone()[0]
+        return {'hits': self.hits, 'revalidated': self.revalidated,
+                'misses': self.misses, 'n_urls': n_urls,
+                'n_objects': n_objects, 'size': self.size()}
@@ -0,0 +1,266 @@
+"""
+Append-only article store, partitioned by publication date.
+
+Each day is a directory "date=YYYY-MM-DD" under data/raw/articles. Articles
+are appended to the day's articles.jsonl one line at a time as soon as they
+are fetched, and flushed, so a crashed scrape keeps everything written up
+to the crash and can be restarted, skipping the URLs already stored
+(see urls). Days that are complete can be compacted into Parquet parts.
+
+Readers stream the store partition by partition and only open the
+partitions of the requested date range, so memory is bounded by one day of
+articles no matter how large the store grows.
+"""
+import os
+import json
+import logging
+import pandas as pd
+from src.data.structure import Data
+from src.utils.profiling import count
+
+COLUMNS = ['date', 'outlet', 'url', 'final_url', 'tweet_id', 'text']
+
+PARTITION_PREFIX = "date="
+
+
+class ArticleStore(Data):
+    """
+    Date-partitioned store of scraped articles.
+    """
+    def __init__(self, dirname="articles"):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the sub directory of "data/raw" holding the store.
+        """
+        Data.__init__(self)
+        self.store_dir = os.path.join(self.raw_dir, dirname)
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        self._files = {}
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _partition_dir(self, date):
+        return os.path.join(self.store_dir, PARTITION_PREFIX + date)
+
+    def partitions(self, start=None, end=None):
+        """
+        Dates of the stored partitions between start and end (inclusive).
+
+        Returns
+        -------
+        list of str
+            Sorted dates as YYYY-MM-DD.
+        """
+        start = None if start is None else \
+            pd.Timestamp(start).strftime('%Y-%m-%d')
+        end = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+        dates = sorted(d[len(PARTITION_PREFIX):]
+                       for d in os.listdir(self.store_dir)
+                       if d.startswith(PARTITION_PREFIX))
+        return [d for d in dates
+                if (start is None or d >= start) and (end is None or d <= end)]
+
+    def append(self, record):
+        """
+        Append one article to the partition of its date.
+
+        Parameters
+        ----------
+        record : dict
+            Article with at least 'date' (datetime-like) and 'text'. Missing
+            columns are stored as null, unknown keys are dropped. Records
+            without text (failed downloads) are skipped, so they are retried
+            on the next run.
+
+        Returns
+        -------
+        bool
+            Whether the record was written.
+        """
+        if record.get('text') is None:
+            return False
+        date = pd.Timestamp(record['date']).strftime('%Y-%m-%d')
+        row = {col: record.get(col) for col in COLUMNS}
+        row['date'] = date
+
+        f = self._files.get(date)
+        if f is None:
+            fdir = self._partition_dir(date)
+            if not os.path.exists(fdir):
+                os.makedirs(fdir)
+            fpath = os.path.join(fdir, "articles.jsonl")
+            f = open(fpath, 'a', encoding='utf-8')
+            # terminate a line truncated by an interrupted run
+            if f.tell() > 0 and not _ends_with_newline(fpath):
+                f.write('\n')
+            self._files[date] = f
+        line = json.dumps(row, ensure_ascii=False) + '\n'
+        f.write(line)
+        f.flush()
+        count(rows_out=1, bytes_out=len(line.encode('utf-8')))
+        return True
+
+    def compact(self, before=None):
+        """
+        Move the JSONL records of complete days into a new Parquet part.
+
+        Parameters
+        ----------
+        before : datetime-like, optional
+            Only compact days before this date, e.g. today. Defaults to all.
+
+        Returns
+        -------
+        list of str
+            Dates of the compacted partitions.
+        """
+        logger = logging.getLogger(__name__)
+        self.close()
+        end = None if before is None else \
+            pd.Timestamp(before) - pd.Timedelta(days=1)
+        compacted = []
+        for date in self.partitions(end=end):
+            fdir = self._partition_dir(date)
+            fpath = os.path.join(fdir, "articles.jsonl")
+            if not os.path.exists(fpath):
+                continue
+            df = pd.DataFrame(list(_read_jsonl(fpath)), columns=COLUMNS)
+            n_parts = sum(f.endswith('.parquet') for f in os.listdir(fdir))
+            fpart = os.path.join(fdir, "part-{:05d}.parquet".format(n_parts))
+            df.to_parquet(fpart + '.tmp', engine='pyarrow', index=False)
+            os.replace(fpart + '.tmp', fpart)
+            os.remove(fpath)
+            count(rows_out=len(df), bytes_out=os.path.getsize(fpart))
+            compacted.append(date)
+            logger.info('Compacted {} articles of {}.'.format(len(df), date))
+        return compacted
+
+    def _read_partition(self, date, columns, outlets):
+        """
+        All articles of one day as a data frame.
+        """
+        fdir = self._partition_dir(date)
+        read_columns = list(columns)
+        if outlets is not None and 'outlet' not in read_columns:
+            read_columns.append('outlet')
+        # compacted parts first, then the live JSONL: rows keep the order
+        # in which they were appended
+        frames = []
+        for fname in sorted(os.listdir(fdir),
+                            key=lambda f: (f.endswith('.jsonl'), f)):
+            fpath = os.path.join(fdir, fname)
+            if fname.endswith('.parquet'):
+                filters = None if outlets is None else \
+                    [('outlet', 'in', list(outlets))]
+                frames.append(pd.read_parquet(fpath, engine='pyarrow',
+                                              columns=read_columns,
+                                              filters=filters))
+            elif fname.endswith('.jsonl'):
+                frames.append(pd.DataFrame(list(_read_jsonl(fpath)),
+                                           columns=COLUMNS))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True)
+        if outlets is not None:
+            df = df[df['outlet'].isin(list(outlets))]
+        return df[columns]
+
+    def iter_batches(self, start=None, end=None, outlets=None, columns=None,
+                     batch_size=10000):
+        """
+        Stream articles in batches, partition by partition in date order.
+
+        Parameters
+        ----------
+        start, end : str or pd.Timestamp, optional
+            First and last publication date.
+        outlets : list of str, optional
+            Only articles of these outlets (twitter screen names).
+        columns : list of str, optional
+            Columns to read. Defaults to all.
+        batch_size : int
+            Maximum number of articles per batch. Batches do not span days.
+
+        Returns
+        -------
+        generator of pd.DataFrame
+        """
+        columns = COLUMNS if columns is None else list(columns)
+        for date in self.partitions(start, end):
+            df = self._read_partition(date, columns, outlets)
+            for i in range(0, len(df), batch_size):
+                yield df.iloc[i:i + batch_size].reset_index(drop=True)
+
+    def iter_articles(self, start=None, end=None, outlets=None,
+                      columns=None):
+        """
+        Stream articles one by one, e.g. texts into the sentiment stage.
+
+        Returns
+        -------
+        generator of dict
+        """
+        for df in self.iter_batches(start, end, outlets, columns):
+            for record in df.to_dict('records'):
+                yield record
+
+    def read_articles(self, start=None, end=None, outlets=None,
+                      columns=None):
+        """
+        Articles as one data frame. Only use if they fit in memory.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        columns = COLUMNS if columns is None else list(columns)
+        frames = list(self.iter_batches(start, end, outlets, columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def urls(self):
+        """
+        URLs of all stored articles, e.g. to skip them when a scrape is
+        restarted.
+
+        Returns
+        -------
+        set of str
+        """
+        urls = set()
+        for df in self.iter_batches(columns=['url']):
+            urls.update(df['url'].dropna())
+        return urls
+
+
+def _read_jsonl(fpath):
+    """
+    Records of a JSONL file. A truncated last line (interrupted write) is
+    skipped.
+    """
+    with open(fpath, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.getLogger(__name__).warning(
+                    'Skipping corrupt line in {}.'.format(fpath))
+
+
+def _ends_with_newline(fpath):
+    with open(fpath, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
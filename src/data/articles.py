@@ -0,0 +1,467 @@
+"""
+Concurrent download of the news articles linked in tweets.
+
+Articles are fetched with asyncio over a single aiohttp session, which reuses
+connections. A per-host scheduler bounds the number of concurrent requests to
+each host, spaces requests to the same host and backs off a whole host when
+it answers with 429 (Too Many Requests) or 503 (Service Unavailable).
+Failed requests are retried with exponential backoff. Parsing the HTML is
+CPU bound and done in a process pool, so it does not block the event loop.
+"""
+import time
+import random
+import asyncio
+import logging
+import datetime
+import collections
+import email.utils
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor
+import aiohttp
+from bs4 import BeautifulSoup
+from src.data.article_cache import content_hash, canonical_url
+
+# status codes worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+USER_AGENT = "Mozilla/5.0 (compatible; bd4pp-article-fetcher)"
+
+
+def extract_paragraphs(html):
+    """
+    Text of all paragraphs (<p>) of a web page.
+
+    Parameters
+    ----------
+    html : bytes or str
+        Page contents.
+
+    Returns
+    -------
+    str
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    return "".join(p.get_text() for p in soup.find_all('p'))
+
+
+def retry_after(value, default=None):
+    """
+    Seconds to wait according to a Retry-After header.
+
+    Parameters
+    ----------
+    value : str or None
+        Header value, either seconds or an HTTP date.
+    default : float, optional
+        Returned if the header is missing or invalid.
+
+    Returns
+    -------
+    float or None
+    """
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((when - now).total_seconds(), 0.)
+
+
+def conditional_headers(entry):
+    """
+    Request headers to revalidate a cache entry.
+
+    Parameters
+    ----------
+    entry : dict or None
+        Cache entry with keys 'etag' and 'last_modified', see
+        ArticleCache.lookup.
+
+    Returns
+    -------
+    dict
+    """
+    headers = {}
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry is not None and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def tweet_requests(api, tweet_ids, batch_size=100):
+    """
+    Article requests of tweets: the first linked URL, publication date and
+    author of each tweet.
+
+    Tweets are looked up in batches of up to 100 per API call instead of one
+    call per tweet.
+
+    Parameters
+    ----------
+    api : tweepy.API
+        Authenticated API.
+    tweet_ids : iterable of int
+        Tweet ids, e.g. from GetOldTweets3.
+    batch_size : int
+        Tweets per lookup. 100 is the maximum of the API.
+
+    Returns
+    -------
+    list of dict
+        Keys 'url', 'date', 'outlet' and 'tweet_id'. Tweets without a link
+        are skipped.
+    """
+    tweet_ids = list(tweet_ids)
+    requests = []
+    for i in range(0, len(tweet_ids), batch_size):
+        statuses = api.statuses_lookup(tweet_ids[i:i + batch_size],
+                                       tweet_mode='extended')
+        for status in statuses:
+            urls = status._json['entities']['urls']
+            if not urls:
+                continue
+            requests.append({'url': urls[0]['expanded_url'],
+                             'date': status.created_at.date().isoformat(),
+                             'outlet': status.user.screen_name,
+                             'tweet_id': status.id})
+    return requests
+
+
+def distinct_requests(requests, counts=None):
+    """
+    Requests as dicts, without those for a URL already requested.
+
+    Parameters
+    ----------
+    requests : iterable of dict or str
+        Requests with at least the key 'url', or plain URLs.
+    counts : collections.Counter, optional
+        Incremented by the number of skipped 'duplicates'.
+
+    Yields
+    ------
+    dict
+        Copy of the first request of each URL, compared by canonical_url.
+    """
+    seen = set()
+    for request in requests:
+        request = {'url': request} if isinstance(request, str) \
+            else dict(request)
+        url = canonical_url(request['url'])
+        if url in seen:
+            if counts is not None:
+                counts['duplicates'] += 1
+            continue
+        seen.add(url)
+        yield request
+
+
+class HostScheduler(object):
+    """
+    Per-host admission control: at most `per_host` concurrent requests to a
+    host, at least `delay` seconds between the starts of two requests to the
+    same host, and a host-wide pause after rate limiting.
+    """
+    def __init__(self, per_host=4, delay=0.):
+        """
+        Parameters
+        ----------
+        per_host : int
+            Maximum number of concurrent requests per host.
+        delay : float
+            Minimum time in seconds between two requests to the same host.
+        """
+        self.per_host = per_host
+        self.delay = delay
+        self._semaphores = {}
+        self._not_before = {}
+        self._locks = {}
+
+    def _get(self, host):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+            self._locks[host] = asyncio.Lock()
+            self._not_before[host] = 0.
+        return self._semaphores[host], self._locks[host]
+
+    async def acquire(self, host):
+        """
+        Wait until a request to host may start.
+        """
+        semaphore, lock = self._get(host)
+        await semaphore.acquire()
+        # the lock serializes the start times of requests to one host
+        async with lock:
+            wait = self._not_before[host] - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._not_before[host] = max(self._not_before[host],
+                                         time.monotonic() + self.delay)
+
+    def release(self, host):
+        self._semaphores[host].release()
+
+    def defer(self, host, seconds):
+        """
+        Pause all requests to host for the given time, e.g. after a 429.
+        """
+        self._get(host)
+        self._not_before[host] = max(self._not_before[host],
+                                     time.monotonic() + seconds)
+
+
+class ArticleFetcher(object):
+    """
+    Downloads and parses articles concurrently.
+    """
+    def __init__(self, concurrency=32, per_host=4, delay=0., retries=3,
+                 backoff=1., timeout=30, n_parsers=None,
+                 user_agent=USER_AGENT, cache=None):
+        """
+        Parameters
+        ----------
+        concurrency : int
+            Maximum number of requests in flight over all hosts.
+        per_host : int
+            Maximum number of concurrent requests per host.
+        delay : float
+            Minimum time in seconds between two requests to the same host.
+        retries : int
+            Number of retries after a failed request.
+        backoff : float
+            Base of the exponential backoff in seconds: retry i waits about
+            backoff * 2 ** i seconds, or as long as Retry-After says.
+        timeout : float
+            Total timeout of a request in seconds.
+        n_parsers : int, optional
+            Number of parser processes. Defaults to the number of CPUs. 0
+            parses in the event loop thread.
+        user_agent : str
+            User-Agent header of all requests.
+        cache : ArticleCache, optional
+            On-disk cache of pages and texts, see src.data.article_cache.
+            Fresh entries are used without request, stale entries are
+            revalidated, and pages with known content are not parsed again.
+        """
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.n_parsers = n_parsers
+        self.user_agent = user_agent
+        self.cache = cache
+
+    async def fetch(self, session, scheduler, url, headers=None):
+        """
+        GET a page, with retries.
+
+        Parameters
+        ----------
+        headers : dict, optional
+            Additional request headers, e.g. If-None-Match.
+
+        Returns
+        -------
+        dict
+            Keys 'status', 'final_url', 'html' (bytes or None), 'etag',
+            'last_modified' and 'error' (None on success, including 304).
+        """
+        logger = logging.getLogger(__name__)
+        host = urlsplit(url).netloc
+        result = {'status': None, 'final_url': url, 'html': None,
+                  'etag': None, 'last_modified': None, 'error': None}
+
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2 ** attempt * (0.5 + random.random())
+            await scheduler.acquire(host)
+            try:
+                async with session.get(url, headers=headers) as response:
+                    result['status'] = response.status
+                    result['final_url'] = str(response.url)
+                    result['etag'] = response.headers.get('ETag')
+                    result['last_modified'] = \
+                        response.headers.get('Last-Modified')
+                    if response.status in (200, 304):
+                        if response.status == 200:
+                            result['html'] = await response.read()
+                        result['error'] = None
+                        return result
+                    result['error'] = 'HTTP {}'.format(response.status)
+                    if response.status not in RETRY_STATUS:
+                        return result
+                    if response.status in (429, 503):
+                        wait = retry_after(
+                            response.headers.get('Retry-After'), wait)
+                        scheduler.defer(host, wait)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result['error'] = repr(e)
+            finally:
+                scheduler.release(host)
+
+            if attempt < self.retries:
+                logger.debug('Retrying {} in {:.1f}s ({}).'.format(
+                    url, wait, result['error']))
+                await asyncio.sleep(wait)
+        logger.warning('Failed to fetch {}: {}'.format(url, result['error']))
+        return result
+
+    async def process(self, session, scheduler, parser, request):
+        """
+        Fetch the page of a request and extract its text, using the cache
+        if there is one.
+
+        Returns
+        -------
+        dict
+            The request plus 'status', 'final_url', 'text', 'error' and
+            'cached' (text taken from the cache).
+        """
+        url = request['url']
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        if entry is not None and entry['fresh']:
+            return dict(request, status=200, text=entry['text'], error=None,
+                        final_url=entry['final_url'] or url, cached=True)
+
+        response = await self.fetch(session, scheduler, url,
+                                    conditional_headers(entry))
+        html = response.pop('html')
+        validators = {'etag': response.pop('etag'),
+                      'last_modified': response.pop('last_modified')}
+
+        if response['status'] == 304 and entry is not None:
+            self.cache.revalidated_ok(url)
+            return dict(request, text=entry['text'], cached=True,
+                        **response)
+
+        text, cached = None, False
+        if html is not None:
+            if self.cache is not None:
+                text = self.cache.text(content_hash(html))
+                cached = text is not None
+            try:
+                if text is None:
+                    text = await self.parse(parser, html)
+            except Exception as e:
+                response['error'] = 'parse error: {!r}'.format(e)
+            if self.cache is not None and text is not None:
+                self.cache.store(url, html, text, response['final_url'],
+                                 **validators)
+        return dict(request, text=text, cached=cached, **response)
+
+    async def parse(self, parser, html):
+        """
+        Extract the text of a page, in the parser pool if there is one.
+        """
+        if parser is None:
+            return extract_paragraphs(html)
+        return await asyncio.get_running_loop().run_in_executor(
+            parser, extract_paragraphs, html)
+
+    async def fetch_all(self, requests, on_result=None):
+        """
+        Fetch and parse the articles of all requests.
+
+        Requests are fed to the workers through a bounded queue, so a
+        generator of requests is consumed lazily. Requests for a URL that
+        was already requested in this run (compared by canonical_url) are
+        skipped.
+
+        Parameters
+        ----------
+        requests : iterable of dict or str
+            Requests with at least the key 'url'. Other keys (e.g. 'date',
+            'outlet') are passed through to the results. Plain URLs are
+            accepted too.
+        on_result : callable, optional
+            Called with each result as soon as it is available, e.g. to
+            write it to a store. Results are then not kept in memory.
+
+        Returns
+        -------
+        list of dict or collections.Counter
+            Without on_result, one result per distinct URL, in order: the
+            request plus 'status', 'final_url', 'text', 'error' and
+            'cached'. With on_result, only the number of fetched
+            'requests', of 'ok' results (no error), of 'cached' results and
+            of skipped 'duplicates'.
+        """
+        counts = collections.Counter(requests=0, ok=0, cached=0,
+                                     duplicates=0)
+        results = {}
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        scheduler = HostScheduler(self.per_host, self.delay)
+        parser = ProcessPoolExecutor(self.n_parsers) \
+            if self.n_parsers != 0 else None
+
+        async def produce():
+            for i, request in enumerate(distinct_requests(requests, counts)):
+                await queue.put((i, request))
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def worker(session):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                i, request = item
+                result = await self.process(session, scheduler, parser,
+                                            request)
+                counts.update(requests=1, ok=result['error'] is None,
+                              cached=result['cached'])
+                if on_result is None:
+                    results[i] = result
+                else:
+                    on_result(result)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        headers = {'User-Agent': self.user_agent}
+        try:
+            async with aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout,
+                                             headers=headers) as session:
+                await asyncio.gather(produce(), *[
+                    worker(session) for _ in range(self.concurrency)])
+        finally:
+            if parser is not None:
+                parser.shutdown()
+        if on_result is not None:
+            return counts
+        return [results[i] for i in range(len(results))]
+
+    def fetch_articles(self, requests, on_result=None):
+        """
+        Blocking version of fetch_all.
+        """
+        logger = logging.getLogger(__name__)
+        start = time.time()
+        results = asyncio.run(self.fetch_all(requests, on_result))
+        if on_result is None:
+            n_ok, n = sum(r['error'] is None for r in results), len(results)
+        else:
+            n_ok, n = results['ok'], results['requests']
+        logger.info('Fetched {} of {} articles in {:.1f}s.'.format(
+            n_ok, n, time.time() - start))
+        if self.cache is not None:
+            logger.info('Article cache: {}'.format(self.cache.stats()))
+        return results
+
+
+if __name__ == '__main__':
+    import sys
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    for result in ArticleFetcher().fetch_articles(sys.argv[1:]):
+        print(result['url'], result['status'], len(result['text'] or ''))
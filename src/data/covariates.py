@@ -0,0 +1,574 @@
+"""
+Registry of covariate sources (see references/data_sources.csv).
+
+Each source is a Transformer that declares where its raw files are, whether
+it is keyed by county or by state FIPS code, and the schema (column ->
+dtype) of the parsed table. read_raw parses the raw files once into a data
+frame indexed by FIPS code. raw2processed validates it against the schema
+and writes it to data/processed/covariates/<NAME>.parquet. The checksum of
+the raw files and the schema are recorded in a manifest, and a source is
+only parsed again if either changed. Hence analyses load pre-parsed,
+typed covariates with read_covariates instead of parsing the spreadsheets.
+
+State level sources include the United States total as FIPS code 0, as the
+Census tables do.
+
+Sources are registered with the register decorator:
+
+    @register
+    class MySource(Covariate):
+        name = 'MYSOURCE'
+        category = 'health'
+        fnames = ['MYSOURCE_2020.csv']
+        level = 'state'
+        schema = {'beds': 'float64'}
+
+        def read_raw(self):
+            ...
+"""
+import os
+import re
+import csv
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from src.data.structure import Transformer
+from src.data.fips import FIPSIndex
+from src.utils.profiling import count
+
+# FIPS code of the United States totals in state level tables
+NATION = 0
+
+# registry: name -> Covariate subclass
+SOURCES = {}
+
+# markers of missing values in the Census and KFF tables
+MISSING = ['.', '-', '---', '*', '(X)', '(NA)', 'N/A', 'NA', '']
+
+# 2-digit NAICS sectors of the County Business Patterns
+NAICS_SECTORS = ['00', '11', '21', '22', '23', '31-33', '42', '44-45',
+                 '48-49', '51', '52', '53', '54', '55', '56', '61', '62',
+                 '71', '72', '81', '99']
+
+
+def register(cls):
+    """
+    Class decorator that adds a covariate source to the registry.
+    """
+    SOURCES[cls.name] = cls
+    return cls
+
+
+def get_source(name):
+    """
+    Covariate source by name.
+
+    Parameters
+    ----------
+    name : str
+        One of SOURCES, e.g. 'POPEST'.
+
+    Returns
+    -------
+    Covariate
+    """
+    if name not in SOURCES:
+        raise IOError("Covariate source does not exist. Choose one of "
+                      "{}.".format(", ".join(sorted(SOURCES))))
+    return SOURCES[name]()
+
+
+def ingest(names=None, force=False):
+    """
+    Parse the raw files of all (or some) sources whose files changed.
+
+    Parameters
+    ----------
+    names : list of str, optional
+        Sources to ingest. Defaults to all sources with raw files.
+    force : bool
+        Parse even if the raw files did not change.
+
+    Returns
+    -------
+    list of str
+        Names of the sources that were parsed.
+    """
+    logger = logging.getLogger(__name__)
+    parsed = []
+    for name in sorted(SOURCES) if names is None else names:
+        source = get_source(name)
+        if names is None and not source.available():
+            logger.info('Skipping {}: raw files missing.'.format(name))
+            continue
+        if source.raw2processed(force=force):
+            parsed.append(name)
+    return parsed
+
+
+def read_covariates(name, columns=None):
+    """
+    Pre-parsed covariates of a source.
+
+    Parameters
+    ----------
+    name : str
+        One of SOURCES.
+    columns : list of str, optional
+        Columns to read. Defaults to all.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by county or state FIPS code.
+    """
+    return get_source(name).read_processed(columns)
+
+
+def to_number(values):
+    """
+    Parse numbers formatted like "1,234", "$56" or "7%", with the missing
+    value markers of MISSING.
+    """
+    s = pd.Series(values).astype(str).str.strip()
+    s = s.str.replace(r'[$,%]', '', regex=True).str.strip()
+    s = s.where(~s.isin(MISSING))
+    return pd.to_numeric(s, errors='coerce')
+
+
+def state_codes(names):
+    """
+    State FIPS codes of state names, with NATION for the United States.
+    """
+    names = pd.Series(names).astype(str).str.strip()
+    codes = FIPSIndex().state_fips(names)
+    nation = names.str.lower().str.startswith('united states')
+    return codes.mask(nation, NATION)
+
+
+class Covariate(Transformer):
+    """
+    Basic class of a covariate source. Must declare name, category, fnames,
+    level and schema and implement read_raw.
+    """
+    name = None
+    category = None
+    fnames = []
+    level = 'state'
+    schema = {}
+
+    def __init__(self):
+        Transformer.__init__(self)
+        self.raw_dir_source = os.path.join(self.raw_dir, self.category)
+        self.processed_dir_covariates = os.path.join(self.processed_dir,
+                                                     "covariates")
+        self.fpath_processed = os.path.join(self.processed_dir_covariates,
+                                            self.name + ".parquet")
+        self.fpath_manifest = os.path.join(self.processed_dir_covariates,
+                                           "manifest.json")
+
+    @property
+    def fpaths_raw(self):
+        return [os.path.join(self.raw_dir_source, f) for f in self.fnames]
+
+    def available(self):
+        """
+        Whether all raw files exist.
+        """
+        return all(os.path.exists(f) for f in self.fpaths_raw)
+
+    def checksum(self):
+        """
+        sha1 of the raw files.
+        """
+        sha1 = hashlib.sha1()
+        for fpath in self.fpaths_raw:
+            with open(fpath, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+        return sha1.hexdigest()
+
+    def read_raw(self):
+        """
+        Parse the raw files.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per county or state, indexed by FIPS code, with the
+            columns of the schema.
+        """
+        raise NotImplementedError
+
+    def validate(self, df):
+        """
+        Check the parsed table against the schema and cast the columns.
+        """
+        missing = set(self.schema) - set(df.columns)
+        if missing:
+            raise ValueError("{}: missing columns {}.".format(
+                self.name, sorted(missing)))
+        if not df.index.is_unique:
+            raise ValueError("{}: duplicated FIPS codes {}.".format(
+                self.name, df.index[df.index.duplicated()].tolist()))
+        df = df[list(self.schema)].astype(self.schema)
+        df.columns.name = None
+        df.index = pd.Index(df.index.astype(np.int64), name=self.level)
+        return df.sort_index()
+
+    def _read_manifest(self):
+        if not os.path.exists(self.fpath_manifest):
+            return {}
+        with open(self.fpath_manifest, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        with open(self.fpath_manifest + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(self.fpath_manifest + '.tmp', self.fpath_manifest)
+
+    def raw2processed(self, force=False):
+        """
+        Parse the raw files into the processed Parquet file, unless the raw
+        files and the schema did not change since the last run.
+
+        Parameters
+        ----------
+        force : bool
+            Parse in any case.
+
+        Returns
+        -------
+        bool
+            Whether the source was parsed.
+        """
+        logger = logging.getLogger(__name__)
+        checksum = self.checksum()
+        entry = {'checksum': checksum, 'schema': self.schema}
+        manifest = self._read_manifest()
+        if not force and manifest.get(self.name) == entry and \
+                os.path.exists(self.fpath_processed):
+            logger.info('{} is up to date.'.format(self.name))
+            return False
+
+        logger.info('Parsing {}.'.format(self.name))
+        df = self.validate(self.read_raw())
+        if not os.path.exists(self.processed_dir_covariates):
+            os.makedirs(self.processed_dir_covariates)
+        df.to_parquet(self.fpath_processed + '.tmp', engine='pyarrow')
+        os.replace(self.fpath_processed + '.tmp', self.fpath_processed)
+        count(rows_out=len(df),
+              bytes_out=os.path.getsize(self.fpath_processed))
+
+        # re-read the manifest, other sources may have been written since
+        manifest = self._read_manifest()
+        manifest[self.name] = entry
+        self._write_manifest(manifest)
+        return True
+
+    def read_processed(self, columns=None):
+        """
+        Read the parsed covariates, parsing them first if necessary.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to read. Defaults to all.
+
+        Returns
+        -------
+        pd.DataFrame
+        """
+        if not os.path.exists(self.fpath_processed):
+            self.raw2processed()
+        return pd.read_parquet(self.fpath_processed, engine='pyarrow',
+                               columns=columns)
+
+
+@register
+class POPESTCovariate(Covariate):
+    """
+    Population estimates and components of change, 2019 (county).
+    """
+    name = 'POPEST'
+    category = 'demography'
+    fnames = ['POPEST_2019.csv']
+    level = 'county'
+    columns = {'POPESTIMATE2019': 'population',
+               'BIRTHS2019': 'births',
+               'DEATHS2019': 'deaths',
+               'NATURALINC2019': 'natural_increase',
+               'NETMIG2019': 'net_migration'}
+    schema = {col: 'int64' for col in columns.values()}
+
+    def read_raw(self):
+        df = pd.read_csv(self.fpaths_raw[0], encoding="ISO-8859-1",
+                         usecols=['SUMLEV', 'STATE', 'COUNTY'] +
+                         list(self.columns))
+        df = df[df['SUMLEV'] == 50]
+        df.index = df['STATE'] * 1000 + df['COUNTY']
+        return df.rename(columns=self.columns)
+
+
+@register
+class SAHIECovariate(Covariate):
+    """
+    Small Area Health Insurance Estimates, 2017 (county). Totals over all
+    ages, races, sexes and incomes.
+    """
+    name = 'SAHIE'
+    category = 'health'
+    fnames = ['SAHIE_2017.csv']
+    level = 'county'
+    columns = ['NIPR', 'nipr_moe', 'NUI', 'nui_moe', 'NIC', 'nic_moe',
+               'PCTUI', 'pctui_moe', 'PCTIC', 'pctic_moe', 'PCTELIG',
+               'pctelig_moe', 'PCTLIIC', 'pctliic_moe']
+    schema = {col: 'float64' for col in columns}
+
+    def read_raw(self):
+        # the data is preceded by a free text header of varying length
+        with open(self.fpaths_raw[0], 'r', encoding="ISO-8859-1") as f:
+            for n_skip, line in enumerate(f):
+                if line.lstrip().startswith('year,'):
+                    break
+        df = pd.read_csv(self.fpaths_raw[0], encoding="ISO-8859-1",
+                         skiprows=n_skip, dtype=str, skipinitialspace=True)
+        df.columns = df.columns.str.strip()
+        df = df.apply(lambda s: s.str.strip())
+
+        # geocat 50: county; category 0: total
+        totals = (df['geocat'] == '50')
+        for cat in ['agecat', 'racecat', 'sexcat', 'iprcat']:
+            totals &= df[cat] == '0'
+        df = df[totals]
+        df.index = df['statefips'].astype(int) * 1000 + \
+            df['countyfips'].astype(int)
+        return df[self.columns].apply(to_number)
+
+
+@register
+class STCCovariate(Covariate):
+    """
+    State government tax collections by category, 2018, in thousands of
+    dollars (state).
+    """
+    name = 'STC'
+    category = 'economy'
+    fnames = ['STC_2018_Category_Table.xlsx']
+    items = {'T00': 'tax_total', 'T01': 'tax_property', 'TA1': 'tax_sales',
+             'TA3': 'tax_license', 'TA4': 'tax_income', 'TA5': 'tax_other'}
+    schema = {col: 'float64' for col in items.values()}
+
+    def read_raw(self):
+        df = pd.read_excel(self.fpaths_raw[0], dtype=str)
+        df.columns = df.columns.str.lower()
+        df = df[df['item'].isin(self.items)]
+        df = df.assign(amount=to_number(df['amount']).values,
+                       state=df['state_code'].astype(int).values)
+        return df.pivot(index='state', columns='item', values='amount') \
+            .rename(columns=self.items)
+
+
+@register
+class CBPCovariate(Covariate):
+    """
+    County Business Patterns, 2018: establishments, employees and annual
+    payroll (thousands of dollars) by NAICS sector (state).
+    """
+    name = 'CBP'
+    category = 'economy'
+    fnames = ['CBP_2018.xlsx']
+    measures = {4: 'establishments', 5: 'employees', 9: 'payroll'}
+    schema = {'{}_{}'.format(m, naics): 'float64'
+              for m in measures.values() for naics in NAICS_SECTORS}
+
+    def read_raw(self):
+        df = pd.read_excel(self.fpaths_raw[0], header=None, dtype=str)
+        df = df[df[1].isin(NAICS_SECTORS)]
+        df = df.assign(state=state_codes(df[0]).values)
+        wide = {}
+        for col, measure in self.measures.items():
+            values = df.assign(value=to_number(df[col]).values) \
+                .pivot(index='state', columns=1, values='value')
+            for naics in NAICS_SECTORS:
+                wide['{}_{}'.format(measure, naics)] = \
+                    values[naics] if naics in values else np.nan
+        return pd.DataFrame(wide)
+
+
+@register
+class ASFINCovariate(Covariate):
+    """
+    Annual Survey of State Government Finances, 2018, in thousands of
+    dollars (state).
+    """
+    name = 'ASFIN'
+    category = 'economy'
+    fnames = ['ASFIN_2018.xlsx']
+    items = {'Total revenue': 'revenue_total',
+             'General revenue': 'revenue_general',
+             'Intergovernmental revenue': 'revenue_intergovernmental',
+             'Taxes': 'taxes',
+             'Total expenditure': 'expenditure_total',
+             'Education': 'expenditure_education',
+             'Public welfare': 'expenditure_public_welfare',
+             'Hospitals': 'expenditure_hospitals',
+             'Health': 'expenditure_health',
+             'Debt at end of fiscal year': 'debt',
+             'Cash and security holdings': 'cash_holdings'}
+    schema = {col: 'float64' for col in items.values()}
+
+    def read_raw(self):
+        df = pd.read_excel(self.fpaths_raw[0], header=None, dtype=str)
+        states = state_codes(df.iloc[0, 1:]).values
+        df = df.iloc[1:].dropna(subset=[0])
+        df[0] = df[0].str.strip()
+        # some items are listed twice (e.g. total expenditure)
+        df = df[df[0].isin(self.items)].drop_duplicates(subset=[0])
+        values = df.set_index(0).iloc[:, :len(states)].apply(to_number)
+        values.columns = states
+        return values.transpose().rename(columns=self.items)
+
+
+@register
+class COGCovariate(Covariate):
+    """
+    Census of Governments, 2017: state and local government finances
+    combined, in thousands of dollars (state).
+    """
+    name = 'COG'
+    category = 'health'
+    fnames = ['COG_2017_17slsstab1a.xlsx', 'COG_2017_17slsstab1b.xlsx']
+    # line number of the item in the tables
+    lines = {1: 'revenue_total', 2: 'revenue_general', 8: 'taxes',
+             54: 'expenditure_total', 69: 'expenditure_education',
+             77: 'expenditure_public_welfare', 81: 'expenditure_hospitals',
+             83: 'expenditure_health', 125: 'debt'}
+    schema = {col: 'float64' for col in lines.values()}
+
+    def read_raw(self):
+        frames = []
+        for fpath in self.fpaths_raw:
+            df = pd.read_excel(fpath, header=None, dtype=str)
+            # state names span their three columns (state & local, state,
+            # local)
+            states = df.iloc[7].ffill()
+            level = df.iloc[8].str.strip()
+            cols = [c for c in df.columns[2:] if level[c] == 'State & local']
+            lines = pd.to_numeric(df[0], errors='coerce')
+            rows = lines.isin(list(self.lines))
+            values = df.loc[rows, cols].apply(to_number)
+            values.index = lines[rows].astype(int).map(self.lines)
+            values.columns = state_codes(states[cols]).values
+            frames.append(values.transpose())
+        return pd.concat(frames)
+
+
+@register
+class HCUPCovariate(Covariate):
+    """
+    HCUP State Inpatient Databases, 2016: discharges, mean age, aggregate
+    charges and costs, and payer shares of discharges (state).
+    """
+    name = 'HCUP'
+    category = 'health'
+    fnames = ['HCUP_2016.csv']
+    payers = {'Medicare': 'share_medicare', 'Medicaid': 'share_medicaid',
+              'Private insurance': 'share_private',
+              'Uninsured': 'share_uninsured'}
+    schema = dict({'discharges': 'float64', 'age_mean': 'float64',
+                   'charges': 'float64', 'costs': 'float64'},
+                  **{col: 'float64' for col in payers.values()})
+
+    def read_raw(self):
+        # one block per state, starting with a "<year>  <state>" line; the
+        # group (e.g. "Payer") is only named on its first row
+        block_re = re.compile(r'^\d{4}\s+(.+)$')
+        records = {}
+        record, group = None, None
+        with open(self.fpaths_raw[0], 'r', encoding="ISO-8859-1") as f:
+            for row in csv.reader(f):
+                match = block_re.match(row[0].strip()) if row else None
+                if match:
+                    record = records.setdefault(match.group(1).strip(), {})
+                    continue
+                if record is None or len(row) < 7:
+                    continue
+                group = row[0] or group
+                if group == 'All discharges':
+                    values = to_number(row[2:7]).values
+                    record.update(discharges=values[0], age_mean=values[2],
+                                  charges=values[3], costs=values[4])
+                elif group == 'Payer' and row[1] in self.payers:
+                    record[self.payers[row[1]]] = \
+                        to_number([row[3]]).values[0] / 100.
+        df = pd.DataFrame.from_dict(records, orient='index')
+        df.index = state_codes(df.index).values
+        return df
+
+
+class KFFCovariate(Covariate):
+    """
+    Basic class of the Kaiser Family Foundation state tables: a "Location"
+    column and one column per indicator (state).
+    """
+    category = 'health'
+    columns = {}
+
+    def read_raw(self):
+        df = pd.read_csv(self.fpaths_raw[0], dtype=str, skip_blank_lines=True)
+        df = df.dropna(subset=['Location'])
+        df.index = state_codes(df['Location']).values
+        df = df[df.index.notnull()]
+        return df[list(self.columns)].apply(to_number) \
+            .rename(columns=self.columns)
+
+
+@register
+class KFFBedsCovariate(KFFCovariate):
+    """
+    Hospital beds per 1,000 population by ownership type.
+    """
+    name = 'KFF_BEDS'
+    fnames = ['health_beds_raw.csv']
+    columns = {'State/Local Government': 'beds_public',
+               'Non-Profit': 'beds_nonprofit',
+               'For-Profit': 'beds_forprofit',
+               'Total': 'beds_total'}
+    schema = {col: 'float64' for col in columns.values()}
+
+
+@register
+class KFFExpendCovariate(KFFCovariate):
+    """
+    Total health care expenditures in millions of dollars.
+    """
+    name = 'KFF_EXPEND'
+    fnames = ['health_expend_raw.csv']
+    columns = {'Total Health Spending': 'health_spending'}
+    schema = {col: 'float64' for col in columns.values()}
+
+
+@register
+class KFFInsureCovariate(KFFCovariate):
+    """
+    Health insurance coverage of the total population (shares).
+    """
+    name = 'KFF_INSURE'
+    fnames = ['health_insure_raw.csv']
+    columns = {'Employer': 'insured_employer',
+               'Non-Group': 'insured_nongroup',
+               'Medicaid': 'insured_medicaid',
+               'Medicare': 'insured_medicare',
+               'Military': 'insured_military',
+               'Uninsured': 'uninsured'}
+    schema = {col: 'float64' for col in columns.values()}
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    print(ingest())
@@ -0,0 +1,274 @@
+"""
+Compact, memory-mapped cube of the CSSE time series.
+
+The cube stores each variable of the xr.Dataset written by
+CSSETransformer.processed2ds/raw2ds as one contiguous int32 array with dims
+(time, county) in a .npy file. Arrays are opened with np.load(mmap_mode='r'),
+so any number of worker processes share the same pages of the OS page cache
+instead of each holding its own copy of the data.
+
+Counties are ordered by state, so every state is a contiguous column range
+and selecting a state (and a date range) returns a view, not a copy.
+"""
+import os
+import logging
+import numpy as np
+import pandas as pd
+from src.data.structure import CSSE
+from src.data.reader import CSSEReader
+from src.utils.profiling import count
+
+# state of the entities without one, see state_fips
+NO_STATE = -1
+
+
+def state_fips(county):
+    """
+    State FIPS codes of clean county FIPS codes.
+
+    CSSE codes state level entities with two digits (e.g. 60 for American
+    Samoa), 'Out of <state>' as 800SS and 'Unassigned' as 900SS. The other
+    entities from 80000 on belong to no state (88888 and 99999 for the
+    Diamond and Grand Princess cruise ships) and get NO_STATE, rather than
+    forming fake states of their own, e.g. as state clusters. 7xxxx
+    entities keep their leading two digits.
+
+    Parameters
+    ----------
+    county : array_like of int
+        County FIPS codes.
+
+    Returns
+    -------
+    np.ndarray
+        State FIPS codes.
+    """
+    county = np.asarray(county, dtype=np.int64)
+    state = county // 1000
+    state = np.where(county < 100, county, state)
+    special = (county % 1000 < 100) & ((state == 80) | (state == 90))
+    state = np.where(special, county % 100, state)
+    return np.where((county >= 80000) & ~special, NO_STATE, state)
+
+
+class CSSECube(CSSE):
+    """
+    Memory-mapped (time, county) arrays of the CSSE variables with FIPS and
+    state indexes. Use build() once after each transformation, then open()
+    in any number of processes.
+    """
+    variables = ['confirmed', 'deaths']
+
+    def __init__(self, dirname):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "csse".
+        """
+        CSSE.__init__(self, dirname)
+        self.dirname = dirname
+        self.cube_dir = os.path.join(self.processed_dir_csse, "US", "cube")
+
+        self.arrays = {}
+        self.time = None
+        self.county = None
+        self.state = None
+        self.state_ranges = None
+        self._fips_sorted = None
+        self._fips_column = None
+
+    def build(self, ds=None, dtype=np.int32):
+        """
+        Write the cube from the xr.Dataset of processed2ds.
+
+        Parameters
+        ----------
+        ds : xr.Dataset, optional
+            Dataset with dims ['time', 'county']. Read with
+            CSSEReader.read_processed2ds if not given.
+        dtype : np.dtype
+            Integer type of the stored arrays. Must hold all values.
+
+        Returns
+        -------
+        self
+        """
+        logger = logging.getLogger(__name__)
+        logger.info('Building CSSE cube in {}.'.format(self.cube_dir))
+
+        if ds is None:
+            ds = CSSEReader(self.dirname).read_processed2ds()
+        if not os.path.exists(self.cube_dir):
+            os.makedirs(self.cube_dir)
+
+        # order counties by state, then FIPS code
+        county = ds['county'].values.astype(np.int64)
+        state = state_fips(county)
+        order = np.lexsort((county, state))
+        county, state = county[order], state[order]
+
+        # index: FIPS -> column (sorted FIPS codes and their columns)
+        fips_column = np.argsort(county)
+        fips_sorted = county[fips_column]
+
+        # index: state -> column range [start, stop)
+        states, starts = np.unique(state, return_index=True)
+        stops = np.append(starts[1:], len(state))
+        state_ranges = np.column_stack([states, starts, stops])
+
+        index = {'time': ds['time'].values.astype('datetime64[D]'),
+                 'county': county,
+                 'state': state,
+                 'state_ranges': state_ranges,
+                 'fips_sorted': fips_sorted,
+                 'fips_column': fips_column}
+        for name, values in index.items():
+            self._save(name, values)
+
+        info = np.iinfo(dtype)
+        for var in self.variables:
+            values = np.asarray(ds[var].values)[:, order]
+            if values.size and (values.min() < info.min or
+                                values.max() > info.max):
+                raise ValueError("Values of {} do not fit into {}.".format(
+                    var, np.dtype(dtype).name))
+            self._save(var, np.ascontiguousarray(values, dtype=dtype))
+        return self
+
+    def open(self):
+        """
+        Memory-map the cube read-only.
+
+        Returns
+        -------
+        self
+        """
+        def load(name):
+            return np.load(os.path.join(self.cube_dir, name + '.npy'),
+                           mmap_mode='r')
+
+        self.arrays = {var: load(var) for var in self.variables}
+        self.time = load('time')
+        self.county = load('county')
+        self.state = load('state')
+        self.state_ranges = load('state_ranges')
+        self._fips_sorted = load('fips_sorted')
+        self._fips_column = load('fips_column')
+        return self
+
+    def _save(self, name, values):
+        """
+        Atomically write an array. Processes that still map the previous
+        file keep a valid (old) view.
+        """
+        fpath = os.path.join(self.cube_dir, name + '.npy')
+        with open(fpath + '.tmp', 'wb') as f:
+            np.save(f, values)
+        os.replace(fpath + '.tmp', fpath)
+        count(bytes_out=os.path.getsize(fpath))
+
+    def __getitem__(self, variable):
+        return self.arrays[variable]
+
+    def columns(self, counties):
+        """
+        Vectorized FIPS -> column lookup.
+
+        Parameters
+        ----------
+        counties : array_like of int
+            County FIPS codes.
+
+        Returns
+        -------
+        np.ndarray
+            Column of each county.
+        """
+        counties = np.asarray(counties, dtype=np.int64)
+        pos = np.searchsorted(self._fips_sorted, counties)
+        pos = np.minimum(pos, len(self._fips_sorted) - 1)
+        missing = self._fips_sorted[pos] != counties
+        if missing.any():
+            raise KeyError("Unknown FIPS codes: {}".format(
+                counties[missing].tolist()))
+        return np.asarray(self._fips_column[pos])
+
+    def state_slice(self, state):
+        """
+        Column range of a state.
+
+        Parameters
+        ----------
+        state : int
+            State FIPS code, e.g. 36 for New York.
+
+        Returns
+        -------
+        slice
+        """
+        row = np.searchsorted(self.state_ranges[:, 0], state)
+        if row == len(self.state_ranges) or \
+                self.state_ranges[row, 0] != state:
+            raise KeyError("Unknown state FIPS code: {}".format(state))
+        return slice(int(self.state_ranges[row, 1]),
+                     int(self.state_ranges[row, 2]))
+
+    def time_slice(self, start=None, end=None):
+        """
+        Row range of the dates between start and end (inclusive).
+
+        Returns
+        -------
+        slice
+        """
+        lo = 0 if start is None else np.searchsorted(
+            self.time, np.datetime64(pd.Timestamp(start), 'D'), side='left')
+        hi = len(self.time) if end is None else np.searchsorted(
+            self.time, np.datetime64(pd.Timestamp(end), 'D'), side='right')
+        return slice(int(lo), int(hi))
+
+    def sel(self, variable, counties=None, state=None, start=None, end=None):
+        """
+        Select a variable by counties or state and a date range.
+
+        Selecting by state and/or dates returns a read-only view of the
+        memory map. Selecting a list of counties copies these columns.
+
+        Parameters
+        ----------
+        variable : str
+            One of 'confirmed', 'deaths'
+        counties : list of int, optional
+            County FIPS codes.
+        state : int, optional
+            State FIPS code.
+        start, end : str or pd.Timestamp, optional
+            First and last date.
+
+        Returns
+        -------
+        values : np.ndarray
+            Values with dims (time, county).
+        time : np.ndarray
+            Dates of the rows.
+        county : np.ndarray
+            FIPS codes of the columns.
+        """
+        rows = self.time_slice(start, end)
+        if counties is not None:
+            cols = self.columns(counties)
+        elif state is not None:
+            cols = self.state_slice(state)
+        else:
+            cols = slice(None)
+        values = self.arrays[variable][rows, cols]
+        return values, self.time[rows], self.county[cols]
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    cube = CSSECube(dirname='csse').build().open()
+    print(cube.sel('confirmed', state=36, start='2020-04-01')[0])
@@ -1,11 +1,75 @@
+import io
 import os
+import json
+import hashlib
 import logging
+import urllib.error
+import urllib.request
+import numpy as np
 import pandas as pd
 from src.data.structure import Downloader, CSSE
+from src.data.reader import date_columns, read_long, write_long
+from src.utils.profiling import count
+
+# columns that identify a county (row) in the raw CSSE files
+KEY_COLS = ['UID', 'FIPS']
+
+
+def conditional_get(url, etag=None, last_modified=None, timeout=60):
+    """
+    Send a conditional HTTP GET request.
+
+    Parameters
+    ----------
+    url : str
+        Resource location. Anything urllib can open, e.g. http:// or file://.
+    etag : str, optional
+        ETag of the last response, sent as If-None-Match.
+    last_modified : str, optional
+        Last-Modified of the last response, sent as If-Modified-Since.
+    timeout : int
+        Timeout in seconds.
+
+    Returns
+    -------
+    status : int
+        200 if the resource was (re-)downloaded, 304 if it is unchanged.
+    body : bytes or None
+        Response body. None if the resource is unchanged.
+    validators : dict
+        Keys 'etag' and 'last_modified' of the current resource.
+    """
+    request = urllib.request.Request(url)
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        return 304, None, {'etag': etag, 'last_modified': last_modified}
+
+    validators = {'etag': headers.get('ETag'),
+                  'last_modified': headers.get('Last-Modified')}
+    return 200, body, validators
 
 
 class CSSEDownloader(CSSE, Downloader):
-    def __init__(self, dirname):
+    def __init__(self, dirname, web_dir=None):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "csse".
+        web_dir : str, optional
+            Overrides the location of the CSSE time series, e.g. to point to
+            a mirror or a local test server.
+        """
         CSSE.__init__(self, dirname)
         Downloader.__init__(self)
 
@@ -17,6 +81,15 @@ class CSSEDownloader(CSSE, Downloader):
             "master",
             "csse_covid_19_data",
             "csse_covid_19_time_series")
+        if web_dir is not None:
+            self.web_dir = web_dir
+
+        self.fnames_raw = {'confirmed': self.fname_confirmed_raw,
+                           'deaths': self.fname_deaths_raw}
+        self.fnames_processed = {'confirmed': self.fname_confirmed_processed,
+                                 'deaths': self.fname_deaths_processed}
+        self.fpath_manifest = os.path.join(self.raw_dir_csse,
+                                           self.fname_manifest)
 
     def fetch_data(self):
         """
@@ -36,21 +109,192 @@ class CSSEDownloader(CSSE, Downloader):
         data['deaths'] = pd.read_csv(self.path_deaths)
         return data
 
-    def save_data(self):
+    def read_manifest(self):
+        """
+        Read the download manifest.
+
+        Returns
+        -------
+        dict
+            Per variable: url, etag, last_modified, last_date, n_rows and
+            keys_digest of the last download. Empty if there is none yet.
+        """
+        if not os.path.exists(self.fpath_manifest):
+            return {}
+        with open(self.fpath_manifest, 'r') as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        """
+        Write the download manifest.
+
+        Parameters
+        ----------
+        manifest : dict
+            See read_manifest.
+        """
+        tmp = self.fpath_manifest + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.fpath_manifest)
+
+    def save_data(self, incremental=False):
         """
         Save CSSE data to ../raw
+
+        In incremental mode, conditional requests are sent based on the
+        manifest of the last download. Unchanged files are skipped entirely.
+        For changed files, only the dates after the last ingested date are
+        parsed and appended to the processed time series. Revisions of
+        already ingested dates are not picked up; run a full download for
+        that.
+
+        Parameters
+        ----------
+        incremental : bool
+            If True, update the raw and processed data incrementally.
+
+        Returns
+        -------
+        updated : dict
+            Per variable, the list of appended dates. None means the
+            processed files are outdated and have to be rebuilt.
         """
         logger = logging.getLogger(__name__)
         logger.info('Downloading latest CSSE raw data.')
 
-        # fetch latest data from github repository
-        data = self.fetch_data()
+        manifest = self.read_manifest() if incremental else {}
+
+        updated = {}
+        for category, fname in self.fnames_raw.items():
+            url = os.path.join(self.web_dir, fname)
+            entry = manifest.get(category, {})
+            if entry.get('url') != url:
+                entry = {}
+
+            status, body, validators = conditional_get(
+                url, entry.get('etag'), entry.get('last_modified'))
+            if status == 304:
+                logger.info('CSSE {} data not modified.'.format(category))
+                updated[category] = []
+                continue
+
+            # parse only the key columns and the dates not ingested yet
+            header = pd.read_csv(io.BytesIO(body), nrows=0).columns
+            dates = date_columns(header)
+            if entry:
+                new_dates = dates[dates > pd.Timestamp(entry['last_date'])]
+            else:
+                new_dates = dates.iloc[:0]
+            df = pd.read_csv(io.BytesIO(body),
+                             usecols=KEY_COLS + list(new_dates.index))
+            keys_digest = hashlib.sha1(pd.util.hash_pandas_object(
+                df[KEY_COLS], index=False).values).hexdigest()
+
+            if entry and entry['keys_digest'] == keys_digest:
+                updated[category] = self._append_processed(
+                    category, df, new_dates)
+            else:
+                updated[category] = None
+
+            self._write_raw(fname, body)
+            manifest[category] = {
+                'url': url,
+                'etag': validators['etag'],
+                'last_modified': validators['last_modified'],
+                'last_date': dates.iloc[-1].strftime('%Y-%m-%d'),
+                'n_rows': len(df),
+                'keys_digest': keys_digest}
+            logger.info('CSSE {} data: {} new dates.'.format(
+                category, 'all' if updated[category] is None
+                else len(updated[category])))
+
+        self.write_manifest(manifest)
+        return updated
+
+    def _write_raw(self, fname, body):
+        """
+        Atomically write a downloaded file to ../raw as is.
+        """
+        fdir = os.path.join(self.raw_dir_csse, 'US')
+        if not os.path.exists(fdir):
+            os.makedirs(fdir)
+        fpath = os.path.join(fdir, fname)
+        with open(fpath + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(fpath + '.tmp', fpath)
+        count(bytes_out=len(body))
+
+    def _append_processed(self, category, df, new_dates):
+        """
+        Append new dates as rows to the processed time series, the csv file
+        and, if it exists, the Parquet file of the parquet backend.
+
+        Parameters
+        ----------
+        category : str
+            One of 'confirmed', 'deaths'
+        df : pd.DataFrame
+            Key columns and new date columns of the raw file.
+        new_dates : pd.Series
+            Dates (values) of the new date columns (index).
+
+        Returns
+        -------
+        list or None
+            Appended dates. None if there is no processed csv file to append
+            to. The Parquet file is then removed, since it is not rebuilt
+            along with the csv file and would keep the old dates.
+        """
+        fpath = os.path.join(self.processed_dir_csse, "US",
+                             self.fnames_processed[category])
+        fpath_parquet = os.path.splitext(fpath)[0] + '.parquet'
+        if not os.path.exists(fpath):
+            if os.path.exists(fpath_parquet):
+                os.remove(fpath_parquet)
+            return None
+        if new_dates.empty:
+            return []
+
+        ts_new = (df.set_index('FIPS')[list(new_dates.index)]
+                  .transpose()
+                  .astype('Int64'))
+        ts_new.index = pd.DatetimeIndex(new_dates.values)
+        size = os.path.getsize(fpath)
+        ts_new.to_csv(fpath, mode='a', header=False)
+        bytes_out = os.path.getsize(fpath) - size
+        if os.path.exists(fpath_parquet):
+            bytes_out += self._append_parquet(fpath_parquet, ts_new)
+        count(rows_out=len(ts_new), bytes_out=bytes_out)
+        return list(ts_new.index)
 
-        # iterate over dictionary of data frames and save to csv
-        for category in data.keys():
-            fname = "time_series_covid19_{type}_US.csv".format(type=category)
-            data[category].to_csv(os.path.join(self.raw_dir_csse, 'US', fname))
-        return None
+    @staticmethod
+    def _append_parquet(fpath, ts_new):
+        """
+        Append new dates to a time series written by write_long. The file
+        is sorted by county and time, so it is rewritten as a whole.
+
+        Parameters
+        ----------
+        fpath : str
+            Path to the Parquet file.
+        ts_new : pd.DataFrame
+            New dates (rows) of all counties (columns), in the order of the
+            raw file, which is the order the Parquet file keeps.
+
+        Returns
+        -------
+        int
+            Number of bytes written.
+        """
+        ts = read_long(fpath)
+        ts_new = pd.DataFrame(ts_new.values.astype(np.int32),
+                              index=ts_new.index.rename(ts.index.name),
+                              columns=ts.columns)
+        ts = pd.concat([ts, ts_new])
+        ts.columns = ts.columns.astype(np.int64)
+        write_long(ts, fpath)
+        return os.path.getsize(fpath)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+"""
+Vectorized resolution of (state, county name) pairs to county FIPS codes.
+
+The index maps normalized names to FIPS codes. Names are normalized by
+lower-casing, removing accents, punctuation and white space, spelling out
+"saint", and dropping the type of the county ("County", "Parish",
+"Borough", "Census Area", ...). Independent cities keep "city", because
+e.g. Baltimore city and Baltimore County are different counties. Hence
+"Anchorage Borough", "Anchorage Municipality" and "anchorage" all resolve
+to 2020, and "De Kalb" to the DeKalb counties.
+
+The county table is built from the POPEST county estimates and the
+municipios of Puerto Rico (not part of POPEST), once, and cached on disk
+and per process. Whole columns are resolved at once: each distinct
+(state, county) pair is normalized and looked up once, and the rows that
+could not be matched are reported.
+"""
+import os
+import re
+import logging
+import unicodedata
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from src.data.structure import POPEST
+from src.data.reader import POPESTReader
+
+# (name, postal code, FIPS code) of the states, DC and territories
+STATES = [
+    ('Alabama', 'AL', 1), ('Alaska', 'AK', 2), ('Arizona', 'AZ', 4),
+    ('Arkansas', 'AR', 5), ('California', 'CA', 6), ('Colorado', 'CO', 8),
+    ('Connecticut', 'CT', 9), ('Delaware', 'DE', 10),
+    ('District of Columbia', 'DC', 11), ('Florida', 'FL', 12),
+    ('Georgia', 'GA', 13), ('Hawaii', 'HI', 15), ('Idaho', 'ID', 16),
+    ('Illinois', 'IL', 17), ('Indiana', 'IN', 18), ('Iowa', 'IA', 19),
+    ('Kansas', 'KS', 20), ('Kentucky', 'KY', 21), ('Louisiana', 'LA', 22),
+    ('Maine', 'ME', 23), ('Maryland', 'MD', 24),
+    ('Massachusetts', 'MA', 25), ('Michigan', 'MI', 26),
+    ('Minnesota', 'MN', 27), ('Mississippi', 'MS', 28),
+    ('Missouri', 'MO', 29), ('Montana', 'MT', 30), ('Nebraska', 'NE', 31),
+    ('Nevada', 'NV', 32), ('New Hampshire', 'NH', 33),
+    ('New Jersey', 'NJ', 34), ('New Mexico', 'NM', 35),
+    ('New York', 'NY', 36), ('North Carolina', 'NC', 37),
+    ('North Dakota', 'ND', 38), ('Ohio', 'OH', 39), ('Oklahoma', 'OK', 40),
+    ('Oregon', 'OR', 41), ('Pennsylvania', 'PA', 42),
+    ('Rhode Island', 'RI', 44), ('South Carolina', 'SC', 45),
+    ('South Dakota', 'SD', 46), ('Tennessee', 'TN', 47),
+    ('Texas', 'TX', 48), ('Utah', 'UT', 49), ('Vermont', 'VT', 50),
+    ('Virginia', 'VA', 51), ('Washington', 'WA', 53),
+    ('West Virginia', 'WV', 54), ('Wisconsin', 'WI', 55),
+    ('Wyoming', 'WY', 56), ('American Samoa', 'AS', 60), ('Guam', 'GU', 66),
+    ('Northern Mariana Islands', 'MP', 69), ('Puerto Rico', 'PR', 72),
+    ('Virgin Islands', 'VI', 78)]
+
+# municipios (county equivalents) of Puerto Rico, which the POPEST county
+# estimates do not cover
+PR_MUNICIPIOS = {
+    72001: 'Adjuntas', 72003: 'Aguada', 72005: 'Aguadilla',
+    72007: 'Aguas Buenas', 72009: 'Aibonito', 72011: 'Añasco',
+    72013: 'Arecibo', 72015: 'Arroyo', 72017: 'Barceloneta',
+    72019: 'Barranquitas', 72021: 'Bayamón', 72023: 'Cabo Rojo',
+    72025: 'Caguas', 72027: 'Camuy', 72029: 'Canóvanas', 72031: 'Carolina',
+    72033: 'Cataño', 72035: 'Cayey', 72037: 'Ceiba', 72039: 'Ciales',
+    72041: 'Cidra', 72043: 'Coamo', 72045: 'Comerío', 72047: 'Corozal',
+    72049: 'Culebra', 72051: 'Dorado', 72053: 'Fajardo', 72054: 'Florida',
+    72055: 'Guánica', 72057: 'Guayama', 72059: 'Guayanilla', 72061: 'Guaynabo',
+    72063: 'Gurabo', 72065: 'Hatillo', 72067: 'Hormigueros', 72069: 'Humacao',
+    72071: 'Isabela', 72073: 'Jayuya', 72075: 'Juana Díaz', 72077: 'Juncos',
+    72079: 'Lajas', 72081: 'Lares', 72083: 'Las Marías', 72085: 'Las Piedras',
+    72087: 'Loíza', 72089: 'Luquillo', 72091: 'Manatí', 72093: 'Maricao',
+    72095: 'Maunabo', 72097: 'Mayagüez', 72099: 'Moca', 72101: 'Morovis',
+    72103: 'Naguabo', 72105: 'Naranjito', 72107: 'Orocovis', 72109: 'Patillas',
+    72111: 'Peñuelas', 72113: 'Ponce', 72115: 'Quebradillas', 72117: 'Rincón',
+    72119: 'Río Grande', 72121: 'Sabana Grande', 72123: 'Salinas',
+    72125: 'San Germán', 72127: 'San Juan', 72129: 'San Lorenzo',
+    72131: 'San Sebastián', 72133: 'Santa Isabel', 72135: 'Toa Alta',
+    72137: 'Toa Baja', 72139: 'Trujillo Alto', 72141: 'Utuado',
+    72143: 'Vega Alta', 72145: 'Vega Baja', 72147: 'Vieques',
+    72149: 'Villalba', 72151: 'Yabucoa', 72153: 'Yauco'}
+
+# county types, dropped from the end of county names
+SUFFIXES = ['city and borough', 'census area', 'municipality', 'municipio',
+            'borough', 'county', 'parish']
+
+# former names of renamed or merged counties: (state, normalized name)
+ALIASES = {(46, 'shannon'): 46102,      # renamed Oglala Lakota in 2015
+           (2, 'wadehampton'): 2158,    # renamed Kusilvak in 2015
+           (51, 'bedfordcity'): 51019}  # merged into Bedford County in 2013
+
+_SUFFIX_RE = re.compile(r'\s+(?:{})$'.format('|'.join(SUFFIXES)))
+_SAINT_RE = re.compile(r'\bsainte?\b')
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]')
+
+
+def normalize_name(name):
+    """
+    Normalized county or state name, see the module docstring.
+
+    Parameters
+    ----------
+    name : str
+
+    Returns
+    -------
+    str
+    """
+    name = unicodedata.normalize('NFKD', str(name))
+    name = name.encode('ascii', 'ignore').decode('ascii').lower().strip()
+    name = name.replace('&', ' and ')
+    name = _SAINT_RE.sub(lambda m: 'ste' if m.group() == 'sainte' else 'st',
+                         name)
+    name = _SUFFIX_RE.sub('', name)
+    return _NON_ALNUM_RE.sub('', name)
+
+
+def _state_lookup():
+    """
+    Normalized state name, postal code and FIPS code -> state FIPS code.
+    """
+    lookup = {}
+    for name, code, fips in STATES:
+        lookup[normalize_name(name)] = fips
+        lookup[code.lower()] = fips
+        lookup[str(fips)] = fips
+        lookup['{:02d}'.format(fips)] = fips
+    return lookup
+
+
+STATE_LOOKUP = _state_lookup()
+
+
+class FIPSIndex(POPEST):
+    """
+    Hash index of (state FIPS, normalized county name) -> county FIPS.
+
+    Covers the counties of the POPEST estimates (states and DC) plus the
+    municipios of Puerto Rico. Counties of the other territories are not
+    indexed and are reported as unmatched.
+    """
+    def __init__(self, dirname="demography"):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the sub directory of "data/raw" with the POPEST data.
+        """
+        POPEST.__init__(self, dirname)
+        self.fpath_cache = os.path.join(self.project_dir, "data/interim",
+                                        "fips_index.parquet")
+        self.index = None
+        self.fips = None
+
+    def build(self):
+        """
+        Build the county table from the POPEST county estimates and the
+        municipios of Puerto Rico.
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns state, key (normalized county name), fips and name.
+        """
+        df = POPESTReader(self.dirname).read_raw()
+        df = df.loc[df['SUMLEV'] == 50, ['STATE', 'COUNTY', 'CTYNAME']]
+        table = pd.DataFrame({
+            'state': df['STATE'].astype(np.int64).values,
+            'key': df['CTYNAME'].map(normalize_name).values,
+            'fips': (df['STATE'] * 1000 + df['COUNTY']).astype(np.int64)
+            .values,
+            'name': df['CTYNAME'].values})
+        known = set(table['fips'])
+        municipios = pd.DataFrame(
+            [(72, normalize_name(name), fips, name + ' Municipio')
+             for fips, name in PR_MUNICIPIOS.items() if fips not in known],
+            columns=table.columns)
+        aliases = pd.DataFrame(
+            [(state, key, fips, key) for (state, key), fips in
+             ALIASES.items()], columns=table.columns)
+        table = pd.concat([table, municipios, aliases], ignore_index=True)
+
+        duplicated = table.duplicated(['state', 'key'], keep=False)
+        if duplicated.any():
+            raise ValueError("Ambiguous county names: {}".format(
+                table.loc[duplicated, 'name'].tolist()))
+        return table
+
+    def load(self):
+        """
+        Load the index, building it (and writing the disk cache) if the
+        cache is missing or older than the POPEST file or this module.
+
+        Returns
+        -------
+        self
+        """
+        fpath_raw = os.path.join(self.raw_dir_popest, self.fname_raw)
+        if os.path.exists(self.fpath_cache) and \
+                os.path.getmtime(self.fpath_cache) >= \
+                max(os.path.getmtime(fpath_raw), os.path.getmtime(__file__)):
+            table = pd.read_parquet(self.fpath_cache, engine='pyarrow')
+        else:
+            table = self.build()
+            if not os.path.exists(os.path.dirname(self.fpath_cache)):
+                os.makedirs(os.path.dirname(self.fpath_cache))
+            table.to_parquet(self.fpath_cache + '.tmp', engine='pyarrow',
+                             index=False)
+            os.replace(self.fpath_cache + '.tmp', self.fpath_cache)
+
+        self.index = pd.MultiIndex.from_arrays([table['state'],
+                                                table['key']])
+        self.fips = table['fips'].values
+        return self
+
+    def state_fips(self, states):
+        """
+        Resolve state names, postal codes or FIPS codes.
+
+        Parameters
+        ----------
+        states : array_like
+            State identifiers.
+
+        Returns
+        -------
+        pd.Series
+            State FIPS codes (Int64), missing where unknown.
+        """
+        states = pd.Series(states)
+        codes, uniques = pd.factorize(states)
+        resolved = np.array([STATE_LOOKUP.get(normalize_name(s), -1)
+                             for s in uniques], dtype=np.int64)
+        values = np.where(codes >= 0, resolved[codes], -1) \
+            if len(uniques) else np.full(len(codes), -1)
+        return pd.Series(values, index=states.index, name='state') \
+            .astype('Int64').where(values >= 0)
+
+    def resolve(self, states, counties):
+        """
+        Resolve (state, county name) pairs to county FIPS codes.
+
+        Parameters
+        ----------
+        states : array_like
+            State names, postal codes or FIPS codes.
+        counties : array_like
+            County names, e.g. "Anchorage Borough" or "Doña Ana".
+
+        Returns
+        -------
+        fips : pd.Series
+            County FIPS codes (Int64), missing where there is no match.
+        unmatched : pd.DataFrame
+            Distinct unmatched (state, county) pairs with their number of
+            rows.
+        """
+        if self.index is None:
+            self.load()
+        logger = logging.getLogger(__name__)
+        states = pd.Series(states).reset_index(drop=True)
+        counties = pd.Series(counties).reset_index(drop=True)
+
+        pairs = pd.DataFrame({'state': states.astype(str),
+                              'county': counties.astype(str)})
+        codes = pairs.groupby(['state', 'county'], sort=False).ngroup() \
+            .values
+        uniques = pairs.drop_duplicates().reset_index(drop=True)
+
+        state = self.state_fips(uniques['state']).fillna(-1).astype(np.int64)
+        key = uniques['county'].map(normalize_name)
+        pos = self.index.get_indexer(
+            pd.MultiIndex.from_arrays([state.values, key.values]))
+        resolved = np.where(pos >= 0, self.fips[pos], -1)
+        values = resolved[codes]
+
+        fips = pd.Series(values, name='FIPS').astype('Int64') \
+            .where(values >= 0)
+        uniques['n_rows'] = np.bincount(codes, minlength=len(uniques))
+        unmatched = uniques[resolved < 0].reset_index(drop=True)
+        if len(unmatched):
+            logger.warning('{} rows ({} distinct counties) without FIPS '
+                           'code.'.format(unmatched['n_rows'].sum(),
+                                          len(unmatched)))
+        return fips, unmatched
+
+    def resolve_frame(self, df, state_col='state', county_col='county',
+                      column='FIPS'):
+        """
+        Add a county FIPS column to a data frame.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Data frame with state and county name columns.
+        state_col, county_col : str
+            Names of the state and county columns.
+        column : str
+            Name of the new FIPS column.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Copy of df with the FIPS column.
+        unmatched : pd.DataFrame
+            See resolve.
+        """
+        fips, unmatched = self.resolve(df[state_col], df[county_col])
+        df = df.copy()
+        df[column] = fips.values
+        return df, unmatched
+
+
+@lru_cache(maxsize=None)
+def get_index(dirname="demography"):
+    """
+    FIPS index, loaded once per process.
+    """
+    return FIPSIndex(dirname).load()
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    fips, unmatched = get_index().resolve(
+        ['Alaska', 'NM', 'Maryland', 'Maryland'],
+        ['Anchorage Borough', 'Dona Ana County', 'Baltimore city',
+         'Baltimore County'])
+    print(fips.tolist())
+    print(unmatched)
@@ -0,0 +1,418 @@
+"""
+Store of the manually coded policy interventions of the states.
+
+Interventions are coded by hand in data/raw/policy/interventions.csv, one
+row per intervention:
+
+    state,type,start,end,stringency
+    New York,stay_at_home,2020-03-22,2020-06-08,1
+    CA,school_closure,2020-03-19,,0.5
+
+state is a state name, postal code or FIPS code, type one of TYPES, start
+and end the first and last day (inclusive) the intervention was in force,
+end empty if it still is, and stringency a number between 0 and 1.
+InterventionTransformer.raw2processed validates and types the table and
+writes it to data/processed/policy/interventions.parquet.
+
+InterventionIndex answers "which interventions were in force in state S on
+day t" for whole arrays of states and days in one call. The (state, day)
+axis is cut into elementary intervals at the start and end of every
+intervention, so the set of interventions in force is constant within an
+interval. Queries are located with one np.searchsorted on the sorted
+interval bounds and the interventions of every interval are the rows of a
+sparse (interval, intervention) matrix, instead of comparing every query
+with every intervention. Treatment arrays with dims (time, county), e.g. of
+the CSSE dataset, are computed per state and day and broadcast to the
+counties of each state.
+"""
+import os
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.data.structure import Policy, Reader, Transformer
+from src.data.fips import FIPSIndex
+
+# types of interventions
+TYPES = ['state_of_emergency', 'stay_at_home', 'school_closure',
+         'business_closure', 'gathering_ban', 'mask_mandate',
+         'travel_restriction', 'testing', 'health_investment']
+
+# columns and dtypes of the processed table
+SCHEMA = {'state': 'int64', 'type': 'category', 'start': 'datetime64[ns]',
+          'end': 'datetime64[ns]', 'stringency': 'float64'}
+
+# values of treatment arrays
+VALUES = ['indicator', 'stringency']
+
+# one row of the store; end is NaT for interventions still in force
+Intervention = namedtuple('Intervention', list(SCHEMA))
+
+# (state, day) keys: days since 1970 offset within a block per state
+_STRIDE = np.int64(1) << np.int64(32)
+_OFFSET = np.int64(1) << np.int64(31)
+
+
+def days(dates):
+    """
+    Days since 1970-01-01 of dates, as int64.
+    """
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def keys(states, day):
+    """
+    Sortable keys of (state FIPS, day) pairs: all days of a state lie
+    between the days of the states before and after it.
+    """
+    return np.asarray(states, dtype=np.int64) * _STRIDE + day
+
+
+class InterventionReader(Policy, Reader):
+    """
+    Reads the raw and processed policy interventions.
+    """
+    def __init__(self, dirname="policy"):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "policy".
+        """
+        Policy.__init__(self, dirname)
+        Reader.__init__(self)
+        self.fpath_raw = os.path.join(self.raw_dir_policy, self.fname_raw)
+        self.fpath_processed = os.path.join(self.processed_dir_policy,
+                                            self.fname_processed)
+
+    def read_raw(self):
+        """
+        Read the interventions as coded.
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns state, type, start, end, stringency as str.
+        """
+        return pd.read_csv(self.fpath_raw, dtype=str, skipinitialspace=True)
+
+    def read_processed(self, states=None, types=None):
+        """
+        Read the validated interventions.
+
+        Parameters
+        ----------
+        states : list of int, optional
+            State FIPS codes to read.
+        types : list of str, optional
+            Types of interventions to read, each one of TYPES.
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns and dtypes of SCHEMA, one row per intervention.
+        """
+        filters = []
+        if states is not None:
+            filters.append(('state', 'in', [int(s) for s in states]))
+        if types is not None:
+            filters.append(('type', 'in', list(types)))
+        df = pd.read_parquet(self.fpath_processed, engine='pyarrow',
+                             filters=filters or None)
+        return df.reset_index(drop=True)
+
+    def read_index(self, states=None, types=None):
+        """
+        Interval index of the validated interventions, see read_processed.
+
+        Returns
+        -------
+        InterventionIndex
+        """
+        return InterventionIndex(self.read_processed(states, types))
+
+
+class InterventionTransformer(InterventionReader, Transformer):
+    """
+    Validates the coded interventions.
+    """
+    def __init__(self, dirname="policy"):
+        InterventionReader.__init__(self, dirname)
+        Transformer.__init__(self)
+
+    def validate(self, df):
+        """
+        Check the coded interventions and cast them to SCHEMA.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            As read by read_raw.
+
+        Returns
+        -------
+        pd.DataFrame
+            Sorted by state, start and type.
+
+        Raises
+        ------
+        ValueError
+            If a column is missing, or a state, type, date or stringency is
+            invalid.
+        """
+        missing = set(SCHEMA) - set(df.columns)
+        if missing:
+            raise ValueError("Missing columns {}.".format(sorted(missing)))
+        df = df[list(SCHEMA)].copy()
+        codes = FIPSIndex().state_fips(df['state'].str.strip())
+        if codes.isna().any():
+            raise ValueError("Unknown states {}.".format(
+                sorted(df['state'][codes.isna()].unique())))
+        df['state'] = codes.astype(np.int64)
+
+        kinds = df['type'].astype(str).str.strip()
+        unknown = sorted(set(kinds) - set(TYPES))
+        if unknown:
+            raise ValueError("Unknown types {}. Choose one of {}.".format(
+                unknown, ", ".join(TYPES)))
+        df['type'] = pd.Categorical(kinds, categories=TYPES)
+
+        for col in ['start', 'end']:
+            df[col] = pd.to_datetime(df[col], errors='raise')
+        if df['start'].isna().any():
+            raise ValueError("Missing start dates in rows {}.".format(
+                df.index[df['start'].isna()].tolist()))
+        if (df['end'] < df['start']).any():
+            raise ValueError("Interventions end before they start in rows "
+                             "{}.".format(df.index[df['end'] <
+                                                   df['start']].tolist()))
+
+        df['stringency'] = pd.to_numeric(df['stringency'], errors='raise')
+        if not df['stringency'].between(0, 1).all():
+            raise ValueError("Stringency must be between 0 and 1.")
+        df = df.astype(SCHEMA)
+        return df.sort_values(['state', 'start', 'type']) \
+            .reset_index(drop=True)
+
+    def raw2processed(self):
+        """
+        Validate the coded interventions and write them to the processed
+        Parquet file.
+
+        Returns
+        -------
+        pd.DataFrame
+            The validated interventions.
+        """
+        logger = logging.getLogger(__name__)
+        df = self.validate(self.read_raw())
+        if not os.path.exists(self.processed_dir_policy):
+            os.makedirs(self.processed_dir_policy)
+        df.to_parquet(self.fpath_processed + '.tmp', engine='pyarrow',
+                      index=False)
+        os.replace(self.fpath_processed + '.tmp', self.fpath_processed)
+        logger.info('Wrote {} interventions of {} states.'.format(
+            len(df), df['state'].nunique()))
+        return df
+
+
+class InterventionIndex(object):
+    """
+    Interval index of interventions by state and day.
+    """
+    def __init__(self, df):
+        """
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Interventions with the columns of SCHEMA, e.g. from
+            InterventionReader.read_processed.
+        """
+        self.frame = df.reset_index(drop=True)
+        state = self.frame['state'].values.astype(np.int64)
+        start = keys(state, days(self.frame['start'].values))
+        # the day after the end, or the end of the block of the state
+        end = self.frame['end'].values
+        stop = np.where(pd.isna(end), keys(state + 1, -_OFFSET),
+                        keys(state, days(end) + 1))
+
+        # bounds of the elementary intervals, with the bounds of the
+        # blocks of the states so that every other key is in no interval
+        states = np.unique(state)
+        self.bounds = np.unique(np.concatenate([
+            start, stop, keys(states, -_OFFSET), keys(states + 1, -_OFFSET)]))
+
+        # interventions in force per interval, and an empty row for the
+        # keys before the first bound
+        first = np.searchsorted(self.bounds, start)
+        counts = np.searchsorted(self.bounds, stop) - first
+        cols = np.repeat(np.arange(len(first)), counts)
+        rows = np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts) + first[cols]
+        self.intervals = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(len(self.bounds) + 1, len(self.frame)))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def interventions(self):
+        """
+        Interventions of the index as records.
+
+        Returns
+        -------
+        list of Intervention
+        """
+        return [Intervention(*row) for row in
+                self.frame[list(SCHEMA)].itertuples(index=False)]
+
+    def active(self, states, dates):
+        """
+        Interventions in force in states on days.
+
+        Parameters
+        ----------
+        states : array_like of int
+            State FIPS codes.
+        dates : array_like
+            Days, broadcastable with states.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            Boolean matrix with a row per (state, day) pair, in the order of
+            the raveled broadcast arrays, and a column per intervention (row
+            of self.frame).
+        """
+        states, day = np.broadcast_arrays(np.asarray(states, dtype=np.int64),
+                                          days(dates))
+        pos = np.searchsorted(self.bounds, keys(states.ravel(), day.ravel()),
+                              side='right') - 1
+        pos[pos < 0] = len(self.bounds)
+        return self.intervals[pos]
+
+    def columns(self, types=None):
+        """
+        Interventions of some types.
+
+        Parameters
+        ----------
+        types : list of str, optional
+            Each one of TYPES. Defaults to all.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array with an element per intervention.
+        """
+        if types is None:
+            return np.ones(len(self.frame), dtype=bool)
+        unknown = sorted(set(types) - set(TYPES))
+        if unknown:
+            raise IOError("Types {} do not exist. Choose one of "
+                          "{}.".format(unknown, ", ".join(TYPES)))
+        return self.frame['type'].isin(types).values
+
+    def treatment(self, states, dates, types=None, value='indicator'):
+        """
+        Treatment of states on days.
+
+        Parameters
+        ----------
+        states : array_like of int
+            State FIPS codes.
+        dates : array_like
+            Days, broadcastable with states.
+        types : list of str, optional
+            Types of interventions, each one of TYPES. Defaults to all.
+        value : str
+            One of VALUES: 'indicator' (1 if an intervention is in force) or
+            'stringency' (the highest stringency in force, 0 if none).
+
+        Returns
+        -------
+        np.ndarray
+            float64 with the broadcast shape of states and dates.
+        """
+        if value not in VALUES:
+            raise IOError("Value does not exist. Choose one of "
+                          "{}.".format(", ".join(VALUES)))
+        shape = np.broadcast_shapes(np.shape(states), np.shape(dates))
+        active = self.active(states, dates)[:, self.columns(types)]
+        if value == 'indicator':
+            treated = active.getnnz(axis=1) > 0
+            return treated.astype(np.float64).reshape(shape)
+        stringency = self.frame['stringency'].values[self.columns(types)]
+        treated = active.multiply(stringency[None, :]).tocsr().max(axis=1)
+        return treated.toarray().ravel().reshape(shape)
+
+    def treatment_arrays(self, time, county, types=None,
+                         value='indicator'):
+        """
+        Treatment arrays aligned with the (time, county) dims of the CSSE
+        dataset.
+
+        The treatment is computed once per state and day and taken by the
+        counties of each state (see src.data.cube.state_fips).
+
+        Parameters
+        ----------
+        time : array_like
+            Days, e.g. ds['time'].values.
+        county : array_like of int
+            County FIPS codes, e.g. ds['county'].values.
+        types : list of str, optional
+            Types of interventions. One array per type if given, one array
+            of all interventions otherwise.
+        value : str
+            One of VALUES, see treatment.
+
+        Returns
+        -------
+        dict
+            'any' or type -> float64 array with dims (time, county).
+        """
+        from src.data.cube import state_fips
+
+        states, pos = np.unique(state_fips(county), return_inverse=True)
+        time = np.asarray(time)[:, None]
+        groups = [('any', None)] if types is None else \
+            [(kind, [kind]) for kind in types]
+        return {name: self.treatment(states[None, :], time, kinds,
+                                     value)[:, pos]
+                for name, kinds in groups}
+
+    def start_dates(self, types=None):
+        """
+        First start of an intervention per state, e.g. the event dates of
+        an event study (see src.models.rolling.state_event_dates).
+
+        Parameters
+        ----------
+        types : list of str, optional
+            Types of interventions. Defaults to all.
+
+        Returns
+        -------
+        pd.Series
+            Start date indexed by state FIPS code.
+        """
+        df = self.frame[self.columns(types)]
+        return df.groupby('state')['start'].min()
+
+
+if __name__ == '__main__':
+    from src.data.reader import CSSEReader
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    InterventionTransformer().raw2processed()
+    index = InterventionReader().read_index()
+    with CSSEReader('csse').read_processed2ds() as ds:
+        time, county = ds['time'].values, ds['county'].values
+    arrays = index.treatment_arrays(time, county, types=['stay_at_home'])
+    print('County-days under stay at home orders: {:.0f}'.format(
+        arrays['stay_at_home'].sum()))
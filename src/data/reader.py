@@ -1,20 +1,222 @@
 import os
+import csv
+import json
 import numpy as np
 import pandas as pd
 import xarray as xr
-from src.data.structure import Reader, CSSE
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.data.structure import Reader, CSSE, POPEST
+
+
+# storage formats of the processed data
+BACKENDS = ['csv', 'parquet']
+
+# rows per row group of the long (county, time, value) Parquet time series
+ROW_GROUP_SIZE = 1 << 16
+
+# key of the county order of the processed csv in the Parquet metadata
+COUNTY_ORDER = b'counties'
+
+
+def read_header(fpath):
+    """
+    Read the header of a csv file. Much faster than pd.read_csv with nrows=0
+    for files with thousands of columns.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to csv file.
+
+    Returns
+    -------
+    pd.Index
+        Column names.
+    """
+    with open(fpath, 'r', newline='') as f:
+        return pd.Index(next(csv.reader(f)))
+
+
+def date_columns(columns):
+    """
+    Find the time series columns of a raw CSSE file.
+
+    Parameters
+    ----------
+    columns : pd.Index
+        Header of the raw file.
+
+    Returns
+    -------
+    pd.Series
+        Dates (values) of all date columns (index), in file order.
+    """
+    dates = pd.to_datetime(pd.Series(columns, index=columns),
+                           format='%m/%d/%y', errors='coerce')
+    return dates.dropna()
+
+
+def clean_fips(df):
+    """
+    Integer FIPS codes of the rows of a raw CSSE file. Entities without a
+    FIPS code (e.g. prisons, health districts) get the last five digits of
+    their UID, which is how CSSE numbers such entities (7xxxx).
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Raw CSSE data with columns UID and FIPS.
+
+    Returns
+    -------
+    pd.Index
+        Unique integer FIPS codes named 'county'.
+    """
+    fips = df['FIPS'].fillna(df['UID'] % 100000).astype(np.int64)
+    fips = pd.Index(fips.values, name='county')
+    assert fips.is_unique
+    return fips
+
+
+def write_long(df, fpath, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a time series frame to Parquet in long format.
+
+    The wide frame (time x county) is stored as (county, time, value) rows
+    sorted by county and time, in large row groups. A wide file with a
+    column per county carries the metadata of thousands of columns per row
+    group, which is parsed on every read; the long file has three columns,
+    and selecting counties only decodes the row groups of their FIPS range.
+    The county order of the frame is kept in the file metadata.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        int32 time series with dims (time, county), integer FIPS columns.
+    fpath : str
+        Path to the Parquet file, replaced atomically.
+    row_group_size : int
+        Rows per row group.
+    """
+    counties = np.asarray(df.columns, dtype=np.int64)
+    order = np.argsort(counties, kind='stable')
+    n_times = len(df)
+    table = pa.table({
+        'county': np.repeat(counties[order], n_times),
+        'time': np.tile(df.index.values.astype('datetime64[ns]'),
+                        len(counties)),
+        'value': np.ascontiguousarray(
+            df.values.T[order]).ravel().astype(np.int32)})
+    table = table.replace_schema_metadata(
+        {COUNTY_ORDER: json.dumps(counties.tolist())})
+    pq.write_table(table, fpath + '.tmp', row_group_size=row_group_size)
+    os.replace(fpath + '.tmp', fpath)
+
+
+def _row_groups(pf, counties):
+    """
+    Row groups of a long Parquet time series whose FIPS range contains one
+    of the (sorted) counties.
+    """
+    groups = []
+    for i in range(pf.metadata.num_row_groups):
+        stats = pf.metadata.row_group(i).column(0).statistics
+        first = np.searchsorted(counties, stats.min)
+        if first < len(counties) and counties[first] <= stats.max:
+            groups.append(i)
+    return groups
+
+
+def _wide(county, time, value):
+    """
+    Wide (time x county) frame of long rows sorted by county and time.
+    """
+    # one block of dates per county, unless counties have different dates
+    starts = np.flatnonzero(np.r_[True, county[1:] != county[:-1]]) \
+        if len(county) else np.array([], dtype=np.int64)
+    n_times = len(county) // max(len(starts), 1)
+    if len(starts) and np.array_equal(starts,
+                                      np.arange(len(starts)) * n_times):
+        return pd.DataFrame(value.reshape(len(starts), n_times).T,
+                            index=pd.DatetimeIndex(time[:n_times],
+                                                   name='time'),
+                            columns=county[starts])
+    df = pd.DataFrame({'county': county, 'time': time, 'value': value})
+    return df.pivot(index='time', columns='county', values='value')
+
+
+def read_long(fpath, counties=None, start=None, end=None):
+    """
+    Read a time series written by write_long into a wide frame.
+
+    Only the row groups of the requested counties are read.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to the Parquet file.
+    counties : list of int, optional
+        FIPS codes to read, in the order of the columns returned. Defaults
+        to all, in the order they were written.
+    start, end : str or pd.Timestamp, optional
+        First and last date to read.
+
+    Returns
+    -------
+    pd.DataFrame
+        int32 time series with dims (time, county). Columns are FIPS codes
+        as str.
+    """
+    pf = pq.ParquetFile(fpath)
+    if counties is None:
+        table = pf.read()
+        metadata = pf.schema_arrow.metadata or {}
+        if COUNTY_ORDER in metadata:
+            counties = json.loads(metadata[COUNTY_ORDER])
+        keep = np.ones(table.num_rows, dtype=bool)
+    else:
+        counties = [int(c) for c in counties]
+        wanted = np.unique(counties)
+        table = pf.read_row_groups(_row_groups(pf, wanted))
+        keep = np.isin(table['county'].to_numpy(), wanted)
+
+    time = table['time'].to_numpy()
+    if start is not None:
+        keep &= time >= np.datetime64(pd.Timestamp(start))
+    if end is not None:
+        keep &= time <= np.datetime64(pd.Timestamp(end))
+    df = _wide(table['county'].to_numpy()[keep], time[keep],
+               table['value'].to_numpy()[keep])
+    if counties is not None:
+        df = df.reindex(columns=[c for c in counties if c in df.columns])
+    df.columns = df.columns.astype(str)
+    return df
 
 
 class CSSEReader(CSSE, Reader):
     """"""
-    def __init__(self, dirname):
-        """"""
+    def __init__(self, dirname, backend='csv'):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "csse".
+        backend : str
+            Storage format of the processed data. One of 'csv', 'parquet'.
+            Parquet files are read with column and row group pushdown.
+        """
         CSSE.__init__(self, dirname)
         Reader.__init__(self)
 
         self.dirname = dirname
+        if backend not in BACKENDS:
+            raise IOError("Backend does not exist. Choose one of 'csv',"
+                          "'parquet'.")
+        self.backend = backend
 
-    def read_raw(self, variable="confirmed"):
+    def read_raw(self, variable="confirmed", counties=None, states=None,
+                 start=None, end=None):
         """
         Read raw CSSE data.
 
@@ -22,6 +224,13 @@ class CSSEReader(CSSE, Reader):
         ----------
         variable : str
             One of 'confirmed', 'deaths'
+        counties : list of int, optional
+            FIPS codes of the counties to read.
+        states : list of str, optional
+            Names of the states to read, e.g. ['New York'].
+        start, end : str or pd.Timestamp, optional
+            First and last date to read. Dates outside the range are not
+            parsed at all.
 
         Returns
         -------
@@ -38,11 +247,68 @@ class CSSEReader(CSSE, Reader):
         else:
             raise IOError("Variable does not exist. Choose one of 'confirmed',"
                           "'deaths'.")
+        # select date columns from the header only
+        header = read_header(fpath)
+        dates = date_columns(header)
+        keep = dates[dates.between(pd.Timestamp(start or dates.min()),
+                                   pd.Timestamp(end or dates.max()))]
+        usecols = [i for i, c in enumerate(header)
+                   if c not in dates.index or c in keep]
+
         # read data
-        df = pd.read_csv(fpath, index_col=[0])
+        df = pd.read_csv(fpath, index_col=[0], usecols=usecols)
+        if counties is not None or states is not None:
+            fips = clean_fips(df.reset_index())
+            df = df[fips.isin(counties or []) |
+                    df['Province_State'].isin(states or [])]
+        return df
+
+    def read_raw_timeseries(self, variable="confirmed", since=None):
+        """
+        Read the time series part of the raw CSSE data directly into a
+        compact int32 frame, without going through the processed csv files.
+
+        Parameters
+        ----------
+        variable : str
+            One of 'confirmed', 'deaths'
+        since : np.datetime64, optional
+            Only parse dates after this one.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            int32 time series with dims (time, county). The columns are the
+            clean integer FIPS codes, see clean_fips.
+        """
+        # create file path
+        if variable == 'confirmed':
+            fpath = os.path.join(self.raw_dir, self.dirname, "US",
+                                 self.fname_confirmed_raw)
+        elif variable == 'deaths':
+            fpath = os.path.join(self.raw_dir, self.dirname, "US",
+                                 self.fname_deaths_raw)
+        else:
+            raise IOError("Variable does not exist. Choose one of 'confirmed',"
+                          "'deaths'.")
+
+        # select date columns from the header only
+        dates = date_columns(read_header(fpath))
+        if since is not None:
+            dates = dates[dates > since]
+        date_cols = list(dates.index)
+
+        # read data
+        raw = pd.read_csv(fpath, usecols=['UID', 'FIPS'] + date_cols,
+                          dtype={col: np.int32 for col in date_cols})
+        values = np.ascontiguousarray(raw[date_cols].values.T)
+        df = pd.DataFrame(values,
+                          index=pd.DatetimeIndex(dates.values, name='time'),
+                          columns=clean_fips(raw))
         return df
 
-    def read_processed(self, variable="confirmed"):
+    def read_processed(self, variable="confirmed", counties=None,
+                       states=None, start=None, end=None):
         """
         Read CSSE time series data only.
 
@@ -50,11 +316,17 @@ class CSSEReader(CSSE, Reader):
         ----------
         variable : str
             One of 'confirmed', 'deaths'
+        counties : list of int, optional
+            FIPS codes of the counties to read.
+        states : list of str, optional
+            Names of the states to read, e.g. ['New York'].
+        start, end : str or pd.Timestamp, optional
+            First and last date to read.
 
         Returns
         -------
         df : pd.DataFrame
-            CSSE time series data.
+            CSSE time series data. Columns are FIPS codes as str.
         """
         # create file path
         if variable == 'confirmed':
@@ -66,13 +338,26 @@ class CSSEReader(CSSE, Reader):
         else:
             raise IOError("Variable does not exist. Choose one of 'confirmed',"
                           "'deaths'.")
+        columns = self._select_counties(variable, counties, states)
+
         # read data
-        df = pd.read_csv(fpath, index_col=[0])
+        if self.backend == 'parquet':
+            fpath = os.path.splitext(fpath)[0] + '.parquet'
+            return read_long(fpath, columns, start, end)
+
+        if columns is None:
+            df = pd.read_csv(fpath, index_col=[0])
+        else:
+            header = read_header(fpath)
+            usecols = [0] + [header.get_loc(c) for c in columns]
+            df = pd.read_csv(fpath, index_col=[0], usecols=usecols)
+            df = df[columns]
         df.index = pd.to_datetime(df.index)
         df.index.name = 'time'
-        return df
+        return df.loc[start:end]
 
-    def read_ancillary(self, variable="confirmed"):
+    def read_ancillary(self, variable="confirmed", counties=None,
+                       states=None):
         """
         Read CSSE ancillary data only.
 
@@ -80,6 +365,10 @@ class CSSEReader(CSSE, Reader):
         ----------
         variable : str
             One of 'confirmed', 'deaths'
+        counties : list of int, optional
+            FIPS codes of the counties to read.
+        states : list of str, optional
+            Names of the states to read, e.g. ['New York'].
 
         Returns
         -------
@@ -96,23 +385,80 @@ class CSSEReader(CSSE, Reader):
             raise IOError("Variable does not exist. Choose one of 'confirmed',"
                           "'deaths'.")
         # read data
+        if self.backend == 'parquet':
+            fpath = os.path.splitext(fpath)[0] + '.parquet'
+            filters = []
+            if counties is not None:
+                filters.append([('FIPS', 'in', list(counties))])
+            if states is not None:
+                filters.append([('Province_State', 'in', list(states))])
+            return pd.read_parquet(fpath, filters=filters or None)
+
         df = pd.read_csv(fpath, index_col=[0])
+        if counties is not None or states is not None:
+            df = df[df['FIPS'].isin(counties or []) |
+                    df['Province_State'].isin(states or [])]
         return df
 
-    def read_processed2ds(self):
+    def _select_counties(self, variable, counties=None, states=None):
         """
-        Read CSSE data to xr.Dataset object.
+        Names of the time series columns of the given counties and states.
+
+        Returns
+        -------
+        list of str or None
+            None if neither counties nor states are given.
+        """
+        if counties is None and states is None:
+            return None
+        fips = list(counties or [])
+        if states is not None:
+            ancillary = self.read_ancillary(variable, states=states)
+            fips += list(ancillary['FIPS'])
+        return [str(int(f)) for f in pd.unique(fips)]
+
+    def read_processed2ds(self, chunks=None):
+        """
+        Read CSSE data to xr.Dataset object. The data is loaded lazily as
+        dask arrays.
+
+        Parameters
+        ----------
+        chunks : dict, optional
+            Dask chunk sizes per dimension. Defaults to the chunking on disk.
 
         Returns
         -------
         CSSE data as xr.Dataset
         """
+        if chunks is None:
+            chunks = {'time': self.time_chunk}
         fpath = os.path.join(self.processed_dir, self.dirname,
-                             "US", "csse_data_merged.nc")
-        return xr.open_dataset(fpath, engine='netcdf4')
+                             "US", self.fname_ds)
+        return xr.open_dataset(fpath, engine='netcdf4', chunks=chunks)
+
+
+class POPESTReader(POPEST, Reader):
+    """"""
+    def __init__(self, dirname="demography"):
+        """"""
+        POPEST.__init__(self, dirname)
+        Reader.__init__(self)
+
+    def read_raw(self):
+        """
+        Read raw POPEST data.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Raw POPEST data, one row per county and state.
+        """
+        fpath = os.path.join(self.raw_dir_popest, self.fname_raw)
+        return pd.read_csv(fpath, encoding="ISO-8859-1")
 
 
 if __name__ == "__main__":
     reader = CSSEReader(dirname='csse')
     ds = reader.read_processed2ds()
-    print(ds)
\ No newline at end of file
+    print(ds)
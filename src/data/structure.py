@@ -116,3 +116,62 @@ class CSSE(Data):
             "time_series_covid19_confirmed_US_ancillary.csv"
         self.fname_deaths_processed_ancillary = \
             "time_series_covid19_deaths_US_ancillary.csv"
+
+        # processed dataset, chunked along the (unlimited) time dimension
+        self.fname_ds = "csse_data_merged.nc"
+
+        # derived metrics (see src.features.build_features)
+        self.fname_features = "csse_features.nc"
+
+        # daily newspaper sentiment on the same time axis
+        # (see src.features.sentiment_daily)
+        self.fname_sentiment = "csse_sentiment.nc"
+        self.time_chunk = 32
+
+        # download manifest (last ingested date, http validators)
+        self.fname_manifest = "manifest.json"
+
+
+class POPEST(Data):
+    """
+    Defines structure of the POPEST population estimates (US Census Bureau).
+    """
+    def __init__(self, dirname="demography"):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directory, e.g. "demography" to map to
+            "data/raw/demography".
+        """
+        super(POPEST, self).__init__()
+        self.dirname = dirname
+        self.raw_dir_popest = os.path.join(self.raw_dir, self.dirname)
+
+        # raw
+        self.fname_raw = "POPEST_2019.csv"
+
+
+class Policy(Data):
+    """
+    Defines structure of the manually coded policy interventions.
+    """
+    def __init__(self, dirname="policy"):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "policy" to map to
+            "data/raw/policy" and "data/processed/policy".
+        """
+        super(Policy, self).__init__()
+        self.dirname = dirname
+        self.raw_dir_policy = os.path.join(self.raw_dir, self.dirname)
+        self.processed_dir_policy = os.path.join(self.processed_dir,
+                                                 self.dirname)
+
+        # raw: one row per intervention, coded by hand
+        self.fname_raw = "interventions.csv"
+
+        # processed: validated and typed
+        self.fname_processed = "interventions.parquet"
@@ -4,39 +4,64 @@ import logging
 import numpy as np
 import pandas as pd
 import xarray as xr
+import netCDF4
+from xarray.backends.file_manager import FILE_CACHE
 from src.utils.paths import get_parent_dir
 from src.data.structure import Transformer, CSSE
-from src.data.reader import CSSEReader
+from src.data.reader import CSSEReader, BACKENDS, clean_fips, \
+    write_long
+from src.utils.profiling import profiled, count
 
 
 class CSSETransformer(CSSEReader, Transformer):
-    def __init__(self, dirname):
+    def __init__(self, dirname, backend='csv'):
         CSSE.__init__(self, dirname)
         Transformer.__init__(self)
         self.dirname = dirname
+        if backend not in BACKENDS:
+            raise IOError("Backend does not exist. Choose one of 'csv',"
+                          "'parquet'.")
+        self.backend = backend
 
-    def raw2processed(self):
+    @profiled
+    def raw2processed(self, variables=None):
         """
         Basic transformation of raw data into processed data.
 
+        Parameters
+        ----------
+        variables : list of str, optional
+            Only transform these variables ('confirmed', 'deaths'). Defaults
+            to all raw files.
+
         Returns
         -------
         Two pd.DataFrames for each variable (confirmed cases, deaths). The first
         one stores the timeseries data as indicated by the file name extension
         _timeseries. The second one stores all ancillary information contained
         in the raw data as indicated by the file name extension _ancillary.
+        Both are written in the format of the backend. Parquet time series
+        are stored in long format sorted by county and time (see
+        write_long), so counties and date ranges can be read without
+        scanning the whole file.
         """
         # start logger
         logger = logging.getLogger(__name__)
         logger.info('Splitting raw data into time series and ancillary part.')
 
         file_dir = os.path.join(self.raw_dir_csse, "US")
+        files = os.listdir(file_dir)
+        if variables is not None:
+            fnames_raw = {'confirmed': self.fname_confirmed_raw,
+                          'deaths': self.fname_deaths_raw}
+            files = [fnames_raw[var] for var in variables]
         # process
-        for file in os.listdir(file_dir):
+        for file in files:
             # read csv
             file_path = os.path.join(file_dir, file)
             ts_raw = pd.read_csv(file_path, infer_datetime_format=True)
             ts_raw = ts_raw.convert_dtypes()
+            count(rows_in=len(ts_raw), bytes_in=os.path.getsize(file_path))
 
             # drop all cols apart from Province_States and the time series data
             ancillary_cols = ['Unnamed: 0', 'UID', 'iso2', 'iso3', 'code3',
@@ -44,37 +69,59 @@ class CSSETransformer(CSSEReader, Transformer):
                               'Long_', 'Province_State', 'Combined_Key']
             if 'Population' in ts_raw.columns:
                 ancillary_cols.append('Population')
+            # raw files downloaded as is do not carry a pandas index column
+            ancillary_cols = [c for c in ancillary_cols if c in ts_raw.columns]
 
             # split into time series and ancillary data per state
-            ts_clean = (ts_raw.drop(columns=ancillary_cols)
-                        .set_index('FIPS')
-                        .transpose())
+            fips = clean_fips(ts_raw)
+            ts_clean = (ts_raw.drop(columns=ancillary_cols + ['FIPS'])
+                        .transpose()
+                        .astype(np.int32))
+            ts_clean.columns = fips
             # to datetime index
             ts_clean.index = pd.to_datetime(ts_clean.index, format='%m/%d/%y')
+            ts_clean.index.name = 'time'
 
             # ancillary data
-            ancillary_cols.append('FIPS')
             ancillary_clean = (ts_raw[ancillary_cols]
-                               .drop(columns=['Unnamed: 0']))
-
-            # save to csv
-            ts_clean.to_csv(
-                os.path.join(self.project_dir, self.processed_dir_csse, "US",
-                             file.split('.')[0] + '_timeseries.csv'))
-            ancillary_clean.to_csv(
-                os.path.join(self.project_dir, self.processed_dir_csse, "US",
-                             file.split('.')[0] + '_ancillary.csv'))
+                               .drop(columns=['Unnamed: 0'], errors='ignore'))
+            ancillary_clean['FIPS'] = fips.values
+
+            # save
+            fpath = os.path.join(self.project_dir, self.processed_dir_csse,
+                                 "US", file.split('.')[0])
+            if self.backend == 'parquet':
+                write_long(ts_clean, fpath + '_timeseries.parquet')
+                ancillary_clean.to_parquet(fpath + '_ancillary.parquet')
+            else:
+                ts_clean.to_csv(fpath + '_timeseries.csv')
+                ancillary_clean.to_csv(fpath + '_ancillary.csv')
+            ext = '.parquet' if self.backend == 'parquet' else '.csv'
+            count(rows_out=len(ts_clean) + len(ancillary_clean),
+                  bytes_out=sum(os.path.getsize(fpath + part + ext)
+                                for part in ['_timeseries', '_ancillary']))
         return None
 
-    def processed2ds(self):
+    @profiled
+    def processed2ds(self, append=True):
         """
         Creates xr.Dataset based on pre-processed time series data. For each
         variable, it stores the time series data as 2D arrays with dimension
         n_times x n_entities. Metadata from the ancillary files is included.
 
+        The dataset is stored with an unlimited time dimension, chunked along
+        time. If possible, only time steps later than the last stored one are
+        appended in place. The file is rewritten if it does not exist yet, if
+        the counties changed or if the file has a fixed time dimension.
+
         Requires the package netcdf4 to be installed in order to use the
         netcdf4 engine for saving the file.
 
+        Parameters
+        ----------
+        append : bool
+            If False, always rewrite the whole file.
+
         Returns
         -------
         xr.Dataset
@@ -92,6 +139,7 @@ class CSSETransformer(CSSEReader, Transformer):
         # read processed time series data
         ts_confirmed = self.read_processed(variable='confirmed')
         ts_deaths = self.read_processed(variable='deaths')
+        count(rows_in=len(ts_confirmed) + len(ts_deaths))
 
         # clean up suspect "Unnamed" columns so we can convert to numeric types
         dfs_clean = {}
@@ -123,21 +171,207 @@ class CSSETransformer(CSSEReader, Transformer):
                      'deaths': (dims, ts_deaths.values)}
         coords = {'time': times, 'county': locs}
         ds = xr.Dataset(data_vars=data_vars, coords=coords)
+        count(rows_out=ds.dims['time'])
 
         # save to netcdf
         fpath = os.path.join(self.project_dir, self.processed_dir, self.dirname,
-                     "US", "csse_data_merged.nc")
-        compression = dict(zlib=True, complevel=5)
-        encoding = {var: compression for var in ds.data_vars}
+                             "US", self.fname_ds)
+        if append and append_ds(fpath, ds):
+            return None
+        write_ds(fpath, ds, self.time_chunk)
+        return None
+
+    @profiled
+    def raw2ds(self, append=True, export_processed=False):
+        """
+        Single pass transformation of raw data into the xr.Dataset written by
+        processed2ds. The raw time series are parsed straight into int32
+        arrays keyed by clean integer FIPS codes (see clean_fips), without
+        writing and re-reading the processed csv files. If the dataset can
+        be appended to, only dates after the last stored one are parsed.
+
+        Parameters
+        ----------
+        append : bool
+            If False, always rewrite the whole file.
+        export_processed : bool
+            If True, also write the processed time series and ancillary files
+            (see raw2processed).
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.info('Converting raw data into xr.Dataset object.')
+
+        fpath = os.path.join(self.processed_dir_csse, "US", self.fname_ds)
+        since = last_time(fpath) if append else None
+
+        ds = self._raw2ds(since=since)
+        count(rows_out=ds.dims['time'])
+        if since is None or not append_ds(fpath, ds):
+            if since is not None:
+                ds = self._raw2ds()
+            write_ds(fpath, ds, self.time_chunk)
+
+        if export_processed:
+            self.raw2processed()
+        return None
+
+    def _raw2ds(self, since=None):
+        """
+        Build the xr.Dataset from the raw data, optionally restricted to the
+        dates after since.
+        """
+        ts_confirmed = self.read_raw_timeseries('confirmed', since=since)
+        ts_deaths = self.read_raw_timeseries('deaths', since=since)
+
+        assert ts_confirmed.columns.equals(ts_deaths.columns)
+        assert ts_confirmed.index.equals(ts_deaths.index)
+
+        dims = ['time', 'county']
+        data_vars = {'confirmed': (dims, ts_confirmed.values),
+                     'deaths': (dims, ts_deaths.values)}
+        coords = {'time': ts_confirmed.index.values,
+                  'county': ts_confirmed.columns.values}
+        return xr.Dataset(data_vars=data_vars, coords=coords)
+
+
+def write_ds(fpath, ds, time_chunk):
+    """
+    Write a dataset with dims ['time', 'county'] to a compressed netcdf file
+    with an unlimited time dimension, chunked along time.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to the netcdf file. An existing file is replaced atomically.
+    ds : xr.Dataset
+        Dataset with dims ['time', 'county'].
+    time_chunk : int
+        Number of time steps per chunk.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Writing {}.'.format(fpath))
+    encoding = {var: dict(zlib=True, complevel=5,
+                          chunksizes=(time_chunk, ds.dims['county']))
+                for var in ds.data_vars}
+    ds.to_netcdf(fpath + '.tmp', mode='w', encoding=encoding,
+                 engine='netcdf4', unlimited_dims=['time'])
+    os.replace(fpath + '.tmp', fpath)
+    count(bytes_out=os.path.getsize(fpath))
+
+
+def last_time(fpath):
+    """
+    Last time step stored in a netcdf file that can be appended to.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to a netcdf file written by write_ds.
+
+    Returns
+    -------
+    np.datetime64 or None
+        None if the file does not exist, is empty or has a fixed time
+        dimension.
+    """
+    if not os.path.exists(fpath):
+        return None
+    with netCDF4.Dataset(fpath, mode='r') as nc:
+        if not nc.dimensions['time'].isunlimited():
+            return None
+        if len(nc.dimensions['time']) == 0:
+            return None
+        return xr.coding.times.decode_cf_datetime(
+            nc['time'][-1:], nc['time'].units, nc['time'].calendar)[0]
+
+
+def release_ds(fpath):
+    """
+    Close the handles that xarray keeps open on a netcdf file in this
+    process, e.g. of a dataset returned by read_processed2ds. HDF5 does not
+    allow to open a file for writing while it is open for reading. Datasets
+    still using the file reopen it on their next read.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to a netcdf file.
+    """
+    fpath = os.path.abspath(fpath)
+    for key in list(FILE_CACHE.keys()):
+        # key: opener, args (the path first), mode, kwargs, manager id
+        args = key[1]
+        if args and isinstance(args[0], str) and \
+                os.path.abspath(args[0]) == fpath:
+            handle = FILE_CACHE.pop(key, None)
+            if handle is not None:
+                handle.close()
+
+
+def append_ds(fpath, ds):
+    """
+    Append the time steps of ds later than the last stored one to a netcdf
+    file in place. Handles of xarray on the file are closed first (see
+    release_ds).
+
+    Parameters
+    ----------
+    fpath : str
+        Path to a netcdf file written by write_ds.
+    ds : xr.Dataset
+        Dataset with dims ['time', 'county'].
+
+    Returns
+    -------
+    bool
+        False if the file cannot be appended to and has to be rewritten.
+    """
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(fpath):
+        return False
+
+    size = os.path.getsize(fpath)
+    release_ds(fpath)
+    try:
+        nc = netCDF4.Dataset(fpath, mode='a')
+    except OSError as e:
+        raise IOError("{} cannot be opened for appending, probably another "
+                      "process reads it. Close its datasets first: "
+                      "{}".format(fpath, e))
+    with nc:
+        # appending requires the same layout as the stored data
+        if not nc.dimensions['time'].isunlimited():
+            return False
+        if set(ds.data_vars) - set(nc.variables):
+            return False
+        if not np.array_equal(nc['county'][:], ds['county'].values):
+            return False
+
+        n_times = len(nc.dimensions['time'])
+        units, calendar = nc['time'].units, nc['time'].calendar
+        last = xr.coding.times.decode_cf_datetime(
+            nc['time'][-1:], units, calendar)[0]
+        new = ds.sel(time=ds['time'] > last)
+        n_new = new.dims['time']
 
-        # appending did not work. let's simply delete the file every time
-        if os.path.exists(fpath):
-            os.remove(fpath)
-        ds.to_netcdf(fpath, mode='w', encoding=encoding, engine='netcdf4')
+        logger.info('Appending {} time steps to {}.'.format(n_new, fpath))
+        if n_new == 0:
+            return True
+        times, _, _ = xr.coding.times.encode_cf_datetime(
+            new['time'].values, units, calendar)
+        nc['time'][n_times:n_times + n_new] = times
+        for var in new.data_vars:
+            nc[var][n_times:n_times + n_new, :] = new[var].values
+    count(bytes_out=os.path.getsize(fpath) - size)
+    return True
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
     # run
-    CSSETransformer(dirname='csse').processed2ds()
\ No newline at end of file
+    CSSETransformer(dirname='csse').raw2ds()
\ No newline at end of file
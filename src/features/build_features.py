@@ -0,0 +1,273 @@
+"""
+Derived metrics of the CSSE time series.
+
+All metrics are computed in vectorized form on the full (time, county)
+arrays of the dataset written by CSSETransformer.processed2ds/raw2ds and
+stored next to it, so that analyses do not have to recompute them from the
+cumulative counts:
+
+    - {var}_new : daily increments
+    - {var}_new_7d : trailing rolling mean of the daily increments
+    - {var}_per100k : cumulative count per 100k inhabitants
+    - {var}_new_7d_per100k : rolling mean of daily increments per 100k
+    - {var}_growth_7d : average daily growth rate of the cumulative count
+    - {var}_doubling_time : doubling time in days at that growth rate
+
+Population figures are taken from the POPEST county estimates.
+"""
+import os
+import logging
+import numpy as np
+import xarray as xr
+from src.data.reader import CSSEReader
+from src.data.covariates import read_covariates
+from src.data.transform import write_ds, append_ds, last_time
+
+
+def daily_increments(cumulative):
+    """
+    Daily increments of cumulative counts along the time axis (axis 0).
+
+    Parameters
+    ----------
+    cumulative : np.ndarray
+        Cumulative counts with dims (time, county).
+
+    Returns
+    -------
+    np.ndarray
+        Increments. The first time step is NaN.
+    """
+    x = np.asarray(cumulative, dtype=np.float64)
+    out = np.full_like(x, np.nan)
+    out[1:] = np.diff(x, axis=0)
+    return out
+
+
+def rolling_mean(values, window=7):
+    """
+    Trailing rolling mean along the time axis (axis 0), computed from
+    cumulative sums in a single pass.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values with dims (time, county). May contain NaN.
+    window : int
+        Window length in time steps.
+
+    Returns
+    -------
+    np.ndarray
+        Rolling means. NaN if the window is incomplete or contains NaN.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    out = np.full_like(x, np.nan)
+    if len(x) < window:
+        return out
+
+    valid = ~np.isnan(x)
+    sums = np.zeros((len(x) + 1,) + x.shape[1:])
+    counts = np.zeros((len(x) + 1,) + x.shape[1:])
+    np.cumsum(np.where(valid, x, 0.), axis=0, out=sums[1:])
+    np.cumsum(valid, axis=0, out=counts[1:])
+
+    window_sums = sums[window:] - sums[:-window]
+    window_counts = counts[window:] - counts[:-window]
+    out[window - 1:] = np.where(window_counts == window,
+                                window_sums / window, np.nan)
+    return out
+
+
+def per_capita(values, population, per=100000):
+    """
+    Normalise values by population.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values with dims (time, county).
+    population : np.ndarray
+        Population per county. NaN where unknown.
+    per : int
+        Reference population size.
+
+    Returns
+    -------
+    np.ndarray
+        Values per `per` inhabitants.
+    """
+    population = np.asarray(population, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(values, dtype=np.float64) / population * per
+
+
+def growth_rate(cumulative, window=7):
+    """
+    Average daily growth rate of cumulative counts over a trailing window,
+    i.e. (c_t / c_{t-window}) ** (1 / window) - 1.
+
+    Parameters
+    ----------
+    cumulative : np.ndarray
+        Cumulative counts with dims (time, county).
+    window : int
+        Window length in time steps.
+
+    Returns
+    -------
+    np.ndarray
+        Growth rates. NaN for the first window time steps and where the
+        count at the start of the window is zero.
+    """
+    x = np.asarray(cumulative, dtype=np.float64)
+    out = np.full_like(x, np.nan)
+    if len(x) <= window:
+        return out
+    past, now = x[:-window], x[window:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[window:] = np.where(past > 0, (now / past) ** (1. / window) - 1,
+                                np.nan)
+    return out
+
+
+def doubling_time(growth):
+    """
+    Doubling time in days at a given daily growth rate.
+
+    Parameters
+    ----------
+    growth : np.ndarray
+        Daily growth rates.
+
+    Returns
+    -------
+    np.ndarray
+        Doubling times. NaN where the growth rate is not positive.
+    """
+    growth = np.asarray(growth, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(growth > 0, np.log(2) / np.log1p(growth), np.nan)
+
+
+def compute_features(ds, population, window=7):
+    """
+    Compute all derived metrics of a dataset.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Cumulative counts with dims ['time', 'county'].
+    population : np.ndarray
+        Population per county, aligned with ds['county'].
+    window : int
+        Window length of rolling means and growth rates in time steps.
+
+    Returns
+    -------
+    xr.Dataset
+        float32 metrics with the same dims and coords as ds.
+    """
+    dims = ['time', 'county']
+    data_vars = {}
+    for var in ['confirmed', 'deaths']:
+        cumulative = ds[var].values
+        new = daily_increments(cumulative)
+        new_mean = rolling_mean(new, window)
+        growth = growth_rate(cumulative, window)
+
+        metrics = {
+            '{}_new'.format(var): new,
+            '{}_new_7d'.format(var): new_mean,
+            '{}_per100k'.format(var): per_capita(cumulative, population),
+            '{}_new_7d_per100k'.format(var): per_capita(new_mean, population),
+            '{}_growth_7d'.format(var): growth,
+            '{}_doubling_time'.format(var): doubling_time(growth)}
+        for name, values in metrics.items():
+            data_vars[name] = (dims, values.astype(np.float32))
+
+    coords = {'time': ds['time'].values, 'county': ds['county'].values}
+    return xr.Dataset(data_vars=data_vars, coords=coords)
+
+
+class CSSEFeatures(CSSEReader):
+    """
+    Builds, stores and reads the derived metrics of the CSSE dataset.
+    """
+    def __init__(self, dirname, window=7):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the data sub directories, e.g. "csse".
+        window : int
+            Window length of rolling means and growth rates in days.
+        """
+        CSSEReader.__init__(self, dirname)
+        self.window = window
+        self.fpath_features = os.path.join(self.processed_dir_csse, "US",
+                                           self.fname_features)
+
+    def build(self, append=True):
+        """
+        Compute the derived metrics and store them next to the dataset.
+
+        If the stored metrics can be appended to, only the new days are
+        computed, from the new days plus `window` days of history.
+
+        Parameters
+        ----------
+        append : bool
+            If False, always recompute and rewrite all metrics.
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        logger.info('Computing derived metrics of the CSSE data.')
+
+        with self.read_processed2ds() as ds:
+            population = (read_covariates('POPEST', ['population'])
+                          ['population'].reindex(ds['county'].values)
+                          .values)
+
+            since = last_time(self.fpath_features) if append else None
+            if since is not None:
+                first_new = np.searchsorted(ds['time'].values, since,
+                                            side='right')
+                start = max(first_new - self.window, 0)
+                features = compute_features(
+                    ds.isel(time=slice(start, None)).load(), population,
+                    self.window)
+                if append_ds(self.fpath_features, features):
+                    return None
+
+            features = compute_features(ds.load(), population, self.window)
+        write_ds(self.fpath_features, features, self.time_chunk)
+        return None
+
+    def read_features(self, chunks=None):
+        """
+        Read the derived metrics lazily.
+
+        Parameters
+        ----------
+        chunks : dict, optional
+            Dask chunk sizes per dimension. Defaults to the chunking on disk.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        if chunks is None:
+            chunks = {'time': self.time_chunk}
+        return xr.open_dataset(self.fpath_features, engine='netcdf4',
+                               chunks=chunks)
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    CSSEFeatures(dirname='csse').build()
@@ -0,0 +1,392 @@
+"""
+Out-of-core document-term matrices of the article corpus.
+
+Articles are streamed in batches through a HashingVectorizer, which needs no
+vocabulary in memory, with normalize_text as analyzer. Each batch is written
+to disk as a sparse CSR shard of raw term counts. Document frequencies are
+accumulated while writing, so TF-IDF weights can be applied to any shard at
+read time and stay up to date when new shards are added.
+
+Feature selection (chi2, f_regression) accumulates its sufficient statistics
+shard by shard, so it never needs the whole matrix in memory either.
+"""
+import os
+import json
+import logging
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy import stats
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from src.data.structure import Data
+from src.utils.iterables import chunked
+from src.utils.profiling import profiled, count
+from src.features.sentiments import normalize_text, load_caches, save_caches
+from src.features.build_features import CSSEFeatures
+
+# number of hashed features (columns)
+N_FEATURES = 2 ** 20
+
+
+def analyze(doc):
+    """
+    Analyzer of the HashingVectorizer: normalize_text, with missing
+    documents (NaN, None) treated as empty strings.
+    """
+    return normalize_text(doc if isinstance(doc, str) else '')
+
+
+def make_vectorizer(n_features=N_FEATURES):
+    """
+    HashingVectorizer producing raw, non-negative term counts.
+
+    Parameters
+    ----------
+    n_features : int
+        Number of hashed features.
+
+    Returns
+    -------
+    HashingVectorizer
+    """
+    return HashingVectorizer(analyzer=analyze, n_features=n_features,
+                             alternate_sign=False, norm=None,
+                             dtype=np.float32)
+
+
+class DocumentTermShards(Data):
+    """
+    Sharded, sparse document-term matrix on disk.
+    """
+    def __init__(self, dirname="dtm", n_features=N_FEATURES):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the sub directory of "data/processed/articles" holding
+            the shards.
+        n_features : int
+            Number of hashed features. Must not change once shards exist.
+        """
+        Data.__init__(self)
+        self.shard_dir = os.path.join(self.processed_dir, "articles",
+                                      dirname)
+        if not os.path.exists(self.shard_dir):
+            os.makedirs(self.shard_dir)
+        self.fpath_manifest = os.path.join(self.shard_dir, "manifest.json")
+        self.fpath_df = os.path.join(self.shard_dir, "doc_freq.npy")
+
+        self.manifest = {'n_features': n_features, 'n_docs': 0,
+                         'shards': []}
+        if os.path.exists(self.fpath_manifest):
+            with open(self.fpath_manifest, 'r') as f:
+                self.manifest = json.load(f)
+        if self.manifest['n_features'] != n_features:
+            raise IOError("Shards in {} have {} features, not {}.".format(
+                self.shard_dir, self.manifest['n_features'], n_features))
+        self.n_features = n_features
+        self.vectorizer = make_vectorizer(n_features)
+
+    @property
+    def n_docs(self):
+        return self.manifest['n_docs']
+
+    def _fpath(self, shard, kind):
+        return os.path.join(self.shard_dir, "{}_{}.npz".format(shard, kind))
+
+    def doc_freq(self):
+        """
+        Number of documents containing each feature, over all shards.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if not os.path.exists(self.fpath_df):
+            return np.zeros(self.n_features, dtype=np.int64)
+        return np.load(self.fpath_df)
+
+    @profiled
+    def add(self, docs, dates=None, batch_size=10000, cache_dir=None):
+        """
+        Vectorize documents batch by batch and append them as new shards.
+
+        Parameters
+        ----------
+        docs : iterable of str
+            Documents, e.g. a generator over the article store.
+        dates : iterable of datetime-like, optional
+            Publication date of each document, stored next to the shards.
+        batch_size : int
+            Number of documents per shard.
+        cache_dir : str, optional
+            If given, the stem cache of normalize_text is loaded from this
+            directory before the first shard and saved to it after the
+            last, see src.features.sentiments.load_caches.
+
+        Returns
+        -------
+        int
+            Number of documents added.
+        """
+        logger = logging.getLogger(__name__)
+        doc_freq = self.doc_freq()
+        batches = chunked(docs, batch_size)
+        date_batches = chunked(dates, batch_size) if dates is not None \
+            else repeat(None)
+
+        if cache_dir is not None:
+            load_caches(cache_dir)
+        n_added = 0
+        for batch, date_batch in zip(batches, date_batches):
+            X = self.vectorizer.transform(batch).tocsr()
+            X.sum_duplicates()
+            doc_freq += np.bincount(X.indices, minlength=self.n_features)
+
+            shard = "shard_{:05d}".format(len(self.manifest['shards']))
+            fpaths = [self._fpath(shard, 'counts')]
+            sp.save_npz(fpaths[0], X)
+            if date_batch is not None:
+                fpaths.append(self._fpath(shard, 'meta'))
+                np.savez(fpaths[1], dates=pd.to_datetime(date_batch).values)
+            count(rows_in=X.shape[0], rows_out=X.shape[0],
+                  bytes_out=sum(os.path.getsize(f) for f in fpaths))
+
+            self.manifest['shards'].append({'name': shard,
+                                            'n_docs': X.shape[0]})
+            self.manifest['n_docs'] += X.shape[0]
+            n_added += X.shape[0]
+            logger.info('Wrote {} with {} documents.'.format(
+                shard, X.shape[0]))
+
+            # document frequencies and manifest are updated after each
+            # shard, so an interrupted run keeps all complete shards
+            np.save(self.fpath_df + '.tmp.npy', doc_freq)
+            os.replace(self.fpath_df + '.tmp.npy', self.fpath_df)
+            self._write_manifest()
+        if cache_dir is not None:
+            save_caches(cache_dir)
+        return n_added
+
+    def _write_manifest(self):
+        with open(self.fpath_manifest + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.fpath_manifest + '.tmp', self.fpath_manifest)
+
+    def idf(self):
+        """
+        Smoothed inverse document frequencies over all shards, as in
+        sklearn's TfidfTransformer: ln((1 + n) / (1 + df)) + 1.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        return (np.log((1. + self.n_docs) / (1. + self.doc_freq())) + 1.) \
+            .astype(np.float32)
+
+    def iter_shards(self, tfidf=True):
+        """
+        Read the shards one by one.
+
+        Parameters
+        ----------
+        tfidf : bool
+            If True, reweight counts with the current idf and l2-normalize
+            rows. If False, return raw counts.
+
+        Returns
+        -------
+        generator of sp.csr_matrix
+        """
+        idf = sp.diags(self.idf()) if tfidf else None
+        for shard in self.manifest['shards']:
+            X = sp.load_npz(self._fpath(shard['name'], 'counts'))
+            if tfidf:
+                X = normalize(X @ idf, norm='l2', copy=False)
+            yield X.tocsr()
+
+    def matrix(self, tfidf=True):
+        """
+        All shards stacked into one matrix. Only use if it fits in memory.
+
+        Returns
+        -------
+        sp.csr_matrix
+        """
+        shards = list(self.iter_shards(tfidf=tfidf))
+        if not shards:
+            return sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        return sp.vstack(shards, format='csr')
+
+    def dates(self):
+        """
+        Publication dates of all documents, in shard order.
+
+        Returns
+        -------
+        np.ndarray of datetime64
+        """
+        dates = []
+        for shard in self.manifest['shards']:
+            fpath = self._fpath(shard['name'], 'meta')
+            if os.path.exists(fpath):
+                dates.append(np.load(fpath)['dates'])
+            else:
+                dates.append(np.full(shard['n_docs'], np.datetime64('NaT'),
+                                     dtype='datetime64[ns]'))
+        if not dates:
+            return np.array([], dtype='datetime64[ns]')
+        return np.concatenate(dates)
+
+    def _iter_xy(self, y, tfidf):
+        """
+        Yield (X, y) per shard, dropping documents with missing y.
+        """
+        y = np.asarray(y, dtype=np.float64)
+        if len(y) != self.n_docs:
+            raise ValueError("y has {} values for {} documents.".format(
+                len(y), self.n_docs))
+        start = 0
+        for X in self.iter_shards(tfidf=tfidf):
+            y_shard = y[start:start + X.shape[0]]
+            start += X.shape[0]
+            valid = ~np.isnan(y_shard)
+            yield X[valid], y_shard[valid]
+
+    def f_regression(self, y, tfidf=True):
+        """
+        Univariate F-test of each feature against a continuous outcome, as
+        sklearn.feature_selection.f_regression, computed shard by shard.
+
+        Parameters
+        ----------
+        y : array_like
+            Outcome per document. Documents with NaN are ignored.
+        tfidf : bool
+            Use TF-IDF weights (True) or raw counts (False).
+
+        Returns
+        -------
+        F : np.ndarray
+            F statistic per feature.
+        pval : np.ndarray
+            p-value per feature.
+        """
+        n, sum_y, sum_yy = 0, 0., 0.
+        sum_x = np.zeros(self.n_features)
+        sum_xx = np.zeros(self.n_features)
+        sum_xy = np.zeros(self.n_features)
+        for X, y_shard in self._iter_xy(y, tfidf):
+            n += len(y_shard)
+            sum_y += y_shard.sum()
+            sum_yy += (y_shard ** 2).sum()
+            sum_x += np.asarray(X.sum(axis=0)).ravel()
+            sum_xx += np.asarray(X.multiply(X).sum(axis=0)).ravel()
+            sum_xy += X.T @ y_shard
+
+        cov = sum_xy - sum_x * sum_y / n
+        var_x = sum_xx - sum_x ** 2 / n
+        var_y = sum_yy - sum_y ** 2 / n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = cov / np.sqrt(var_x * var_y)
+            F = corr ** 2 / (1 - corr ** 2) * (n - 2)
+        F = np.nan_to_num(F, nan=0.)
+        return F, stats.f.sf(F, 1, n - 2)
+
+    def chi2(self, y, tfidf=False):
+        """
+        Chi-squared statistic of each feature against class labels, as
+        sklearn.feature_selection.chi2, computed shard by shard.
+
+        Parameters
+        ----------
+        y : array_like
+            Integer class label per document, e.g. whether cases were rising.
+            Documents with NaN are ignored.
+        tfidf : bool
+            Use TF-IDF weights (True) or raw counts (False).
+
+        Returns
+        -------
+        chi2 : np.ndarray
+            Chi-squared statistic per feature.
+        pval : np.ndarray
+            p-value per feature.
+        """
+        y = np.asarray(y, dtype=np.float64)
+        classes = np.unique(y[~np.isnan(y)])
+
+        observed = np.zeros((len(classes), self.n_features))
+        class_count = np.zeros(len(classes))
+        for X, y_shard in self._iter_xy(y, tfidf):
+            Y = (y_shard[:, None] == classes[None, :]).astype(np.float64)
+            observed += np.asarray((X.T @ Y).T)
+            class_count += Y.sum(axis=0)
+
+        feature_count = observed.sum(axis=0, keepdims=True)
+        class_prob = (class_count / class_count.sum())[:, None]
+        expected = class_prob @ feature_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chisq = ((observed - expected) ** 2 / expected).sum(axis=0)
+        chisq = np.nan_to_num(chisq, nan=0.)
+        return chisq, stats.chi2.sf(chisq, len(classes) - 1)
+
+    def select_features(self, y, k=1000, score_func='f_regression',
+                        tfidf=True):
+        """
+        Indices of the k highest scoring features, as SelectKBest.
+
+        Parameters
+        ----------
+        y : array_like
+            Outcome or class label per document.
+        k : int
+            Number of features to select.
+        score_func : str
+            One of 'f_regression', 'chi2'.
+        tfidf : bool
+            Use TF-IDF weights (True) or raw counts (False).
+
+        Returns
+        -------
+        np.ndarray
+            Selected feature (column) indices, highest score first.
+        """
+        if score_func == 'f_regression':
+            scores, _ = self.f_regression(y, tfidf=tfidf)
+        elif score_func == 'chi2':
+            scores, _ = self.chi2(y, tfidf=tfidf)
+        else:
+            raise IOError("Score function does not exist. Choose one of "
+                          "'f_regression', 'chi2'.")
+        return np.argsort(scores)[::-1][:k]
+
+
+def csse_outcome(dates, variable='confirmed_new_7d', dirname='csse'):
+    """
+    National CSSE outcome at given dates, e.g. to select features of the
+    articles published on these dates.
+
+    Parameters
+    ----------
+    dates : array_like of datetime-like
+        Publication dates of documents.
+    variable : str
+        Variable of the derived metrics, see src.features.build_features.
+    dirname : str
+        Name of the CSSE data sub directories.
+
+    Returns
+    -------
+    np.ndarray
+        Sum of the variable over all counties on each date. NaN where no
+        data is available.
+    """
+    with CSSEFeatures(dirname).read_features() as ds:
+        national = ds[variable].sum(dim='county', min_count=1) \
+            .to_series()
+    days = pd.to_datetime(dates).floor('D')
+    return national.reindex(days).values
@@ -0,0 +1,354 @@
+"""
+Daily newspaper sentiment on the time axis of the CSSE dataset.
+
+Articles are streamed from the article store (src.data.article_store) and
+scored with the batched VADER scorer of src.features.sentiments. Scores are
+reduced per day and outlet into mergeable statistics: counts, sums, sums of
+squares and fixed-bin histograms of each score. These are kept on disk, so
+each update only scores the articles appended since the last one, and
+statistics of any group of outlets are obtained by adding them up.
+
+The dataset written next to the CSSE dataset has dims (time, outlet) with
+time equal to the time coordinate of the CSSE dataset, plus 'quantile' for
+the quantile variables. The outlet 'all' pools all outlets:
+
+    - article_count : number of articles
+    - sentiment_{score}_mean : mean score
+    - sentiment_{score}_std : standard deviation of the scores
+    - sentiment_{score}_quantile : quantiles of the scores, interpolated
+      within histogram bins of width 0.01 (0.005 for neg, neu, pos)
+
+for score in neg, neu, pos, compound.
+"""
+import os
+import json
+import logging
+from collections import deque
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.data.structure import CSSE
+from src.data.reader import CSSEReader
+from src.data.article_store import ArticleStore
+from src.features.sentiments import SENTIMENT_DTYPE, iter_sentiment
+from src.utils.profiling import count
+
+SCORES = list(SENTIMENT_DTYPE.names)
+
+# value range of each score, divided into N_BINS histogram bins
+SCORE_RANGES = {'neg': (0., 1.), 'neu': (0., 1.), 'pos': (0., 1.),
+                'compound': (-1., 1.)}
+N_BINS = 200
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+ALL_OUTLETS = "all"
+
+
+def histogram_quantiles(hist, lo, hi, quantiles=QUANTILES):
+    """
+    Quantiles of values summarized by histograms with equal-width bins,
+    interpolated linearly within the bins.
+
+    Parameters
+    ----------
+    hist : np.ndarray
+        Counts with the bins along the last axis.
+    lo, hi : float
+        Value range of the histograms.
+    quantiles : list of float
+        Quantiles to compute.
+
+    Returns
+    -------
+    np.ndarray
+        Quantiles along a new last axis. NaN for empty histograms.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    width = (hi - lo) / hist.shape[-1]
+    cum = np.cumsum(hist, axis=-1)
+    total = cum[..., -1:]
+    out = []
+    for q in quantiles:
+        target = q * total
+        idx = np.argmax(cum >= target, axis=-1)[..., None]
+        before = np.take_along_axis(cum, idx, -1) - \
+            np.take_along_axis(hist, idx, -1)
+        in_bin = np.take_along_axis(hist, idx, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(in_bin > 0, (target - before) / in_bin, 0.)
+        value = lo + (idx + frac) * width
+        out.append(np.where(total > 0, value, np.nan)[..., 0])
+    return np.stack(out, axis=-1)
+
+
+class DailySentiment(CSSE):
+    """
+    Incrementally updated daily sentiment statistics per outlet.
+    """
+    def __init__(self, dirname="csse", store=None):
+        """
+        Parameters
+        ----------
+        dirname : str
+            Name of the CSSE data sub directories, e.g. "csse".
+        store : ArticleStore, optional
+            Article store to read from. Defaults to ArticleStore().
+        """
+        CSSE.__init__(self, dirname)
+        self.store = ArticleStore() if store is None else store
+        self.state_dir = os.path.join(self.processed_dir, "articles",
+                                      "sentiment")
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+        self.fpath_state = os.path.join(self.state_dir, "daily_stats.npz")
+        self.fpath_offsets = os.path.join(self.state_dir, "offsets.json")
+        self.fpath_sentiment = os.path.join(self.processed_dir_csse, "US",
+                                            self.fname_sentiment)
+        self._load_state()
+
+    def _load_state(self):
+        """
+        Statistics per (date, outlet) key and the number of rows of each
+        store partition that are already included.
+        """
+        self.keys = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, len(SCORES)))
+        self.sumsq = np.zeros((0, len(SCORES)))
+        self.hist = np.zeros((0, len(SCORES), N_BINS), dtype=np.int64)
+        self.offsets = {}
+        if not os.path.exists(self.fpath_state):
+            return
+        with np.load(self.fpath_state) as state:
+            self.keys = {(d, o): i for i, (d, o) in
+                         enumerate(zip(state['dates'], state['outlets']))}
+            self.count = state['count']
+            self.sums = state['sums']
+            self.sumsq = state['sumsq']
+            self.hist = state['hist']
+        with open(self.fpath_offsets, 'r') as f:
+            self.offsets = json.load(f)
+
+    def _save_state(self):
+        keys = sorted(self.keys, key=self.keys.get)
+        with open(self.fpath_state + '.tmp', 'wb') as f:
+            np.savez(f, dates=np.array([k[0] for k in keys], dtype=str),
+                     outlets=np.array([k[1] for k in keys], dtype=str),
+                     count=self.count, sums=self.sums, sumsq=self.sumsq,
+                     hist=self.hist)
+        with open(self.fpath_offsets + '.tmp', 'w') as f:
+            json.dump(self.offsets, f, indent=2, sort_keys=True)
+        os.replace(self.fpath_state + '.tmp', self.fpath_state)
+        os.replace(self.fpath_offsets + '.tmp', self.fpath_offsets)
+
+    def _iter_new(self, start=None, end=None):
+        """
+        (date, outlet, text) of the articles not included yet. Advances the
+        partition offsets as rows are read.
+        """
+        for date in self.store.partitions(start, end):
+            offset = self.offsets.get(date, 0)
+            n_rows = 0
+            for df in self.store.iter_batches(date, date,
+                                              columns=['outlet', 'text']):
+                new = df.iloc[max(offset - n_rows, 0):]
+                n_rows += len(df)
+                outlets = new['outlet'].fillna('unknown').astype(str)
+                for outlet, text in zip(outlets, new['text']):
+                    yield date, outlet, text
+            self.offsets[date] = max(n_rows, offset)
+
+    def _index(self, keys):
+        """
+        Row of each (date, outlet) key in the statistics, adding new rows.
+        """
+        new = [k for k in dict.fromkeys(keys) if k not in self.keys]
+        if new:
+            for k in new:
+                self.keys[k] = len(self.keys)
+            n = len(new)
+            self.count = np.concatenate([self.count, np.zeros(n, np.int64)])
+            self.sums = np.concatenate([self.sums,
+                                        np.zeros((n, len(SCORES)))])
+            self.sumsq = np.concatenate([self.sumsq,
+                                         np.zeros((n, len(SCORES)))])
+            self.hist = np.concatenate(
+                [self.hist, np.zeros((n, len(SCORES), N_BINS), np.int64)])
+        return np.array([self.keys[k] for k in keys], dtype=np.int64)
+
+    def _add(self, keys, scores):
+        """
+        Add a chunk of scores to the statistics of their keys.
+        """
+        rows = self._index(keys)
+        values = np.column_stack([scores[s].astype(np.float64)
+                                  for s in SCORES])
+        np.add.at(self.count, rows, 1)
+        np.add.at(self.sums, rows, values)
+        np.add.at(self.sumsq, rows, values ** 2)
+        for j, score in enumerate(SCORES):
+            lo, hi = SCORE_RANGES[score]
+            bins = np.clip(((values[:, j] - lo) / (hi - lo) * N_BINS)
+                           .astype(np.int64), 0, N_BINS - 1)
+            np.add.at(self.hist[:, j], (rows, bins), 1)
+
+    def update(self, start=None, end=None, n_jobs=None, chunksize=None):
+        """
+        Score the articles appended to the store since the last update and
+        add them to the statistics.
+
+        Parameters
+        ----------
+        start, end : str or pd.Timestamp, optional
+            Only consider store partitions of these dates.
+        n_jobs : int, optional
+            Number of scoring processes, see iter_sentiment.
+        chunksize : int, optional
+            Number of articles per scoring task, see iter_sentiment.
+
+        Returns
+        -------
+        int
+            Number of articles added.
+        """
+        logger = logging.getLogger(__name__)
+        keys = deque()
+
+        def texts():
+            for date, outlet, text in self._iter_new(start, end):
+                keys.append((date, outlet))
+                yield text
+
+        n_added = 0
+        for scores in iter_sentiment(texts(), n_jobs=n_jobs,
+                                     chunksize=chunksize):
+            self._add([keys.popleft() for _ in range(len(scores))], scores)
+            n_added += len(scores)
+        self._save_state()
+        logger.info('Added {} articles to the daily sentiment.'.format(
+            n_added))
+        return n_added
+
+    def to_dataset(self, time=None):
+        """
+        Daily statistics as xr.Dataset with dims (time, outlet).
+
+        Parameters
+        ----------
+        time : array_like of datetime64, optional
+            Time coordinate to align to. Defaults to the time coordinate of
+            the CSSE dataset. Days without articles have count 0 and NaN
+            statistics; articles outside of it are left out.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        if time is None:
+            with CSSEReader(self.dirname).read_processed2ds() as ds:
+                time = ds['time'].values
+        time = pd.DatetimeIndex(time)
+
+        keys = sorted(self.keys, key=self.keys.get)
+        outlets = sorted({o for _, o in keys}) + [ALL_OUTLETS]
+        t_pos = pd.Index(time).get_indexer(pd.DatetimeIndex(
+            [d for d, _ in keys]))
+        o_pos = pd.Index(outlets).get_indexer([o for _, o in keys])
+
+        # scatter (date, outlet) rows into (time, outlet) arrays; the last
+        # outlet pools all others
+        shape = (len(time), len(outlets))
+        count = np.zeros(shape, dtype=np.int64)
+        sums = np.zeros(shape + (len(SCORES),))
+        sumsq = np.zeros(shape + (len(SCORES),))
+        hist = np.zeros(shape + (len(SCORES), N_BINS), dtype=np.int64)
+        valid = t_pos >= 0
+        for target in (o_pos[valid], np.full(valid.sum(), len(outlets) - 1)):
+            idx = (t_pos[valid], target)
+            np.add.at(count, idx, self.count[valid])
+            np.add.at(sums, idx, self.sums[valid])
+            np.add.at(sumsq, idx, self.sumsq[valid])
+            np.add.at(hist, idx, self.hist[valid])
+
+        dims = ['time', 'outlet']
+        data_vars = {'article_count': (dims, count.astype(np.int32))}
+        n = count[..., None].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / n
+            std = np.sqrt(np.maximum(sumsq / n - mean ** 2, 0.))
+        for j, score in enumerate(SCORES):
+            lo, hi = SCORE_RANGES[score]
+            data_vars['sentiment_{}_mean'.format(score)] = \
+                (dims, mean[..., j].astype(np.float32))
+            data_vars['sentiment_{}_std'.format(score)] = \
+                (dims, std[..., j].astype(np.float32))
+            data_vars['sentiment_{}_quantile'.format(score)] = \
+                (dims + ['quantile'],
+                 histogram_quantiles(hist[..., j, :], lo, hi)
+                 .astype(np.float32))
+
+        coords = {'time': time.values, 'outlet': outlets,
+                  'quantile': QUANTILES}
+        return xr.Dataset(data_vars=data_vars, coords=coords)
+
+    def build(self, n_jobs=None):
+        """
+        Update the statistics and write them aligned to the CSSE dataset.
+
+        Returns
+        -------
+        None
+        """
+        logger = logging.getLogger(__name__)
+        self.update(n_jobs=n_jobs)
+        ds = self.to_dataset()
+        logger.info('Writing {}.'.format(self.fpath_sentiment))
+        encoding = {var: dict(zlib=True, complevel=5)
+                    for var in ds.data_vars}
+        ds.to_netcdf(self.fpath_sentiment + '.tmp', mode='w',
+                     encoding=encoding, engine='netcdf4')
+        os.replace(self.fpath_sentiment + '.tmp', self.fpath_sentiment)
+        count(bytes_out=os.path.getsize(self.fpath_sentiment))
+        return None
+
+    def read_sentiment(self):
+        """
+        Read the daily sentiment written by build.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        return xr.open_dataset(self.fpath_sentiment, engine='netcdf4')
+
+    def merge(self, ds, outlet=None):
+        """
+        Add the daily sentiment as variables to a CSSE dataset.
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            Dataset with a time dimension, e.g. from read_processed2ds.
+        outlet : str, optional
+            Only add the statistics of this outlet (or 'all'), without the
+            outlet dimension.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        with self.read_sentiment() as sentiment:
+            sentiment = sentiment.reindex(time=ds['time']).load()
+        sentiment['article_count'] = sentiment['article_count'] \
+            .fillna(0).astype(np.int32)
+        if outlet is not None:
+            sentiment = sentiment.sel(outlet=outlet, drop=True)
+        return xr.merge([ds, sentiment])
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    DailySentiment(dirname='csse').build()
@@ -1,42 +1,247 @@
+"""
+Text features of newspaper articles: sentiment scores, normalized tokens,
+part-of-speech ratios.
+
+NLP models and corpora are expensive to load, so they are not created at
+import time. They are registered as resources and created on first use by
+get_resource (or up front with warmup) and cached per process.
+"""
 import os
+import threading
 import numpy as np
+from itertools import chain, islice
 from string import punctuation
-from collections import Counter
-
-import spacy
-import nltk
-from nltk import word_tokenize, ngrams
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer, WordNetLemmatizer
-from nltk.tag import perceptron
-
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfVectorizer  #up-weights rare/distinctive words
-from sklearn.feature_extraction.text import HashingVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_selection import SelectKBest, chi2, f_classif, \
-    f_regression, f_classif, mutual_info_classif
-
-# download nltk data
-nltk_data = {'stopwords': 'corpora/stopwords',
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from src.utils.cache import LRUCache
+from src.utils.iterables import chunked
+from src.utils.paths import get_parent_dir
+from src.utils.profiling import Timer, profiled, count, register_cache
+
+# nltk data required by the resources below
+NLTK_DATA = {'stopwords': 'corpora/stopwords',
              'punkt': 'tokenizers/punkt',
-             'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger'}
+             'averaged_perceptron_tagger':
+                 'taggers/averaged_perceptron_tagger',
+             'vader_lexicon': 'sentiment/vader_lexicon.zip'}
+
+# size of the word-level stem cache (word frequencies are Zipf distributed,
+# so a few thousand entries serve most tokens)
+CACHE_SIZE = 100000
+CACHE_DIR = os.path.join(get_parent_dir(up=2), 'data', 'interim')
+
+# "global" objects
+translator = str.maketrans('', '', punctuation)
 
-for pkg, path in nltk_data.items():
+# registry of lazily created resources: name -> factory, name -> instance
+_factories = {}
+_resources = {}
+_lock = threading.RLock()
+
+
+def resource(name):
+    """
+    Decorator registering a factory function for a lazily created resource.
+
+    Parameters
+    ----------
+    name : str
+        Name under which the resource is available through get_resource.
+    """
+    def register(factory):
+        _factories[name] = factory
+        return factory
+    return register
+
+
+def get_resource(name):
+    """
+    Get a resource, creating it on first use. Resources are created once per
+    process and cached.
+
+    Parameters
+    ----------
+    name : str
+        One of 'sid', 'stopwords', 'nlp', 'nlp_tagger', 'stemmer',
+        'tagger', 'word_tokenize', 'stem_cache'.
+
+    Returns
+    -------
+    The resource.
+    """
+    try:
+        return _resources[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _resources:
+            _resources[name] = _factories[name]()
+    return _resources[name]
+
+
+def warmup(names=None):
+    """
+    Create resources up front, e.g. when a server or worker starts, so that
+    the first request does not pay for loading them.
+
+    Parameters
+    ----------
+    names : list of str, optional
+        Resources to create. Defaults to all registered resources.
+    """
+    for name in names or list(_factories):
+        get_resource(name)
+
+
+def ensure_nltk_data(pkg):
+    """
+    Download nltk data if it is not available yet.
+
+    Parameters
+    ----------
+    pkg : str
+        Name of the nltk package, see NLTK_DATA.
+    """
+    import nltk
     try:
-        nltk.data.find(path)
+        nltk.data.find(NLTK_DATA[pkg])
     except LookupError as e:
         print(e)
         nltk.download(pkg)
 
-# "global" objects
-sid = SentimentIntensityAnalyzer()
-stopwords = set(stopwords.words('english'))
-nlp = spacy.load('en_core_web_sm')
-stemmer = SnowballStemmer('english')
-translator = str.maketrans('', '', punctuation)
-tagger = perceptron.PerceptronTagger()
+
+@resource('sid')
+def _load_sid():
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    ensure_nltk_data('vader_lexicon')
+    return SentimentIntensityAnalyzer()
+
+
+@resource('stopwords')
+def _load_stopwords():
+    from nltk.corpus import stopwords
+    ensure_nltk_data('stopwords')
+    return set(stopwords.words('english'))
+
+
+@resource('nlp')
+def _load_nlp():
+    import spacy
+    return spacy.load('en_core_web_sm')
+
+
+@resource('nlp_tagger')
+def _load_nlp_tagger():
+    # only tokenizer and tagger are needed for text features
+    import spacy
+    return spacy.load('en_core_web_sm', disable=['parser', 'ner'])
+
+
+@resource('stemmer')
+def _load_stemmer():
+    from nltk.stem import SnowballStemmer
+    return SnowballStemmer('english')
+
+
+@resource('stem_cache')
+def _load_stem_cache():
+    return LRUCache(maxsize=CACHE_SIZE)
+
+
+@resource('tagger')
+def _load_tagger():
+    from nltk.tag import perceptron
+    ensure_nltk_data('averaged_perceptron_tagger')
+    return perceptron.PerceptronTagger()
+
+
+@resource('word_tokenize')
+def _load_word_tokenize():
+    from nltk import word_tokenize
+    ensure_nltk_data('punkt')
+    return word_tokenize
+
+
+def stem(word):
+    """
+    Stem a word with the Snowball stemmer, memoized in a bounded LRU cache
+    shared by all text feature functions.
+
+    Parameters
+    ----------
+    word : str
+        Lower case word.
+
+    Returns
+    -------
+    str
+        Stem.
+    """
+    return get_resource('stem_cache').get_or_compute(
+        word, get_resource('stemmer').stem)
+
+
+def cache_stats():
+    """
+    Hit/miss statistics of the stem cache.
+
+    Returns
+    -------
+    dict
+        Statistics per cache, see LRUCache.stats.
+    """
+    return {'stem': get_resource('stem_cache').stats()}
+
+
+def _created_cache_stats():
+    """
+    Statistics of the stem cache, if created in this process, for the
+    pipeline measurements (see src.utils.profiling).
+    """
+    if 'stem_cache' not in _resources:
+        return {}
+    return {'stem': _resources['stem_cache'].stats()}
+
+
+register_cache('sentiments', _created_cache_stats)
+
+
+def save_caches(cache_dir=CACHE_DIR):
+    """
+    Save the stem cache to disk, e.g. before shutting down.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache files.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    get_resource('stem_cache').save(os.path.join(cache_dir, 'stem_cache.pkl'))
+
+
+def load_caches(cache_dir=CACHE_DIR):
+    """
+    Load the stem cache saved by save_caches, so that a restarted process
+    starts with a warm cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache files.
+    """
+    get_resource('stem_cache').load(os.path.join(cache_dir, 'stem_cache.pkl'))
+
+
+def __getattr__(name):
+    """
+    Keep the former module level objects (sid, stopwords, nlp, stemmer,
+    tagger) available as attributes, created on first access.
+    """
+    if name in _factories:
+        return get_resource(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
 
 
 def get_words_per_doc(txt):
@@ -74,10 +279,140 @@ def compute_sentiment(series, all=False):
     -------
     A series of sentiment score(s).
     """
+    sid = get_resource('sid')
     if all:
         return sid.polarity_scores(series)['compound']
     return sid.polarity_scores(series)
 
+
+# chunk sizes of the batch scoring: default for corpora of unknown length,
+# lower bound when derived from the length, and chunks per worker
+CHUNKSIZE = 1000
+MIN_CHUNKSIZE = 100
+CHUNKS_PER_JOB = 4
+
+# scores returned by compute_sentiment_batch
+SENTIMENT_DTYPE = np.dtype([('neg', np.float32), ('neu', np.float32),
+                            ('pos', np.float32), ('compound', np.float32)])
+
+
+def _init_sentiment_worker():
+    """
+    Create one analyzer per worker process.
+    """
+    global _worker_sid
+    _worker_sid = get_resource('sid')
+
+
+def _score_chunk(docs):
+    """
+    Score a list of documents with the analyzer of the current worker.
+    """
+    scores = np.empty(len(docs), dtype=SENTIMENT_DTYPE)
+    for i, doc in enumerate(docs):
+        s = _worker_sid.polarity_scores(doc if isinstance(doc, str) else '')
+        scores[i] = (s['neg'], s['neu'], s['pos'], s['compound'])
+    return scores
+
+
+def get_chunksize(docs, n_jobs):
+    """
+    Number of documents per scoring task: about CHUNKS_PER_JOB chunks per
+    worker if the number of documents is known, but at least MIN_CHUNKSIZE
+    documents, so that the transfer to the workers stays cheap.
+
+    Parameters
+    ----------
+    docs : iterable of str
+        Documents. Their number is known for sequences, e.g. a pd.Series.
+    n_jobs : int
+        Number of worker processes.
+
+    Returns
+    -------
+    int
+    """
+    if not hasattr(docs, '__len__'):
+        return CHUNKSIZE
+    n_chunks = CHUNKS_PER_JOB * n_jobs
+    return max(-(-len(docs) // n_chunks), MIN_CHUNKSIZE)
+
+
+def iter_sentiment(docs, n_jobs=None, chunksize=None):
+    """
+    Score documents in chunks across a process pool. Chunks are yielded in
+    input order as they are done; at most two chunks per worker are in
+    flight, so docs can be a generator over a corpus larger than memory.
+    If all documents fit into a single chunk, they are scored in the
+    current process, which saves starting the pool.
+
+    Parameters
+    ----------
+    docs : iterable of str
+        Documents, e.g. a pd.Series. Missing documents (NaN, None) are
+        scored as empty strings.
+    n_jobs : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With 1,
+        documents are scored in the current process.
+    chunksize : int, optional
+        Number of documents per task. Defaults to get_chunksize.
+
+    Returns
+    -------
+    generator of np.ndarray
+        Scores per chunk as structured arrays of SENTIMENT_DTYPE.
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    chunks = chunked(docs, chunksize or get_chunksize(docs, n_jobs))
+    head = list(islice(chunks, 2))
+    chunks = chain(head, chunks)
+
+    if n_jobs == 1 or len(head) < 2:
+        _init_sentiment_worker()
+        for chunk in chunks:
+            yield _score_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(n_jobs,
+                             initializer=_init_sentiment_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_score_chunk, chunk))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@profiled
+def compute_sentiment_batch(docs, n_jobs=None, chunksize=None):
+    """
+    Compute sentiment scores for many documents in parallel. Use instead of
+    compute_sentiment with .apply() for large corpora.
+
+    Parameters
+    ----------
+    docs : iterable of str
+        Documents, e.g. a pd.Series.
+    n_jobs : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    chunksize : int, optional
+        Number of documents per task. Defaults to get_chunksize.
+
+    Returns
+    -------
+    scores : np.ndarray
+        Structured array with fields neg, neu, pos, compound (float32), one
+        row per document. Use pd.DataFrame(scores) to get a data frame.
+    """
+    scores = list(iter_sentiment(docs, n_jobs=n_jobs, chunksize=chunksize))
+    n_docs = sum(len(chunk) for chunk in scores)
+    count(rows_in=n_docs, rows_out=n_docs)
+    if not scores:
+        return np.empty(0, dtype=SENTIMENT_DTYPE)
+    return np.concatenate(scores)
+
+
 def normalize_text(text):
     """
     Process text to clean list of tokens.
@@ -91,13 +426,15 @@ def normalize_text(text):
     -------
     Clean, stemmed list of tokens.
     """
+    stopwords = get_resource('stopwords')
+
     text = text.replace('\r', ' ').replace('\n', ' ')
     lower = text.lower()  # all lower case
     nopunc = lower.translate(translator)  # remove punctuation
     words = nopunc.split()  # split into tokens
     nostop = [w for w in words if w not in stopwords]  # remove stopwords
     no_numbers = [w if not w.isdigit() else '#' for w in nostop]  # normalize
-    stemmed = [stemmer.stem(w) for w in no_numbers]  # stem each word
+    stemmed = [stem(w) for w in no_numbers]  # stem each word (cached)
     return stemmed
 
 
@@ -114,7 +451,93 @@ def get_nouns_adj(text):
     -------
     Tuple of the number of nouns and adjectives.
     """
+    tagger = get_resource('tagger')
+    word_tokenize = get_resource('word_tokenize')
     tags = [x[1] for x in tagger.tag(word_tokenize(text))]
     num_nouns = len([t for t in tags if t[0] == 'N']) / len(tags)
     num_adj = len([t for t in tags if t[0] == 'J']) / len(tags)
     return num_nouns, num_adj
+
+
+# text features of one document, see iter_text_features
+TextFeatures = namedtuple('TextFeatures', ['tokens', 'n_words', 'nouns',
+                                           'adj'])
+
+# name of the measurements of iter_text_features
+_TEXT_FEATURES = '{}.iter_text_features'.format(__name__)
+
+
+def iter_text_features(docs, batch_size=1000, n_process=1, cache_dir=None):
+    """
+    Stream text features of many documents in a single pass through spaCy's
+    nlp.pipe, instead of tokenizing each document separately for
+    normalize_text, get_nouns_adj and get_words_per_doc. Only the tokenizer
+    and the tagger of the spaCy model are run.
+
+    The results are close to, but not identical with, those of the per
+    document functions, since spaCy tokenizes differently than str.split
+    and nltk's word_tokenize (e.g. "don't" becomes "do", "n't").
+
+    Parameters
+    ----------
+    docs : iterable of str
+        Documents, e.g. a pd.Series or a generator. Missing documents (NaN,
+        None) are treated as empty strings.
+    batch_size : int
+        Number of documents per spaCy batch.
+    n_process : int
+        Number of spaCy worker processes.
+    cache_dir : str, optional
+        If given, the stem cache is loaded from this directory before the
+        first document and saved to it after the last, see load_caches.
+
+    Returns
+    -------
+    generator of TextFeatures
+        Per document, in input order:
+            tokens : clean, stemmed list of tokens (see normalize_text)
+            n_words : number of words, i.e. tokens that are not punctuation
+            nouns, adj : share of nouns and adjectives among all tokens
+                (see get_nouns_adj), NaN for empty documents
+    """
+    nlp = get_resource('nlp_tagger')
+    stopwords = get_resource('stopwords')
+    if cache_dir is not None:
+        load_caches(cache_dir)
+
+    texts = (doc if isinstance(doc, str) else '' for doc in docs)
+    stream = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    while True:
+        # measured per batch, not per document, see src.utils.profiling
+        with Timer(_TEXT_FEATURES):
+            batch = [_text_features(doc, stopwords)
+                     for doc in islice(stream, batch_size)]
+            count(rows_in=len(batch), rows_out=len(batch))
+        if not batch:
+            break
+        yield from batch
+    if cache_dir is not None:
+        save_caches(cache_dir)
+
+
+def _text_features(doc, stopwords):
+    """
+    TextFeatures of a document tagged by spaCy.
+    """
+    tags = [token.tag_ for token in doc if not token.is_space]
+    words = [token.lower_ for token in doc
+             if not (token.is_punct or token.is_space)]
+
+    tokens = []
+    for word in words:
+        word = word.translate(translator)  # remove punctuation
+        if not word or word in stopwords:
+            continue
+        tokens.append('#' if word.isdigit() else stem(word))
+
+    if tags:
+        nouns = sum(tag[:1] == 'N' for tag in tags) / len(tags)
+        adj = sum(tag[:1] == 'J' for tag in tags) / len(tags)
+    else:
+        nouns, adj = np.nan, np.nan
+    return TextFeatures(tokens, len(words), nouns, adj)
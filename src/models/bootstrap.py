@@ -0,0 +1,362 @@
+"""
+Wild cluster bootstrap of panel regressions.
+
+The bootstrap tests beta_j = 0 for each parameter j with the null imposed
+(WCR, Cameron, Gelbach and Miller 2008): bootstrap samples are
+y* = X_r b_r + u_r * v_g, where X_r b_r and u_r are the fit and the
+residuals of the model without regressor j and v_g a random weight per
+cluster. Instead of refitting the model for every replication, the
+bootstrap t statistics are computed from quantities of the clusters that
+are computed once per parameter (as in Roodman et al. 2019, "Fast and wild"):
+with the scores c_g = X_g'u_r of the restricted residuals, the cluster
+cross-products H_g = X_g'X_g and (X'X)^-1,
+
+    t*_j = q'v / sqrt(scale * sum_g (q_g v_g - r_g'A v)^2)
+
+where q_g = c_g'(X'X)^-1 e_j, A = (X'X)^-1 C' and r_g = H_g (X'X)^-1 e_j.
+A batch of replications is then a few matrix products with the (cluster,
+replication) matrix of weights. Batches are spread across a process pool
+and seeded from one np.random.SeedSequence, so results depend on the seed
+and the batch size only, not on the number of workers.
+
+The formula assumes that the fixed effects are nested in the clusters, so
+that u_r * v_g is still within transformed. Otherwise (e.g. time effects
+with state clusters) the refit demeans u_r * v_g again, which moves
+residuals between clusters: q_g v_g becomes (Q v)_g, where Q_gh is the
+weighted score of cluster g of the within transformed restricted residuals
+of cluster h. Q costs one within transformation per cluster and parameter.
+"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+from src.models.train_model import CONST, DEPENDENT, inverse
+
+WEIGHTS = ['rademacher', 'mammen', 'webb']
+
+# support of Webb's six point distribution
+WEBB = np.sqrt(np.array([1.5, 1., .5, .5, 1., 1.5])) * \
+    np.array([-1, -1, -1, 1, 1, 1])
+
+
+def draw_weights(rng, n_clusters, size, weights='rademacher'):
+    """
+    Bootstrap weights of the clusters.
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+    n_clusters : int
+    size : int
+        Number of replications.
+    weights : str
+        One of WEIGHTS: 'rademacher' (+-1), 'mammen' (two point
+        distribution with skewness 1) or 'webb' (six points, for few
+        clusters).
+
+    Returns
+    -------
+    np.ndarray
+        Weights with dims (cluster, replication).
+    """
+    shape = (n_clusters, size)
+    if weights == 'rademacher':
+        return rng.integers(0, 2, shape) * 2. - 1.
+    if weights == 'mammen':
+        sqrt5 = np.sqrt(5)
+        return np.where(rng.random(shape) < (sqrt5 + 1) / (2 * sqrt5),
+                        (1 - sqrt5) / 2, (1 + sqrt5) / 2)
+    if weights == 'webb':
+        return WEBB[rng.integers(0, len(WEBB), shape)]
+    raise IOError("Weights do not exist. Choose one of "
+                  "{}.".format(", ".join(WEIGHTS)))
+
+
+def bootstrap_tstats(rng, size, parts, scale, n_clusters,
+                     weights='rademacher'):
+    """
+    Bootstrap t statistics of one batch of replications.
+
+    Parameters
+    ----------
+    rng : np.random.Generator
+    size : int
+        Number of replications.
+    parts : list of tuple
+        (q, r, a) per tested parameter, see WildClusterBootstrap.prepare.
+        q is a matrix (cluster, cluster) if the effects are not nested in
+        the clusters.
+    scale : float
+        Degrees of freedom correction of the covariance.
+    n_clusters : int
+    weights : str
+        See draw_weights.
+
+    Returns
+    -------
+    np.ndarray
+        t statistics with dims (parameter, replication).
+    """
+    v = draw_weights(rng, n_clusters, size, weights)
+    tstats = np.empty((len(parts), size))
+    for i, (q, r, a) in enumerate(parts):
+        own = q[:, None] * v if q.ndim == 1 else q @ v
+        scores = own - r @ (a @ v)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tstats[i] = own.sum(axis=0) / np.sqrt(
+                scale * (scores ** 2).sum(axis=0))
+    return tstats
+
+
+class WildClusterBootstrap(object):
+    """
+    Restricted wild cluster bootstrap of the parameters of a panel
+    regression.
+    """
+    def __init__(self, panel, dependent, exog, clusters, weights='rademacher',
+                 debiased=True, drop_absorbed=False):
+        """
+        Parameters
+        ----------
+        panel : src.models.train_model.Panel
+            Panel of the model.
+        dependent : str
+            Dependent variable.
+        exog : list of str
+            Regressors, without the constant.
+        clusters : str or array_like
+            'entity' (county), 'time', or cluster ids broadcastable to
+            (time, county), e.g. state FIPS codes per county, see
+            Panel.clusters.
+        weights : str
+            One of WEIGHTS.
+        debiased : bool
+            Degrees of freedom correction as in Panel.fit.
+        drop_absorbed : bool
+            See Panel.fit.
+        """
+        if weights not in WEIGHTS:
+            raise IOError("Weights do not exist. Choose one of "
+                          "{}.".format(", ".join(WEIGHTS)))
+        self.panel = panel
+        self.dependent = dependent
+        self.weights = weights
+        self.names = panel.regressors(exog, drop_absorbed)
+        self.codes, self.n_clusters = panel.clusters(clusters)
+
+        xx, xy = panel.cross_products(self.names, dependent)
+        self.xx_inv = inverse(xx, self.names)
+        self.params = self.xx_inv @ xy
+        self.nested = panel.nested(self.codes)
+        extra_df = 0 if self.nested else None
+        self.scale = panel.scale(len(self.names), debiased, extra_df)
+        self.df_resid = panel.nobs - len(self.names) - panel.n_effects
+        self.debiased = debiased
+
+        resid = panel.residuals(dependent, self.names, self.params)
+        scores = panel.scores(self.names, resid, self.codes, self.n_clusters)
+        self.cov = self.xx_inv @ (scores.T @ scores) @ self.xx_inv * \
+            self.scale
+        self._hessians = None
+        self.draws = None
+
+    @classmethod
+    def from_model(cls, model, clusters, **kwargs):
+        """
+        Bootstrap of a FixedEffects model.
+        """
+        return cls(model.panel, DEPENDENT, model.exog, clusters,
+                   drop_absorbed=model.drop_absorbed, **kwargs)
+
+    def hessians(self):
+        """
+        Cross-products X_g'X_g of the clusters, computed once.
+
+        Returns
+        -------
+        np.ndarray
+            Dims (cluster, regressor, regressor).
+        """
+        if self._hessians is not None:
+            return self._hessians
+        k = len(self.names)
+        h = np.empty((self.n_clusters, k, k))
+        for i, a in enumerate(self.names):
+            for j, b in enumerate(self.names[:i + 1]):
+                h[:, i, j] = h[:, j, i] = self.panel.cluster_sums(
+                    self.panel.within(a) * self.panel.within(b), self.codes,
+                    self.n_clusters)
+        self._hessians = h
+        return h
+
+    def prepare(self, param):
+        """
+        Cluster quantities of the test of one parameter.
+
+        Parameters
+        ----------
+        param : str
+            One of the regressors.
+
+        Returns
+        -------
+        q : np.ndarray
+            (X'X)^-1 row of the parameter times the restricted scores, per
+            cluster. With effects that are not nested in the clusters, dims
+            (cluster, cluster): the same of the within transformed
+            restricted residuals of each cluster (columns).
+        r : np.ndarray
+            H_g (X'X)^-1 e_j, dims (cluster, regressor).
+        a : np.ndarray
+            (X'X)^-1 C', dims (regressor, cluster).
+        """
+        j = self.names.index(param)
+        restricted = [name for name in self.names if name != param]
+        if restricted:
+            xx, xy = self.panel.cross_products(restricted, self.dependent)
+            params = np.linalg.solve(xx, xy)
+        else:
+            params = []
+        resid = self.panel.residuals(self.dependent, restricted, params)
+        scores = self.panel.scores(self.names, resid, self.codes,
+                                   self.n_clusters)
+        if self.panel.has_effects and not self.nested:
+            q = self.transformed_scores(resid, self.xx_inv[:, j])
+        else:
+            q = scores @ self.xx_inv[:, j]
+        r = self.hessians() @ self.xx_inv[:, j]
+        a = self.xx_inv @ scores.T
+        return q, r, a
+
+    def transformed_scores(self, resid, weights):
+        """
+        Scores of the within transformed residuals of every cluster, for
+        effects that are not nested in the clusters.
+
+        Parameters
+        ----------
+        resid : np.ndarray
+            Restricted residuals with dims (time, county).
+        weights : np.ndarray
+            Weights of the regressors, (X'X)^-1 e_j.
+
+        Returns
+        -------
+        np.ndarray
+            Dims (cluster, cluster): element (g, h) is the weighted score of
+            cluster g of the within transformed residuals of cluster h.
+        """
+        x = sum(w * self.panel.within(name)
+                for w, name in zip(weights, self.names))
+        codes = np.broadcast_to(self.codes, self.panel.shape)
+        q = np.empty((self.n_clusters, self.n_clusters))
+        for h in range(self.n_clusters):
+            u = self.panel.transform(np.where(codes == h, resid, 0.))
+            q[:, h] = self.panel.cluster_sums(x * u, self.codes,
+                                              self.n_clusters)
+        return q
+
+    def test(self, params=None, reps=9999, seed=0, n_jobs=None,
+             batch_size=1000):
+        """
+        Bootstrap p-values of beta_j = 0.
+
+        Parameters
+        ----------
+        params : list of str, optional
+            Parameters to test. Defaults to all regressors but the
+            constant.
+        reps : int
+            Number of bootstrap replications.
+        seed : int
+            Seed of the np.random.SeedSequence of the batches.
+        n_jobs : int, optional
+            Number of worker processes. Defaults to the number of CPUs. With
+            1, replications run in the current process.
+        batch_size : int
+            Replications per batch (and task).
+
+        Returns
+        -------
+        pd.DataFrame
+            Per parameter: estimate, std_error (clustered), tstat, pvalue
+            (analytic), boot_pvalue (symmetric bootstrap p-value). The
+            bootstrap t statistics are kept in self.draws (replication x
+            parameter).
+        """
+        logger = logging.getLogger(__name__)
+        if params is None:
+            params = [name for name in self.names if name != CONST]
+        parts = [self.prepare(param) for param in params]
+
+        sizes = [min(batch_size, reps - start)
+                 for start in range(0, reps, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        tasks = list(zip(seeds, sizes))
+        logger.info('Running {} bootstrap replications in {} batches.'.format(
+            reps, len(tasks)))
+        args = (parts, self.scale, self.n_clusters, self.weights)
+        if n_jobs == 1 or len(tasks) == 1:
+            _init_bootstrap_worker(*args)
+            batches = [_bootstrap_batch(task) for task in tasks]
+        else:
+            n_jobs = min(n_jobs or os.cpu_count(), len(tasks))
+            with ProcessPoolExecutor(n_jobs,
+                                     initializer=_init_bootstrap_worker,
+                                     initargs=args) as pool:
+                batches = list(pool.map(_bootstrap_batch, tasks))
+        draws = np.concatenate(batches, axis=1)
+        self.draws = pd.DataFrame(draws.T, columns=params)
+
+        pos = [self.names.index(param) for param in params]
+        estimate = self.params[pos]
+        std_error = np.sqrt(np.diag(self.cov))[pos]
+        tstat = estimate / std_error
+        dist = stats.t(self.df_resid) if self.debiased else stats.norm()
+        exceed = np.abs(draws) >= np.abs(tstat)[:, None]
+        return pd.DataFrame({'estimate': estimate,
+                             'std_error': std_error,
+                             'tstat': tstat,
+                             'pvalue': 2 * dist.sf(np.abs(tstat)),
+                             'boot_pvalue': exceed.mean(axis=1)},
+                            index=pd.Index(params, name='parameter'))
+
+
+def _init_bootstrap_worker(parts, scale, n_clusters, weights):
+    """
+    Keep the cluster quantities of the tests in the current worker.
+    """
+    global _worker_args
+    _worker_args = (parts, scale, n_clusters, weights)
+
+
+def _bootstrap_batch(task):
+    """
+    t statistics of one batch of replications.
+    """
+    seed, size = task
+    parts, scale, n_clusters, weights = _worker_args
+    return bootstrap_tstats(np.random.default_rng(seed), size, parts, scale,
+                            n_clusters, weights)
+
+
+if __name__ == '__main__':
+    from src.data.reader import CSSEReader
+    from src.data.covariates import read_covariates
+    from src.data.cube import state_fips
+    from src.models.train_model import FixedEffects, county_covariates
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # state clustered inference for confirmed cases on population
+    with CSSEReader('csse').read_processed2ds() as ds:
+        confirmed = ds['confirmed'].values
+        county = ds['county'].values
+    population = county_covariates(
+        read_covariates('POPEST', ['population']), county)
+    model = FixedEffects(confirmed, population, time_effects=True)
+    boot = WildClusterBootstrap.from_model(model, state_fips(county))
+    print(boot.test(reps=9999))
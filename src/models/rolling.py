@@ -0,0 +1,521 @@
+"""
+Rolling-window and event-study panel regressions.
+
+RollingRegression estimates a panel regression on every window of a fixed
+number of dates along the time axis of the (time, county) arrays. Instead
+of demeaning and refitting each window from scratch, it computes the
+cross-products of the variables once per date and keeps their cumulative
+sums, so the X'X and X'y of a window are differences of two cumulative
+sums. The county fixed effects only need the sums of the variables per
+county in the window, which are updated incrementally as the window moves:
+the rows entering the window are added and the rows leaving it subtracted.
+A window then costs O(county) instead of O(window x county), i.e. the whole
+rolling regression costs about as much as one fit on the full sample.
+
+Dummies of an event study (see event_study) are scipy.sparse matrices with
+dims (time, county) and one non-zero per treated county and relative
+period, and enter the cross-products without being expanded to dense
+arrays.
+
+Estimates, standard errors (unadjusted) and R^2 are those of
+src.models.train_model.Panel on the observations of each window. Two-way
+effects on unbalanced panels have no closed form within transformation;
+such models are fit per window with Panel.
+"""
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.models.train_model import Panel, as_panel, sample, total, \
+    count_effects, inverse, CONST
+from src.models.specifications import statistics
+
+
+def event_rows(time, dates):
+    """
+    Rows of event dates on a regularly spaced time axis, e.g. daily.
+
+    Parameters
+    ----------
+    time : array_like
+        Sorted dates of the rows.
+    dates : array_like
+        Event dates, NaT if there is no event.
+
+    Returns
+    -------
+    np.ndarray
+        Float row of every date (the first row on or after it), which may
+        lie before or after the time axis. NaN for NaT.
+    """
+    time = np.asarray(time, dtype='datetime64[D]')
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    step = time[1] - time[0] if len(time) > 1 else np.timedelta64(1, 'D')
+    return np.ceil((dates - time[0]) / step)
+
+
+def event_name(period):
+    """
+    Name of the dummy of a period relative to the event, e.g. "lead3" for
+    three dates before and "lag0" for the date of the event.
+    """
+    if period < 0:
+        return 'lead{}'.format(-period)
+    return 'lag{}'.format(period)
+
+
+def _ranges(begin, end):
+    """
+    Concatenated ranges begin[i], ..., end[i] - 1 and their positions i.
+    """
+    counts = np.maximum(end - begin, 0)
+    pos = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    return begin[pos] + offsets, pos
+
+
+def event_study(time, dates, leads=5, lags=10, reference=-1,
+                bin_endpoints=True):
+    """
+    Relative time dummies of an event study design.
+
+    The dummy of period k is one at the date k steps after the event of a
+    county. Counties without an event are controls and have no non-zero.
+
+    Parameters
+    ----------
+    time : array_like
+        Sorted, regularly spaced dates of the time axis, e.g.
+        ds['time'].values.
+    dates : array_like
+        Event date per county, NaT for counties without an event, e.g. from
+        state_event_dates.
+    leads, lags : int
+        Dummies of the periods -leads, ..., lags.
+    reference : int
+        Omitted period, the baseline of the estimates.
+    bin_endpoints : bool
+        The first and last dummies include all earlier and later periods,
+        respectively.
+
+    Returns
+    -------
+    OrderedDict
+        Name (see event_name) -> scipy.sparse.csr_matrix with dims (time,
+        county), in the order of the periods.
+    """
+    n_times = len(time)
+    shape = (n_times, len(dates))
+    rows = event_rows(time, dates)
+    treated = np.flatnonzero(np.isfinite(rows))
+    rows = rows[treated].astype(np.int64)
+
+    dummies = OrderedDict()
+    for period in range(-leads, lags + 1):
+        if period == reference:
+            continue
+        begin, end = rows + period, rows + period + 1
+        if bin_endpoints and period == -leads:
+            begin = np.zeros_like(begin)
+        if bin_endpoints and period == lags:
+            end = np.full_like(end, n_times)
+        index, pos = _ranges(np.clip(begin, 0, n_times),
+                             np.clip(end, 0, n_times))
+        dummies[event_name(period)] = sparse.csr_matrix(
+            (np.ones(len(index)), (index, treated[pos])), shape=shape)
+    return dummies
+
+
+def state_event_dates(county, dates):
+    """
+    Event dates of the counties from dates per state.
+
+    Parameters
+    ----------
+    county : array_like of int
+        County FIPS codes, e.g. ds['county'].values.
+    dates : dict or pd.Series
+        State FIPS code -> event date, e.g. from
+        src.data.interventions.InterventionIndex.start_dates.
+
+    Returns
+    -------
+    np.ndarray
+        datetime64 per county, NaT for counties of states without a date.
+    """
+    from src.data.cube import state_fips
+
+    dates = pd.to_datetime(pd.Series(dates, dtype=object))
+    dates.index = dates.index.astype(np.int64)
+    return dates.reindex(state_fips(county)).values
+
+
+class RollingRegression(object):
+    """
+    Panel regressions on rolling windows of dates, from incrementally
+    updated cross-products.
+    """
+    def __init__(self, variables, window, step=1, time=None,
+                 entity_effects=False, time_effects=False, constant=True,
+                 debiased=True, drop_absorbed=False, tol=1e-10,
+                 max_iter=1000):
+        """
+        Parameters
+        ----------
+        variables : dict
+            Name -> array broadcastable to (time, county), see as_panel, or
+            scipy.sparse matrix with dims (time, county), e.g. the dummies
+            of event_study.
+        window : int
+            Number of dates per window.
+        step : int
+            Number of dates between the starts of consecutive windows.
+        time : array_like, optional
+            Dates of the time axis, e.g. ds['time'].values, to label the
+            windows. Defaults to the row numbers.
+        entity_effects, time_effects : bool
+            Include county and/or time fixed effects.
+        constant : bool
+            Include a constant (named 'const').
+        debiased : bool
+            See Panel.fit.
+        drop_absorbed : bool
+            Drop regressors absorbed by the fixed effects in a window
+            instead of raising a ValueError.
+        tol, max_iter :
+            Convergence criterion of the two-way demeaning of unbalanced
+            windows, see demean.
+        """
+        if constant and CONST in variables:
+            raise ValueError("Variable {} is reserved for the "
+                             "constant.".format(CONST))
+        shapes = [x.shape if sparse.issparse(x) else
+                  (1,) * (2 - np.ndim(x)) + np.shape(x)
+                  for x in variables.values()]
+        self.shape = np.broadcast_shapes(*shapes)
+        self.variables = {
+            name: x.tocsr() if sparse.issparse(x) else
+            as_panel(x, self.shape) for name, x in variables.items()}
+        if not 0 < window <= self.shape[0]:
+            raise ValueError("The window must have between 1 and {} "
+                             "dates.".format(self.shape[0]))
+        self.window = int(window)
+        self.step = int(step)
+        self.time = np.arange(self.shape[0]) if time is None else \
+            np.asarray(time)
+        self.entity_effects = entity_effects
+        self.time_effects = time_effects
+        self.constant = constant
+        self.debiased = debiased
+        self.drop_absorbed = drop_absorbed
+        self.tol = tol
+        self.max_iter = max_iter
+
+    @property
+    def windows(self):
+        """
+        First and last (exclusive) row of every window.
+        """
+        return [(lo, lo + self.window) for lo in
+                range(0, self.shape[0] - self.window + 1, self.step)]
+
+    def _columns(self, names, mask):
+        """
+        Observation indicator and the variables centered at their sample
+        means (which keeps the cumulative sums precise), zero outside of
+        the mask, and the means.
+        """
+        nobs = np.prod(self.shape) if mask is None else mask.sum()
+        columns = [np.ones((1, 1)) if mask is None else mask * 1.]
+        means = np.zeros(len(names) + 1)
+        for i, name in enumerate(names, 1):
+            x = self.variables[name]
+            if sparse.issparse(x):
+                columns.append(x if mask is None else x.multiply(mask).tocsr())
+                continue
+            means[i] = total(x, mask, self.shape) / max(nobs, 1)
+            x = x - means[i]
+            columns.append(x if mask is None else np.where(mask, x, 0.))
+        return columns, means
+
+    def _time_sums(self, a, b):
+        """
+        Sums of the products of two columns per date.
+        """
+        if sparse.issparse(a) or sparse.issparse(b):
+            product = a.multiply(b) if sparse.issparse(a) else b.multiply(a)
+            return np.asarray(product.sum(axis=1)).ravel()
+        return np.broadcast_to(a * b, self.shape).sum(axis=1)
+
+    def _county_sums(self, x, lo, hi):
+        """
+        Sums of a column per county over rows lo, ..., hi - 1.
+        """
+        if sparse.issparse(x):
+            return np.asarray(x[lo:hi].sum(axis=0)).ravel()
+        return np.broadcast_to(x, self.shape)[lo:hi].sum(axis=0)
+
+    def cumulative_products(self, columns):
+        """
+        Cumulative sums over dates of the cross-products of the columns
+        and, for time effects, of the products of their sums per date.
+
+        Returns
+        -------
+        products, time_products : np.ndarray
+            Dims (time + 1, column, column), starting with zeros.
+        """
+        m = len(columns)
+        products = np.zeros((self.shape[0] + 1, m, m))
+        for i in range(m):
+            for j in range(i + 1):
+                products[1:, i, j] = products[1:, j, i] = np.cumsum(
+                    self._time_sums(columns[i], columns[j]))
+        time_products = None
+        if self.time_effects:
+            sums = np.diff(products[:, 0], axis=0)
+            counts = np.maximum(sums[:, :1], 1)
+            time_products = np.zeros_like(products)
+            time_products[1:] = np.cumsum(
+                sums[:, :, None] * sums[:, None, :] / counts[:, :, None],
+                axis=0)
+        return products, time_products
+
+    def cross_products(self, products, time_products, county_sums, lo, hi,
+                       means):
+        """
+        Cross-products of the transformed columns of a window.
+
+        Parameters
+        ----------
+        products, time_products : np.ndarray
+            See cumulative_products.
+        county_sums : np.ndarray
+            Sums of the columns per county in the window, dims (county,
+            column). Only used with entity effects.
+        lo, hi : int
+            Rows of the window.
+        means : np.ndarray
+            Sample means by which the columns are centered.
+
+        Returns
+        -------
+        gram : np.ndarray
+            Cross-products of the columns as transformed by Panel: within
+            transformed, with the window mean added back if the model has
+            effects and a constant. The observation indicator becomes the
+            constant.
+        demeaned : np.ndarray
+            Cross-products of the within transformed columns.
+        squares : np.ndarray
+            Sums of squares of the untransformed columns, or of the
+            centered columns if larger: the scale of the test of absorbed
+            regressors, which the rounding errors of the former would
+            decide for columns that are zero in the window.
+        """
+        gram = products[hi] - products[lo]
+        nobs = gram[0, 0]
+        sums = gram[0]
+        demeaned = gram.copy()
+        if self.entity_effects:
+            counts = county_sums[:, 0]
+            used = counts > 0
+            demeaned -= (county_sums[used] / counts[used, None]).T @ \
+                county_sums[used]
+        if self.time_effects:
+            demeaned -= time_products[hi] - time_products[lo]
+        if self.entity_effects == self.time_effects:
+            # two-way demeaning subtracts the grand mean twice, none once
+            sign = 1 if self.entity_effects else -1
+            demeaned += sign * np.outer(sums, sums) / nobs
+
+        raw_sums = sums + nobs * means
+        squares = np.maximum(
+            np.diag(gram) + (raw_sums ** 2 - sums ** 2) / nobs,
+            np.diag(gram))
+        if self.constant or not self.has_effects:
+            gram = demeaned + np.outer(raw_sums, raw_sums) / nobs
+        else:
+            gram = demeaned
+        return gram, demeaned, squares
+
+    @property
+    def has_effects(self):
+        return self.entity_effects or self.time_effects
+
+    def estimate(self, gram, demeaned, squares, n_effects, exog):
+        """
+        Estimate the model of a window from its cross-products.
+
+        Parameters
+        ----------
+        gram, demeaned, squares : np.ndarray
+            See cross_products, with the columns observation indicator,
+            dependent variable and regressors.
+        n_effects : int
+            Number of absorbed effects, see count_effects.
+        exog : list of str
+            Regressors.
+
+        Returns
+        -------
+        dict
+            names (regressors), params, std_error, nobs, df_resid and
+            rsquared as in Panel.estimate.
+        """
+        # the sum of squares of the observation indicator
+        nobs = int(round(squares[0]))
+        positions = range(2, len(gram))
+        absorbed = [i for i in positions if self.has_effects and
+                    demeaned[i, i] <= 1e-8 * squares[i]]
+        if absorbed and not self.drop_absorbed:
+            raise ValueError("Regressors absorbed by the fixed effects: {}. "
+                             "Use drop_absorbed=True to drop them.".format(
+                                 ", ".join(exog[i - 2] for i in absorbed)))
+        index = ([0] if self.constant else []) + \
+            [i for i in positions if i not in absorbed]
+        names = [CONST if i == 0 else exog[i - 2] for i in index]
+        xx_inv = inverse(gram[np.ix_(index, index)], names)
+        xy = gram[index, 1]
+        params = xx_inv @ xy
+        resid_ss = max(gram[1, 1] - params @ xy, 0.)
+        k = len(index)
+        scale = nobs / (nobs - n_effects - (k if self.debiased else 0))
+        total_ss = gram[1, 1]
+        if self.constant:
+            total_ss -= gram[0, 1] ** 2 / nobs
+        return dict(names=names, params=params,
+                    std_error=np.sqrt(np.diag(xx_inv) * scale * resid_ss /
+                                      nobs),
+                    nobs=nobs, df_resid=nobs - k - n_effects,
+                    rsquared=1 - resid_ss / total_ss if total_ss > 0 else 0.)
+
+    def _estimates(self, dependent, exog, mask):
+        """
+        Estimates of every window from the incrementally updated
+        cross-products.
+        """
+        columns, means = self._columns([dependent] + exog, mask)
+        products, time_products = self.cumulative_products(columns)
+        dates = np.r_[0, np.cumsum(np.diff(products[:, 0, 0]) > 0)]
+        county_sums = np.zeros((self.shape[1], len(columns)))
+        last = (0, 0)
+        for lo, hi in self.windows:
+            if self.entity_effects:
+                for i, x in enumerate(columns):
+                    county_sums[:, i] += \
+                        self._county_sums(x, last[1], hi) - \
+                        self._county_sums(x, last[0], lo)
+                last = (lo, hi)
+            n_effects = count_effects(
+                (county_sums[:, 0] > 0).sum(), dates[hi] - dates[lo],
+                self.entity_effects, self.time_effects, self.constant)
+            gram, demeaned, squares = self.cross_products(
+                products, time_products, county_sums, lo, hi, means)
+
+            def estimate(gram=gram, demeaned=demeaned, squares=squares,
+                         n_effects=n_effects):
+                return self.estimate(gram, demeaned, squares, n_effects,
+                                     exog)
+            yield lo, hi, estimate
+
+    def _panel_estimates(self, dependent, exog, mask):
+        """
+        Estimates of every window with one Panel per window.
+        """
+        for lo, hi in self.windows:
+            variables = {}
+            for name in [dependent] + exog:
+                x = self.variables[name]
+                if sparse.issparse(x):
+                    variables[name] = x[lo:hi].toarray()
+                else:
+                    variables[name] = x[lo:hi] if x.shape[0] > 1 else x
+            rows = None if mask is None else mask[lo:hi]
+            panel = Panel(variables, (hi - lo, self.shape[1]),
+                          None if rows is None or rows.all() else rows,
+                          self.entity_effects, self.time_effects,
+                          self.constant, self.tol, self.max_iter)
+
+            def estimate(panel=panel):
+                est = panel.estimate(dependent, exog, 'unadjusted',
+                                     self.debiased, self.drop_absorbed)
+                est['std_error'] = np.sqrt(np.diag(est.pop('cov')))
+                return est
+            yield lo, hi, estimate
+
+    def fit(self, dependent, exog):
+        """
+        Estimate a model on every window.
+
+        Parameters
+        ----------
+        dependent : str
+            Dependent variable.
+        exog : list of str
+            Regressors, without the constant.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per window and parameter: start, end (first and last
+            date of the window), parameter, estimate, std_error
+            (unadjusted), tstat, pvalue, lower, upper, nobs, df_resid,
+            rsquared. Windows that cannot be estimated are logged and have
+            no rows.
+        """
+        logger = logging.getLogger(__name__)
+        exog = list(exog)
+        mask = sample([x for name, x in self.variables.items()
+                       if name in exog + [dependent] and
+                       not sparse.issparse(x)], self.shape)
+        logger.info('Fitting {} windows of {} dates.'.format(
+            len(self.windows), self.window))
+        if self.entity_effects and self.time_effects and mask is not None:
+            logger.info('Two-way effects on an unbalanced panel: fitting '
+                        'every window separately.')
+            estimates = self._panel_estimates(dependent, exog, mask)
+        else:
+            estimates = self._estimates(dependent, exog, mask)
+
+        columns = {name: [] for name in ['start', 'end', 'parameter',
+                                         'estimate', 'std_error', 'nobs',
+                                         'df_resid', 'rsquared']}
+        for lo, hi, estimate in estimates:
+            try:
+                est = estimate()
+            except (np.linalg.LinAlgError, ValueError) as e:
+                logger.warning('Window {} - {} failed: {}'.format(
+                    self.time[lo], self.time[hi - 1], e))
+                continue
+            k = len(est['names'])
+            columns['start'] += [self.time[lo]] * k
+            columns['end'] += [self.time[hi - 1]] * k
+            columns['parameter'] += est['names']
+            columns['estimate'] += list(est['params'])
+            columns['std_error'] += list(est['std_error'])
+            for name in ['nobs', 'df_resid', 'rsquared']:
+                columns[name] += [est[name]] * k
+        df = statistics(pd.DataFrame(columns), self.debiased)
+        return df[['start', 'end', 'parameter', 'estimate', 'std_error',
+                   'tstat', 'pvalue', 'lower', 'upper', 'nobs', 'df_resid',
+                   'rsquared']]
+
+
+if __name__ == '__main__':
+    from src.data.reader import CSSEReader
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # deaths on confirmed cases two weeks earlier, in four week windows
+    with CSSEReader('csse').read_processed2ds() as ds:
+        deaths = ds['deaths'].values
+        confirmed = ds['confirmed'].shift(time=14).values
+        time = ds['time'].values
+    rolling = RollingRegression({'deaths': deaths, 'L14.confirmed': confirmed},
+                                window=28, step=7, time=time,
+                                time_effects=True)
+    print(rolling.fit('deaths', ['L14.confirmed']))
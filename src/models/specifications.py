@@ -0,0 +1,497 @@
+"""
+Grids of panel regression specifications.
+
+A grid is the product of dependent variables, regressor sets, fixed effects,
+lags of the regressors and date windows, see specification_grid. The grid is
+fit sample by sample: specifications with the same effects, lag and window
+whose variables are missing at the same observations share a Panel, so every
+variable is lagged, windowed and within transformed once per sample and
+every cross-product is computed once, no matter how many specifications use
+it. The samples are fit in parallel on a process pool. Results are returned
+as one tidy table with a row per specification and parameter.
+
+With common_sample=True, all specifications with the same lag and window are
+fit on the observations where none of their variables is missing, as usual
+for robustness tables, which also lets them share one Panel per effect
+structure.
+"""
+import os
+import hashlib
+import logging
+import itertools
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+from src.models.train_model import Panel, as_panel, COV_TYPES
+
+# fixed effects: name -> (entity_effects, time_effects)
+EFFECTS = OrderedDict([('none', (False, False)), ('entity', (True, False)),
+                       ('time', (False, True)), ('both', (True, True))])
+
+# one model of a grid, see specification_grid
+Specification = namedtuple('Specification', ['dependent', 'exog', 'effects',
+                                             'lag', 'window'])
+
+
+def specification_grid(dependent, exog, effects=('none',), lags=(0,),
+                       windows=(None,)):
+    """
+    All combinations of the given specification choices.
+
+    Parameters
+    ----------
+    dependent : str or list of str
+        Dependent variables.
+    exog : list of list of str
+        Regressor sets, without the constant.
+    effects : list of str
+        Fixed effects, each one of EFFECTS.
+    lags : list of int
+        Lags of the regressors in time steps.
+    windows : list of tuple
+        (start, end) date ranges (inclusive, either may be None). None for
+        all dates.
+
+    Returns
+    -------
+    list of Specification
+    """
+    if isinstance(dependent, str):
+        dependent = [dependent]
+    for effect in effects:
+        if effect not in EFFECTS:
+            raise IOError("Effects do not exist. Choose one of "
+                          "{}.".format(", ".join(EFFECTS)))
+    windows = [None if w is None else tuple(w) for w in windows]
+    return [Specification(dep, tuple(x), effect, int(periods), window)
+            for dep, x, effect, periods, window in itertools.product(
+                dependent, exog, effects, lags, windows)]
+
+
+def lag(values, periods):
+    """
+    Lag a variable along the time axis (axis 0).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array in compact 2-D form, see as_panel. County level arrays with a
+        single row do not change.
+    periods : int
+        Number of time steps. The first periods rows are NaN.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if periods == 0 or values.shape[0] == 1:
+        return values
+    out = np.full(values.shape, np.nan)
+    if periods < len(values):
+        out[periods:] = values[:-periods]
+    return out
+
+
+def window_slice(time, window):
+    """
+    Rows of the dates of a window.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sorted dates of the rows.
+    window : tuple or None
+        (start, end) dates (inclusive), either may be None.
+
+    Returns
+    -------
+    slice
+    """
+    if window is None:
+        return slice(None)
+    start, end = window
+    time = np.asarray(time, dtype='datetime64[D]')
+    lo = 0 if start is None else np.searchsorted(
+        time, np.datetime64(pd.Timestamp(start), 'D'), side='left')
+    hi = len(time) if end is None else np.searchsorted(
+        time, np.datetime64(pd.Timestamp(end), 'D'), side='right')
+    return slice(int(lo), int(hi))
+
+
+def lag_name(name, periods):
+    """
+    Name of a lagged regressor, e.g. "L7.confirmed".
+    """
+    return name if periods == 0 else 'L{}.{}'.format(periods, name)
+
+
+def statistics(df, debiased=True, level=0.95):
+    """
+    Add test statistics to a table of estimates, vectorized over its rows.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Columns estimate, std_error and df_resid, a row per parameter.
+    debiased : bool
+        t instead of normal p-values and intervals, see Panel.fit.
+    level : float
+        Level of the confidence intervals.
+
+    Returns
+    -------
+    pd.DataFrame
+        df with the columns tstat, pvalue, lower and upper.
+    """
+    df['tstat'] = df['estimate'] / df['std_error']
+    if debiased:
+        df['pvalue'] = 2 * stats.t.sf(np.abs(df['tstat']), df['df_resid'])
+        q = stats.t.ppf(0.5 + level / 2, df['df_resid'])
+    else:
+        df['pvalue'] = 2 * stats.norm.sf(np.abs(df['tstat']))
+        q = stats.norm.ppf(0.5 + level / 2)
+    df['lower'] = df['estimate'] - q * df['std_error']
+    df['upper'] = df['estimate'] + q * df['std_error']
+    return df
+
+
+class SpecificationGrid(object):
+    """
+    Fits many panel regressions on the same (time, county) variables.
+    """
+    def __init__(self, variables, time=None, constant=True,
+                 cov_type='unadjusted', debiased=True, common_sample=False,
+                 clusters='entity', tol=1e-10, max_iter=1000):
+        """
+        Parameters
+        ----------
+        variables : dict
+            Name -> array broadcastable to (time, county), see as_panel.
+            E.g. the variables of the dataset of processed2ds or
+            CSSEFeatures and county covariates from county_covariates.
+        time : array_like, optional
+            Dates of the time axis, e.g. ds['time'].values. Required for
+            date windows.
+        constant : bool
+            Include a constant in every specification.
+        cov_type : str
+            One of COV_TYPES.
+        debiased : bool
+            See Panel.fit.
+        common_sample : bool
+            Fit all specifications with the same lag and window on the same
+            observations.
+        clusters : str or array_like
+            Clusters of cov_type 'clustered': 'entity' (county), 'time' or
+            cluster ids broadcastable to (time, county), e.g. state FIPS
+            codes per county, see Panel.clusters.
+        tol, max_iter :
+            Convergence criterion of the two-way demeaning, see demean.
+        """
+        if cov_type not in COV_TYPES:
+            raise IOError("Covariance type does not exist. Choose one of "
+                          "{}.".format(", ".join(COV_TYPES)))
+        shapes = [np.shape(x) for x in variables.values()]
+        shapes = [(1,) * (2 - len(s)) + tuple(s) for s in shapes]
+        self.shape = np.broadcast_shapes(*shapes)
+        self.variables = {name: as_panel(x, self.shape)
+                          for name, x in variables.items()}
+        self.time = None if time is None else np.asarray(time)
+        self.constant = constant
+        self.cov_type = cov_type
+        self.debiased = debiased
+        self.common_sample = common_sample
+        self.clusters = clusters
+        self.tol = tol
+        self.max_iter = max_iter
+        self._lagged = {}
+        self._valid = {}
+
+    def lagged(self, name, periods):
+        """
+        Lagged variable, computed once.
+        """
+        key = (name, periods)
+        if key not in self._lagged:
+            self._lagged[key] = lag(self.variables[name], periods)
+        return self._lagged[key]
+
+    def exog_name(self, name, periods):
+        """
+        Name of a lagged regressor, see lag_name. County level variables do
+        not change with lags and keep their name.
+        """
+        if self.variables[name].shape[0] == 1:
+            return name
+        return lag_name(name, periods)
+
+    def valid(self, name, periods):
+        """
+        Observations of a lagged variable that are not missing, in compact
+        2-D form, computed once.
+        """
+        key = (name, periods)
+        if key not in self._valid:
+            self._valid[key] = np.isfinite(self.lagged(name, periods))
+        return self._valid[key]
+
+    def _rows(self, window):
+        if window is not None and self.time is None:
+            raise ValueError("Date windows require the time axis.")
+        rows = window_slice(self.time, window)
+        return rows, (len(range(*rows.indices(self.shape[0]))),
+                      self.shape[1])
+
+    def panel_variables(self, dependent, exog, periods, window):
+        """
+        Lagged and windowed variables of a sample.
+
+        Parameters
+        ----------
+        dependent : list of str
+            Dependent variables (not lagged).
+        exog : list of str
+            Regressors.
+        periods : int
+            Lag of the regressors.
+        window : tuple or None
+            Date window.
+
+        Returns
+        -------
+        variables : dict
+            Name (see exog_name for the regressors) -> array.
+        shape : tuple
+            Shape of the panel.
+        """
+        rows, shape = self._rows(window)
+        variables = {}
+        for name in dependent:
+            variables[name] = self.variables[name]
+        for name in exog:
+            variables[self.exog_name(name, periods)] = self.lagged(name,
+                                                                   periods)
+        variables = {name: x[rows] if x.shape[0] > 1 else x
+                     for name, x in variables.items()}
+        return variables, shape
+
+    def sample(self, dependent, exog, periods, window):
+        """
+        Observations without missing values in any of the variables.
+
+        Returns
+        -------
+        np.ndarray or None
+            Boolean array with dims (time, county) of the window, None if
+            all observations are valid.
+        """
+        rows, shape = self._rows(window)
+        valid = np.ones(shape, dtype=bool)
+        for name, periods in [(name, 0) for name in dependent] + \
+                [(name, periods) for name in exog]:
+            x = self.valid(name, periods)
+            valid &= x[rows] if x.shape[0] > 1 else x
+        return None if valid.all() else valid
+
+    def samples(self, specs):
+        """
+        Group specifications by their sample.
+
+        Parameters
+        ----------
+        specs : list of Specification
+
+        Returns
+        -------
+        list of tuple
+            (dependent, exog, effects, lag, window) defining a sample and
+            the positions of its specifications in specs, in the order of
+            their first specification.
+        """
+        groups = OrderedDict()
+        common = {}
+        if self.common_sample:
+            for spec in specs:
+                names = common.setdefault((spec.lag, spec.window),
+                                          (set(), set()))
+                names[0].add(spec.dependent)
+                names[1].update(spec.exog)
+
+        for i, spec in enumerate(specs):
+            if self.common_sample:
+                dependent, exog = common[(spec.lag, spec.window)]
+                mask = None
+            else:
+                dependent, exog = {spec.dependent}, set(spec.exog)
+                mask = self.sample(dependent, exog, spec.lag, spec.window)
+            digest = None if mask is None else \
+                hashlib.sha1(np.packbits(mask)).hexdigest()
+            key = (spec.effects, spec.lag, spec.window, digest)
+            if key not in groups:
+                groups[key] = [set(), set(), []]
+            groups[key][0].update(dependent)
+            groups[key][1].update(exog)
+            groups[key][2].append(i)
+        return [(sorted(dep), sorted(exog), effects, periods, window, pos)
+                for (effects, periods, window, _), (dep, exog, pos)
+                in groups.items()]
+
+    def fit_sample(self, dependent, exog, effects, periods, window, specs):
+        """
+        Fit the specifications of one sample on a shared Panel.
+
+        Parameters
+        ----------
+        dependent, exog : list of str
+            All variables of the sample.
+        effects : str
+            One of EFFECTS.
+        periods : int
+            Lag of the regressors.
+        window : tuple or None
+            Date window.
+        specs : list of (int, Specification)
+            Specifications and their ids.
+
+        Returns
+        -------
+        dict
+            Column -> list: spec, parameter, estimate, std_error, nobs,
+            df_resid and rsquared per parameter.
+        """
+        logger = logging.getLogger(__name__)
+        variables, shape = self.panel_variables(dependent, exog, periods,
+                                                window)
+        mask = self.sample(dependent, exog, periods, window)
+        entity_effects, time_effects = EFFECTS[effects]
+        panel = Panel(variables, shape, mask, entity_effects, time_effects,
+                      self.constant, self.tol, self.max_iter)
+        clusters = self.clusters
+        if not isinstance(clusters, str) and np.ndim(clusters) == 2 and \
+                np.shape(clusters)[0] > 1:
+            clusters = np.asarray(clusters)[self._rows(window)[0]]
+
+        columns = {name: [] for name in ['spec', 'parameter', 'estimate',
+                                         'std_error', 'nobs', 'df_resid',
+                                         'rsquared']}
+        for spec_id, spec in specs:
+            try:
+                est = panel.estimate(
+                    spec.dependent,
+                    [self.exog_name(x, periods) for x in spec.exog],
+                    self.cov_type, self.debiased, drop_absorbed=True,
+                    clusters=clusters)
+            except (np.linalg.LinAlgError, ValueError) as e:
+                logger.warning('Specification {} failed: {}'.format(
+                    spec_id, e))
+                continue
+            k = len(est['names'])
+            columns['spec'] += [spec_id] * k
+            columns['parameter'] += est['names']
+            columns['estimate'] += list(est['params'])
+            columns['std_error'] += list(np.sqrt(np.diag(est['cov'])))
+            for name in ['nobs', 'df_resid', 'rsquared']:
+                columns[name] += [est[name]] * k
+        return columns
+
+    def fit(self, specs, n_jobs=None):
+        """
+        Fit specifications.
+
+        Parameters
+        ----------
+        specs : list of Specification
+            E.g. from specification_grid.
+        n_jobs : int, optional
+            Number of worker processes. Defaults to the number of CPUs. With
+            1, samples are fit in the current process.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per specification and parameter: spec (position in
+            specs), dependent, exog, effects, lag, start, end, parameter,
+            estimate, std_error, tstat, pvalue, lower, upper, nobs,
+            df_resid, rsquared. Failed specifications are logged and have
+            no rows.
+        """
+        logger = logging.getLogger(__name__)
+        specs = list(specs)
+        tasks = [(dep, exog, effects, periods, window,
+                  [(i, specs[i]) for i in pos])
+                 for dep, exog, effects, periods, window, pos
+                 in self.samples(specs)]
+        logger.info('Fitting {} specifications on {} samples.'.format(
+            len(specs), len(tasks)))
+
+        if n_jobs == 1 or len(tasks) == 1:
+            tables = [self.fit_sample(*task) for task in tasks]
+        else:
+            n_jobs = min(n_jobs or os.cpu_count(), len(tasks))
+            with ProcessPoolExecutor(n_jobs, initializer=_init_grid_worker,
+                                     initargs=(self,)) as pool:
+                tables = list(pool.map(_fit_sample, tasks))
+
+        return self._tidy(specs, tables)
+
+    def _tidy(self, specs, tables):
+        """
+        Results table of fit from the columns of fit_sample.
+        """
+        df = pd.DataFrame({name: np.concatenate([t[name] for t in tables])
+                           for name in tables[0]}) \
+            if tables else pd.DataFrame(columns=['spec', 'parameter'])
+        df = df.sort_values('spec', kind='stable').reset_index(drop=True)
+        df = statistics(df, self.debiased)
+
+        meta = pd.DataFrame(
+            [(spec.dependent, ' + '.join(spec.exog), spec.effects, spec.lag)
+             + ((None, None) if spec.window is None else spec.window)
+             for spec in specs],
+            columns=['dependent', 'exog', 'effects', 'lag', 'start', 'end'])
+        df = pd.concat([df[['spec']], meta.reindex(df['spec'].values)
+                        .reset_index(drop=True), df.drop(columns='spec')],
+                       axis=1)
+        return df[['spec', 'dependent', 'exog', 'effects', 'lag', 'start',
+                   'end', 'parameter', 'estimate', 'std_error', 'tstat',
+                   'pvalue', 'lower', 'upper', 'nobs', 'df_resid',
+                   'rsquared']]
+
+
+def _init_grid_worker(grid):
+    """
+    Keep the grid of the current worker.
+    """
+    global _worker_grid
+    _worker_grid = grid
+
+
+def _fit_sample(task):
+    """
+    Fit the specifications of one sample with the grid of the worker.
+    """
+    return _worker_grid.fit_sample(*task)
+
+
+if __name__ == '__main__':
+    from src.data.reader import CSSEReader
+    from src.data.covariates import read_covariates
+    from src.models.train_model import county_covariates
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    with CSSEReader('csse').read_processed2ds() as ds:
+        variables = {var: ds[var].values for var in ['confirmed', 'deaths']}
+        time, county = ds['time'].values, ds['county'].values
+    population = read_covariates('POPEST', ['population'])
+    variables.update(county_covariates(population, county))
+
+    specs = specification_grid(
+        'deaths', [['population'], ['confirmed'], ['confirmed', 'population']],
+        effects=['none', 'time', 'both'], lags=[0, 7, 14],
+        windows=[None, ('2020-04-01', None)])
+    grid = SpecificationGrid(variables, time=time, common_sample=True)
+    print(grid.fit(specs).to_string())
@@ -0,0 +1,805 @@
+"""
+Fixed-effects panel regressions on the (time, county) arrays of the CSSE
+dataset.
+
+Instead of stacking the dataset into long format and merging covariates per
+row (as linearmodels.PanelOLS requires), the estimator works on 2-D arrays
+with dims (time, county), e.g. the variables of the dataset written by
+CSSETransformer.processed2ds or CSSEFeatures. Regressors are any arrays
+broadcastable to (time, county): county level covariates have shape
+(county,), time level ones (time, 1). The entity (county) and time fixed
+effects are removed by demeaning along the axes of the arrays, which keeps
+broadcast covariates in their compact shape whenever the panel is balanced,
+and the regression is solved from the cross-products of the demeaned
+variables. Observations with a missing value in any variable are dropped.
+
+Estimates, standard errors and R^2 match those of PanelOLS with the same
+specification. The R^2 is PanelOLS' rsquared, that of the within
+transformed model, not its rsquared_within.
+"""
+import logging
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+COV_TYPES = ['unadjusted', 'robust', 'clustered']
+
+# clusters by name, see Panel.clusters
+CLUSTERS = ['entity', 'time']
+
+# name of the constant, as with statsmodels.add_constant
+CONST = 'const'
+
+# name of the dependent variable in the panel of a FixedEffects model
+DEPENDENT = 'dependent'
+
+# regressors count as collinear above this condition number of their
+# correlation-scaled cross-product matrix
+MAX_CONDITION = 1e12
+
+
+def county_covariates(frame, county):
+    """
+    Align county level covariates with the counties of a dataset.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame or pd.Series
+        Covariates indexed by county FIPS code, e.g. read with
+        src.data.covariates.read_covariates.
+    county : array_like of int
+        FIPS codes of the dataset, e.g. ds['county'].values.
+
+    Returns
+    -------
+    dict
+        Column -> float64 array with dims (county,), NaN for counties
+        without data.
+    """
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    frame = frame.reindex(np.asarray(county, dtype=np.int64))
+    return {col: frame[col].values.astype(np.float64) for col in frame}
+
+
+def inverse(xx, names):
+    """
+    Inverse of the cross-product matrix of the regressors.
+
+    Parameters
+    ----------
+    xx : np.ndarray
+        Cross-products of the (demeaned) regressors.
+    names : list of str
+        Regressors, for the error message.
+
+    Returns
+    -------
+    np.ndarray
+
+    Raises
+    ------
+    np.linalg.LinAlgError
+        If a regressor has no variation or the regressors are (nearly)
+        collinear, so the estimates would be meaningless.
+    """
+    scale = np.sqrt(np.diag(xx))
+    if not np.all(scale > 0):
+        raise np.linalg.LinAlgError("Regressors without variation: {}.".format(
+            ", ".join(name for name, s in zip(names, scale) if not s > 0)))
+    condition = np.linalg.cond(xx / np.outer(scale, scale))
+    if not condition <= MAX_CONDITION:
+        raise np.linalg.LinAlgError(
+            "Regressors are collinear (condition number {:.3g}): {}.".format(
+                condition, ", ".join(names)))
+    return np.linalg.inv(xx)
+
+
+def as_panel(values, shape):
+    """
+    Float64 array of a variable, broadcastable to shape, in its compact
+    2-D form: (county,) becomes (1, county), scalars (1, 1).
+
+    Parameters
+    ----------
+    values : array_like
+        E.g. np.ndarray, xr.DataArray or pd.DataFrame.
+    shape : tuple
+        (n_time, n_county)
+
+    Returns
+    -------
+    np.ndarray
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim > 2:
+        raise ValueError("Variables must have at most two dims (time, "
+                         "county), got shape {}.".format(values.shape))
+    values = values.reshape((1,) * (2 - values.ndim) + values.shape)
+    np.broadcast_shapes(values.shape, shape)
+    return values
+
+
+def total(values, mask, shape):
+    """
+    Sum of a broadcastable array over the observations of a panel.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Broadcastable to shape.
+    mask : np.ndarray or None
+        Boolean array of the observations with dims shape. None if all
+        observations are used.
+    shape : tuple
+        (n_time, n_county)
+
+    Returns
+    -------
+    float
+    """
+    if mask is None:
+        # broadcasting repeats every value equally often
+        return float(values.sum()) * (np.prod(shape) / values.size)
+    return float(np.broadcast_to(values, shape).sum(where=mask))
+
+
+def demean(values, mask=None, entity_effects=True, time_effects=True,
+           tol=1e-10, max_iter=1000):
+    """
+    Within transformation: subtract entity (county) and/or time means.
+
+    Balanced panels are demeaned exactly in one pass, which keeps county or
+    time level variables in their compact shape. Two-way demeaning of
+    unbalanced panels alternates between the two one-way transformations
+    until the means vanish.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        2-D array broadcastable to the panel, see as_panel.
+    mask : np.ndarray, optional
+        Boolean array with dims (time, county) of the observations used.
+        Defaults to all (a balanced panel). Demeaned values outside of the
+        mask are undefined.
+    entity_effects, time_effects : bool
+        Effects to remove.
+    tol : float
+        Convergence tolerance of the alternating projections, relative to
+        the largest absolute value.
+    max_iter : int
+        Maximum number of alternating projections.
+
+    Returns
+    -------
+    np.ndarray
+        Demeaned values.
+    """
+    x = values
+    if mask is None:
+        if entity_effects:
+            x = x - x.mean(axis=0, keepdims=True)
+        if time_effects:
+            x = x - x.mean(axis=1, keepdims=True)
+        return x
+
+    x = np.where(mask, x, 0.)
+    n_time = np.maximum(mask.sum(axis=0, keepdims=True), 1)
+    n_county = np.maximum(mask.sum(axis=1, keepdims=True), 1)
+    scale = tol * max(np.abs(x).max(), 1.) if x.size else tol
+    for _ in range(max_iter):
+        change = 0.
+        if entity_effects:
+            means = x.sum(axis=0, keepdims=True) / n_time
+            x -= means
+            x[~mask] = 0.
+            change = max(change, np.abs(means).max(initial=0.))
+        if time_effects:
+            means = x.sum(axis=1, keepdims=True) / n_county
+            x -= means
+            x[~mask] = 0.
+            change = max(change, np.abs(means).max(initial=0.))
+        if not (entity_effects and time_effects) or change <= scale:
+            return x
+    logging.getLogger(__name__).warning(
+        'Demeaning did not converge in {} iterations.'.format(max_iter))
+    return x
+
+
+def sample(variables, shape):
+    """
+    Observations of a panel without a missing value in any variable.
+
+    Parameters
+    ----------
+    variables : iterable of np.ndarray
+        Arrays broadcastable to shape.
+    shape : tuple
+        (n_time, n_county)
+
+    Returns
+    -------
+    np.ndarray or None
+        Boolean array with dims shape, None if all observations are valid.
+    """
+    valid = np.ones(shape, dtype=bool)
+    for x in variables:
+        valid &= np.isfinite(x)
+    return None if valid.all() else valid
+
+
+def count_effects(n_entities, n_times, entity_effects, time_effects,
+                  constant=True):
+    """
+    Number of absorbed effect parameters, as counted by PanelOLS: one
+    parameter per county and/or date with observations, less the first one
+    if the model has a constant or another effect.
+
+    Returns
+    -------
+    int
+    """
+    n_effects = 0
+    drop_first = constant
+    if entity_effects:
+        n_effects += n_entities - drop_first
+        drop_first = True
+    if time_effects:
+        n_effects += n_times - drop_first
+    return int(n_effects)
+
+
+class Panel(object):
+    """
+    Variables of panel regressions on a fixed sample: their within
+    transformation and cross-products are computed once per variable (pair)
+    and shared by all models fit on the panel, e.g. specifications that
+    differ only in their dependent variable or regressors.
+    """
+    def __init__(self, variables, shape, mask=None, entity_effects=False,
+                 time_effects=False, constant=True, tol=1e-10,
+                 max_iter=1000):
+        """
+        Parameters
+        ----------
+        variables : dict
+            Name -> array broadcastable to shape, see as_panel. Values must
+            be finite on the mask.
+        shape : tuple
+            (n_time, n_county)
+        mask : np.ndarray, optional
+            Boolean array with dims shape of the observations used, e.g.
+            from sample. Defaults to all.
+        entity_effects, time_effects : bool
+            Include county and/or time fixed effects.
+        constant : bool
+            Include a constant (named 'const').
+        tol, max_iter :
+            Convergence criterion of the two-way demeaning of unbalanced
+            panels, see demean.
+        """
+        if constant and CONST in variables:
+            raise ValueError("Variable {} is reserved for the "
+                             "constant.".format(CONST))
+        self.shape = tuple(shape)
+        self.variables = {name: as_panel(x, self.shape)
+                          for name, x in variables.items()}
+        self.mask = mask
+        self.entity_effects = entity_effects
+        self.time_effects = time_effects
+        self.constant = constant
+        self.tol = tol
+        self.max_iter = max_iter
+
+        if mask is None:
+            self.nobs = int(np.prod(self.shape))
+            self.n_times, self.n_entities = self.shape
+        else:
+            self.nobs = int(mask.sum())
+            self.n_entities = int(mask.any(axis=0).sum())
+            self.n_times = int(mask.any(axis=1).sum())
+        self._within = {}
+        self._absorbed = {}
+        self._cross = {}
+
+    @property
+    def has_effects(self):
+        return self.entity_effects or self.time_effects
+
+    @property
+    def n_effects(self):
+        """
+        Number of absorbed effect parameters, as counted by PanelOLS.
+        """
+        return count_effects(self.n_entities, self.n_times,
+                             self.entity_effects, self.time_effects,
+                             self.constant)
+
+    def total(self, values):
+        """
+        Sum of a broadcastable array over the observations of the panel.
+        """
+        return total(values, self.mask, self.shape)
+
+    def within(self, name):
+        """
+        Within transformed variable, computed once.
+
+        As in PanelOLS, the sample mean is added back to the demeaned
+        variables of models with a constant, so the constant is estimated.
+
+        Parameters
+        ----------
+        name : str
+            One of the variables or 'const'.
+
+        Returns
+        -------
+        np.ndarray
+            Transformed values in compact 2-D form.
+        """
+        if name in self._within:
+            return self._within[name]
+        if name == CONST:
+            self._within[name] = np.ones((1, 1))
+            self._absorbed[name] = False
+            return self._within[name]
+
+        x = self.variables[name]
+        x_within = demean(x, self.mask, self.entity_effects,
+                          self.time_effects, self.tol, self.max_iter)
+        absorbed = False
+        if self.has_effects:
+            # the effects explain (nearly) all variation of x
+            mean = self.total(x) / max(self.nobs, 1)
+            ss = max(self.total((x - mean) ** 2), self.total(x ** 2))
+            absorbed = self.total(x_within ** 2) <= 1e-8 * ss
+            if self.constant:
+                x_within = x_within + mean
+        self._within[name] = x_within
+        self._absorbed[name] = absorbed
+        return x_within
+
+    def transform(self, values):
+        """
+        Within transformation of an array that is not a variable of the
+        panel, e.g. residuals, as in within. Not cached.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            Broadcastable to the panel.
+
+        Returns
+        -------
+        np.ndarray
+        """
+        x = demean(values, self.mask, self.entity_effects, self.time_effects,
+                   self.tol, self.max_iter)
+        if self.has_effects and self.constant:
+            x = x + self.total(values) / max(self.nobs, 1)
+        return x
+
+    def absorbed(self, name):
+        """
+        Whether the fixed effects absorb a variable.
+        """
+        self.within(name)
+        return self._absorbed[name]
+
+    def cross_product(self, a, b):
+        """
+        Cross-product of two transformed variables, computed once.
+        """
+        key = (a, b) if a <= b else (b, a)
+        if key not in self._cross:
+            self._cross[key] = self.total(self.within(a) * self.within(b))
+        return self._cross[key]
+
+    def cross_products(self, names, dependent=None):
+        """
+        Cross-products of transformed variables.
+
+        Parameters
+        ----------
+        names : list of str
+            Regressors, including 'const'.
+        dependent : str, optional
+            Dependent variable.
+
+        Returns
+        -------
+        xx : np.ndarray
+            X'X, with rows and columns in the order of names.
+        xy : np.ndarray
+            X'y, None without dependent variable.
+        """
+        k = len(names)
+        xx = np.empty((k, k))
+        for i in range(k):
+            for j in range(i + 1):
+                xx[i, j] = xx[j, i] = self.cross_product(names[i], names[j])
+        if dependent is None:
+            return xx, None
+        xy = np.array([self.cross_product(name, dependent) for name in names])
+        return xx, xy
+
+    def regressors(self, exog, drop_absorbed=False):
+        """
+        Regressors of a model: the constant first, then exog without the
+        absorbed variables if drop_absorbed.
+        """
+        names = [CONST] if self.constant else []
+        absorbed = [name for name in exog if self.absorbed(name)]
+        if absorbed and not drop_absorbed:
+            raise ValueError("Regressors absorbed by the fixed effects: {}. "
+                             "Use drop_absorbed=True to drop them.".format(
+                                 ", ".join(absorbed)))
+        if absorbed:
+            logging.getLogger(__name__).warning(
+                'Dropped regressors absorbed by the fixed effects: '
+                '{}.'.format(", ".join(absorbed)))
+        return names + [name for name in exog if name not in absorbed]
+
+    def residuals(self, dependent, names, params):
+        """
+        Residuals of the transformed model.
+
+        Parameters
+        ----------
+        dependent : str
+            Dependent variable.
+        names : list of str
+            Regressors, including 'const'.
+        params : array_like
+            Coefficients in the order of names.
+
+        Returns
+        -------
+        np.ndarray
+            Residuals with dims (time, county), zero outside of the mask.
+        """
+        resid = self.within(dependent)
+        for beta, name in zip(params, names):
+            resid = resid - beta * self.within(name)
+        resid = np.broadcast_to(resid, self.shape)
+        if self.mask is not None:
+            resid = np.where(self.mask, resid, 0.)
+        return resid
+
+    def clusters(self, clusters):
+        """
+        Cluster codes of the observations.
+
+        Parameters
+        ----------
+        clusters : str or array_like
+            'entity' (county), 'time', or cluster ids broadcastable to
+            (time, county), e.g. the state FIPS codes of the counties (see
+            src.data.cube.state_fips) for state clusters.
+
+        Returns
+        -------
+        codes : np.ndarray
+            Codes 0, ..., n_clusters - 1 in compact 2-D form.
+        n_clusters : int
+        """
+        if isinstance(clusters, str):
+            if clusters not in CLUSTERS:
+                raise IOError("Clusters do not exist. Choose one of {} or "
+                              "an array of cluster ids.".format(
+                                  ", ".join(CLUSTERS)))
+            if clusters == 'entity':
+                codes = np.arange(self.shape[1])[None, :]
+            else:
+                codes = np.arange(self.shape[0])[:, None]
+            return codes, codes.size
+        ids = np.asarray(clusters)
+        ids = ids.reshape((1,) * (2 - ids.ndim) + ids.shape)
+        np.broadcast_shapes(ids.shape, self.shape)
+        uniques, codes = np.unique(ids, return_inverse=True)
+        return codes.reshape(ids.shape), len(uniques)
+
+    def cluster_sums(self, values, codes, n_clusters):
+        """
+        Sums of values per cluster.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            Broadcastable to the panel.
+        codes, n_clusters :
+            See clusters.
+
+        Returns
+        -------
+        np.ndarray
+            Sum per cluster of the values of the observations.
+        """
+        values = np.broadcast_to(values, self.shape)
+        if self.mask is not None:
+            values = np.where(self.mask, values, 0.)
+        if codes.shape[0] == 1:
+            return np.bincount(codes[0], values.sum(axis=0), n_clusters)
+        if codes.shape[1] == 1:
+            return np.bincount(codes[:, 0], values.sum(axis=1), n_clusters)
+        return np.bincount(np.broadcast_to(codes, self.shape).ravel(),
+                           values.ravel(), n_clusters)
+
+    def scores(self, names, resid, codes, n_clusters):
+        """
+        Scores X_g'e_g of the clusters.
+
+        Returns
+        -------
+        np.ndarray
+            Scores with dims (cluster, regressor).
+        """
+        return np.column_stack([
+            self.cluster_sums(self.within(name) * resid, codes, n_clusters)
+            for name in names])
+
+    def nested(self, codes):
+        """
+        Whether the fixed effect of a one-way model is nested within the
+        clusters, e.g. counties within states. PanelOLS does not count
+        nested effects in the degrees of freedom of clustered standard
+        errors.
+        """
+        if self.entity_effects and not self.time_effects:
+            return codes.shape[0] == 1 or bool((codes == codes[:1]).all())
+        if self.time_effects and not self.entity_effects:
+            return codes.shape[1] == 1 or bool((codes == codes[:, :1]).all())
+        return False
+
+    def _meat(self, names, resid, cov_type, clusters):
+        """
+        Middle matrix of the sandwich estimator and the number of effects
+        counted in its degrees of freedom correction.
+        """
+        if cov_type == 'robust':
+            e2 = resid ** 2
+            xs = [self.within(name) for name in names]
+            meat = np.empty((len(xs), len(xs)))
+            for i in range(len(xs)):
+                for j in range(i + 1):
+                    meat[i, j] = meat[j, i] = self.total(xs[i] * xs[j] * e2)
+            return meat, self.n_effects
+        codes, n_clusters = self.clusters(clusters)
+        scores = self.scores(names, resid, codes, n_clusters)
+        return scores.T @ scores, 0 if self.nested(codes) else self.n_effects
+
+    def scale(self, k, debiased=True, extra_df=None):
+        """
+        Degrees of freedom correction of the covariance, as in PanelOLS:
+        nobs / (nobs - extra_df - k), where k is only subtracted if
+        debiased. extra_df defaults to the number of effects.
+        """
+        extra_df = self.n_effects if extra_df is None else extra_df
+        return self.nobs / (self.nobs - extra_df - (k if debiased else 0))
+
+    def estimate(self, dependent, exog, cov_type='unadjusted',
+                 debiased=True, drop_absorbed=False, clusters='entity'):
+        """
+        Estimate a model, see fit.
+
+        Returns
+        -------
+        dict
+            names (regressors), params, cov, nobs, df_model, df_resid,
+            rsquared and resid_ss as plain numbers and arrays, e.g. to
+            collect the results of many models.
+        """
+        if cov_type not in COV_TYPES:
+            raise IOError("Covariance type does not exist. Choose one of "
+                          "{}.".format(", ".join(COV_TYPES)))
+        names = self.regressors(exog, drop_absorbed)
+        xx, xy = self.cross_products(names, dependent)
+        xx_inv = inverse(xx, names)
+        params = xx_inv @ xy
+        yy = self.cross_product(dependent, dependent)
+        resid_ss = max(yy - params @ xy, 0.)
+
+        df_model = len(names) + self.n_effects
+        df_resid = self.nobs - df_model
+        if cov_type == 'unadjusted':
+            cov = xx_inv * self.scale(len(names), debiased) * resid_ss / \
+                self.nobs
+        else:
+            resid = self.residuals(dependent, names, params)
+            meat, extra_df = self._meat(names, resid, cov_type, clusters)
+            cov = xx_inv @ meat @ xx_inv * self.scale(len(names), debiased,
+                                                      extra_df)
+
+        total_ss = yy
+        if self.constant:
+            total_ss -= self.cross_product(dependent, CONST) ** 2 / self.nobs
+        return dict(names=names, params=params, cov=cov, nobs=self.nobs,
+                    df_model=df_model, df_resid=df_resid,
+                    rsquared=1 - resid_ss / total_ss if total_ss > 0 else 0.,
+                    resid_ss=resid_ss)
+
+    def fit(self, dependent, exog, cov_type='unadjusted', debiased=True,
+            drop_absorbed=False, clusters='entity'):
+        """
+        Estimate a model.
+
+        Parameters
+        ----------
+        dependent : str
+            Dependent variable.
+        exog : list of str
+            Regressors, without the constant.
+        cov_type : str
+            One of COV_TYPES: 'unadjusted' (homoskedastic), 'robust'
+            (White's heteroskedasticity robust estimator) or 'clustered'.
+        debiased : bool
+            Use a degrees of freedom correction and t instead of normal
+            p-values, as PanelOLS does by default.
+        drop_absorbed : bool
+            Drop regressors absorbed by the fixed effects instead of
+            raising a ValueError.
+        clusters : str or array_like
+            Clusters of clustered standard errors, see clusters.
+
+        Returns
+        -------
+        PanelResults
+        """
+        est = self.estimate(dependent, exog, cov_type, debiased,
+                            drop_absorbed, clusters)
+        names = est.pop('names')
+        return PanelResults(
+            params=pd.Series(est.pop('params'), index=names,
+                             name='parameter'),
+            cov=pd.DataFrame(est.pop('cov'), index=names, columns=names),
+            cov_type=cov_type, debiased=debiased, **est)
+
+
+class FixedEffects(object):
+    """
+    Linear panel regression with county and/or time fixed effects, the
+    counterpart of linearmodels.PanelOLS on (time, county) arrays.
+    """
+    def __init__(self, dependent, exog, entity_effects=False,
+                 time_effects=False, constant=True, drop_absorbed=False,
+                 tol=1e-10, max_iter=1000):
+        """
+        Parameters
+        ----------
+        dependent : array_like
+            Dependent variable with dims (time, county).
+        exog : dict
+            Name -> regressor broadcastable to (time, county): (time,
+            county), (county,) for county level and (time, 1) for time
+            level variables.
+        entity_effects, time_effects : bool
+            Include county and/or time fixed effects.
+        constant : bool
+            Include a constant (named 'const').
+        drop_absorbed : bool
+            Drop regressors that are absorbed by the fixed effects (e.g.
+            county level covariates with entity effects) instead of raising
+            a ValueError.
+        tol, max_iter :
+            Convergence criterion of the two-way demeaning of unbalanced
+            panels, see demean.
+        """
+        y = np.asarray(dependent, dtype=np.float64)
+        if y.ndim != 2:
+            raise ValueError("The dependent variable must have dims (time, "
+                             "county), got shape {}.".format(y.shape))
+        if DEPENDENT in exog:
+            raise ValueError("Regressor {} is reserved for the dependent "
+                             "variable.".format(DEPENDENT))
+        variables = {name: as_panel(x, y.shape) for name, x in exog.items()}
+        variables[DEPENDENT] = y
+        self.exog = list(exog)
+        self.drop_absorbed = drop_absorbed
+        self.panel = Panel(variables, y.shape,
+                           sample(variables.values(), y.shape),
+                           entity_effects, time_effects, constant, tol,
+                           max_iter)
+
+    @property
+    def nobs(self):
+        return self.panel.nobs
+
+    def fit(self, cov_type='unadjusted', debiased=True, clusters='entity'):
+        """
+        Estimate the model.
+
+        Parameters
+        ----------
+        cov_type : str
+            One of COV_TYPES, see Panel.fit.
+        debiased : bool
+            Use a degrees of freedom correction and t instead of normal
+            p-values, as PanelOLS does by default.
+        clusters : str or array_like
+            Clusters of clustered standard errors: 'entity' (county),
+            'time', or cluster ids broadcastable to (time, county), e.g.
+            state FIPS codes per county.
+
+        Returns
+        -------
+        PanelResults
+        """
+        return self.panel.fit(DEPENDENT, self.exog, cov_type, debiased,
+                              self.drop_absorbed, clusters)
+
+
+class PanelResults(object):
+    """
+    Estimates of a panel regression.
+    """
+    def __init__(self, params, cov, nobs, df_model, df_resid, rsquared,
+                 resid_ss, cov_type, debiased):
+        self.params = params
+        self.cov = cov
+        self.nobs = nobs
+        self.df_model = df_model
+        self.df_resid = df_resid
+        self.rsquared = rsquared
+        self.resid_ss = resid_ss
+        self.cov_type = cov_type
+        self.debiased = debiased
+
+    @property
+    def std_errors(self):
+        return pd.Series(np.sqrt(np.diag(self.cov.values)),
+                         index=self.params.index, name='std_error')
+
+    @property
+    def tstats(self):
+        return (self.params / self.std_errors).rename('tstat')
+
+    def _dist(self):
+        return stats.t(self.df_resid) if self.debiased else stats.norm()
+
+    @property
+    def pvalues(self):
+        pvalues = 2 * self._dist().sf(np.abs(self.tstats.values))
+        return pd.Series(pvalues, index=self.params.index, name='pvalue')
+
+    def conf_int(self, level=0.95):
+        """
+        Confidence intervals of the parameters.
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns 'lower', 'upper'.
+        """
+        q = self._dist().ppf(0.5 + level / 2)
+        return pd.DataFrame({'lower': self.params - q * self.std_errors,
+                             'upper': self.params + q * self.std_errors})
+
+    def summary(self):
+        """
+        Parameter table.
+
+        Returns
+        -------
+        pd.DataFrame
+            parameter, std_error, tstat, pvalue, lower, upper per regressor.
+        """
+        return pd.concat([self.params, self.std_errors, self.tstats,
+                          self.pvalues, self.conf_int()], axis=1)
+
+
+if __name__ == '__main__':
+    from src.data.reader import CSSEReader
+    from src.data.covariates import read_covariates
+
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # confirmed cases on county population with time fixed effects
+    with CSSEReader('csse').read_processed2ds() as ds:
+        confirmed = ds['confirmed'].values
+        county = ds['county'].values
+    population = county_covariates(
+        read_covariates('POPEST', ['population']), county)
+    model = FixedEffects(confirmed, population, time_effects=True)
+    print(model.fit().summary())
@@ -2,35 +2,170 @@ import os
 import time
 import logging
 from src.utils.paths import get_parent_dir
+from src.utils.dag import Stage, Pipeline
+from src.data.structure import CSSE
 from src.data.download import CSSEDownloader
 from src.data.transform import CSSETransformer
+from src.data.cube import CSSECube
+from src.data.article_store import ArticleStore
+from src.data.covariates import SOURCES, ingest, get_source
+from src.features.build_features import CSSEFeatures
+from src.features.sentiment_daily import DailySentiment
 
+VARIABLES = ['confirmed', 'deaths']
 
-def run_pipeline():
+
+# stage functions: module level, so they can be sent to worker processes
+# -----------------------------------------------------------------------------
+def download(dirname, incremental):
+    downloader = CSSEDownloader(dirname=dirname)
+    updated = downloader.save_data(incremental=incremental)
+    if incremental:
+        # new dates were appended to the processed files; rebuild only those
+        # that could not be appended to
+        processed_dir = os.path.join(downloader.processed_dir_csse, "US")
+        rebuild = [var for var, dates in updated.items()
+                   if dates is None or not os.path.exists(os.path.join(
+                       processed_dir, downloader.fnames_processed[var]))]
+        if rebuild:
+            CSSETransformer(dirname=dirname).raw2processed(variables=rebuild)
+
+
+def transform(dirname, variable):
+    CSSETransformer(dirname=dirname).raw2processed(variables=[variable])
+
+
+def dataset(dirname, append):
+    CSSETransformer(dirname=dirname).raw2ds(append=append)
+
+
+def cube(dirname):
+    CSSECube(dirname=dirname).build()
+
+
+def features(dirname, append):
+    CSSEFeatures(dirname=dirname).build(append=append)
+
+
+def ingest_covariates():
+    ingest()
+
+
+def sentiment(dirname):
+    DailySentiment(dirname=dirname).build()
+
+
+def get_stages(dirname='csse', incremental=False):
+    """
+    Stages of the programme pipeline with their inputs and outputs.
+
+    Parameters
+    ----------
+    dirname : str
+        Name of the CSSE data sub directories.
+    incremental : bool
+        If True, only fetch and append dates that are new since the last run.
+
+    Returns
+    -------
+    list of Stage
+    """
+    csse = CSSE(dirname)
+    raw = {'confirmed': csse.fname_confirmed_raw,
+           'deaths': csse.fname_deaths_raw}
+    raw = {var: os.path.join(csse.raw_dir_csse, "US", fname)
+           for var, fname in raw.items()}
+    processed = {'confirmed': csse.fname_confirmed_processed,
+                 'deaths': csse.fname_deaths_processed}
+    ancillary = {'confirmed': csse.fname_confirmed_processed_ancillary,
+                 'deaths': csse.fname_deaths_processed_ancillary}
+    processed_dir = os.path.join(csse.processed_dir_csse, "US")
+    fpath_ds = os.path.join(processed_dir, csse.fname_ds)
+    fpath_popest = get_source('POPEST').fpath_processed
+
+    sources = [cls() for cls in SOURCES.values()]
+    sources = [source for source in sources if source.available()]
+    store = ArticleStore()
+
+    fpaths_processed = {var: [os.path.join(processed_dir, processed[var]),
+                              os.path.join(processed_dir, ancillary[var])]
+                        for var in VARIABLES}
+
+    # in incremental mode the download appends to the processed files
+    # itself, so a full transform would overwrite the appended dates
+    outputs = list(raw.values())
+    if incremental:
+        outputs += [f for var in VARIABLES for f in fpaths_processed[var]]
+    stages = [Stage('download', download, outputs=outputs,
+                    always=True, dirname=dirname, incremental=incremental)]
+    if not incremental:
+        stages += [Stage('transform_' + var, transform, inputs=[raw[var]],
+                         outputs=fpaths_processed[var], dirname=dirname,
+                         variable=var)
+                   for var in VARIABLES]
+    stages += [
+        Stage('dataset', dataset, inputs=list(raw.values()),
+              outputs=[fpath_ds], dirname=dirname, append=incremental),
+        Stage('cube', cube, inputs=[fpath_ds],
+              outputs=[CSSECube(dirname).cube_dir], dirname=dirname),
+        Stage('features', features, inputs=[fpath_ds, fpath_popest],
+              outputs=[os.path.join(processed_dir, csse.fname_features)],
+              dirname=dirname, append=incremental),
+        Stage('covariates', ingest_covariates,
+              inputs=[f for source in sources for f in source.fpaths_raw],
+              outputs=[source.fpath_processed for source in sources])]
+    if store.partitions():
+        stages.append(Stage(
+            'sentiment', sentiment, inputs=[store.store_dir, fpath_ds],
+            outputs=[os.path.join(processed_dir, csse.fname_sentiment)],
+            dirname=dirname))
+    return stages
+
+
+def run_pipeline(incremental=False, force=False, n_jobs=None, profiler=None):
     """
     Run all steps. This includes download, processing, transformation,
     feature extraction, model training, prediction and visualization.
+
+    Steps are run as a task graph (see src.utils.dag): independent steps run
+    concurrently, and steps whose input files did not change since their
+    last run are skipped. Time, memory, rows, bytes and cache hit rates of
+    each step are written to logs/profile_<time>.json.
+
+    Parameters
+    ----------
+    incremental : bool
+        If True, only fetch and append dates that are new since the last run.
+    force : bool
+        If True, run all steps even if their inputs did not change.
+    n_jobs : int, optional
+        Maximum number of steps running at the same time.
+    profiler : str, optional
+        'cprofile' or 'pyinstrument' to profile each step that runs. The
+        profiles are written to logs/profiles.
+
+    Returns
+    -------
+    dict
+        Step name -> 'ran' or 'skipped'.
     """
     start_time = time.time()
     logger = logging.getLogger(__name__)
     logger.info('Starting programme pipeline.')
 
-    # run steps
-    # -------------------------------------------------------------------------
-    # 1) Download latest data
-    CSSEDownloader(dirname='csse').save_data()
-
-    # 2) transform data
-    CSSETransformer(dirname='csse').raw2processed()
-    CSSETransformer(dirname='csse').processed2ds()
-
-    # 3) extract features
-    # ...
+    project_dir = get_parent_dir(up=2)
+    fpath_state = os.path.join(project_dir, 'data', 'interim',
+                               'pipeline_state.json')
+    pipeline = Pipeline(get_stages(incremental=incremental), fpath_state,
+                        n_jobs=n_jobs,
+                        report_dir=os.path.join(project_dir, 'logs'),
+                        profiler=profiler)
+    status = pipeline.run(force=force)
 
     execution_time = time.time() - start_time
     logger.info('Programme pipeline successfully '
                 'executed in {:.2f} seconds.'.format(execution_time))
-    return None
+    return status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# returned by get for missing entries in get_or_compute
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Bounded in-memory mapping with least-recently-used eviction and hit/miss
+    statistics. Can be saved to and loaded from disk. Safe to share between
+    threads.
+    """
+    def __init__(self, maxsize=100000):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of entries. The least recently used entry is
+            evicted when the cache is full.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Get an entry and mark it as recently used.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entry if
+        the cache is full.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, func):
+        """
+        Get an entry, computing and adding it with func(key) on a miss.
+        func is called without holding the lock, so two threads may compute
+        the same missing entry.
+
+        Parameters
+        ----------
+        key : hashable
+            Cache key, e.g. a word.
+        func : callable
+            Computes the value of a key, e.g. a stemmer.
+
+        Returns
+        -------
+        The cached or computed value.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(key)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """
+        Remove all entries and reset the statistics.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Cache statistics.
+
+        Returns
+        -------
+        dict
+            hits, misses, evictions, size, maxsize and hit_rate.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            stats = {'hits': hits,
+                     'misses': misses,
+                     'evictions': self.evictions,
+                     'size': len(self._data),
+                     'maxsize': self.maxsize}
+        requests = hits + misses
+        stats['hit_rate'] = hits / requests if requests else None
+        return stats
+
+    def save(self, fpath):
+        """
+        Atomically write the entries, least recently used first, to disk.
+
+        Parameters
+        ----------
+        fpath : str
+            Path to pickle file.
+        """
+        with self._lock:
+            items = list(self._data.items())
+        with open(fpath + '.tmp', 'wb') as f:
+            pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fpath + '.tmp', fpath)
+
+    def load(self, fpath):
+        """
+        Add the entries of a file written by save. Missing files are ignored.
+
+        Parameters
+        ----------
+        fpath : str
+            Path to pickle file.
+
+        Returns
+        -------
+        self
+        """
+        if not os.path.exists(fpath):
+            return self
+        with open(fpath, 'rb') as f:
+            items = pickle.load(f)
+        for key, value in items[-self.maxsize:]:
+            self.put(key, value)
+        return self
@@ -0,0 +1,391 @@
+"""
+Minimal task graph runner.
+
+A pipeline is a list of stages. Each stage declares the files (or
+directories) it reads and writes. A stage depends on the stages that write
+its inputs and runs once they have finished; stages that do not depend on
+each other run concurrently on a pool of worker processes (or threads).
+
+A stage is skipped if all its outputs exist and the content hash of its
+inputs is the one recorded after its last successful run. Content hashes
+are cached per file together with its size and modification time, so
+unchanged files are not read again and a run in which nothing changed only
+costs a stat call per file.
+
+Every stage is measured (see src.utils.profiling): wall and CPU time, peak
+RSS, bytes of its input and output files, the rows and hot functions it
+reported, and the hit rates of the caches it used. With a report directory,
+the measurements of a run are written to <report_dir>/profile_<time>.json,
+and stages can be profiled with cProfile or pyinstrument.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    wait, FIRST_COMPLETED
+from src.utils.profiling import run_profiled, write_report, PROFILERS
+
+EXECUTORS = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}
+
+
+class Stage(object):
+    """
+    Step of a pipeline: a function with declared inputs and outputs.
+    """
+    def __init__(self, name, func, inputs=(), outputs=(), after=(),
+                 always=False, **kwargs):
+        """
+        Parameters
+        ----------
+        name : str
+            Unique name of the stage.
+        func : callable
+            Module level function (picklable for the process pool), called
+            as func(**kwargs).
+        inputs, outputs : list of str
+            Paths of the files or directories read and written by func.
+        after : list of str
+            Names of stages to wait for, in addition to those writing the
+            inputs.
+        always : bool
+            Never skip the stage, e.g. a download that checks the remote
+            side itself.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.always = always
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return 'Stage({!r})'.format(self.name)
+
+
+def _iter_files(path):
+    """
+    Files of a path in a fixed order: the file itself or all files below a
+    directory. Temporary files of atomic writes are ignored.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                if not fname.endswith('.tmp'):
+                    yield os.path.join(root, fname)
+    elif os.path.exists(path):
+        yield path
+
+
+def _contains(outer, inner):
+    """
+    Whether path inner is equal to or below path outer.
+    """
+    outer, inner = os.path.abspath(outer), os.path.abspath(inner)
+    return inner == outer or inner.startswith(outer.rstrip(os.sep) + os.sep)
+
+
+class FileHasher(object):
+    """
+    Content hashes of files, cached by (size, modification time).
+    """
+    def __init__(self, cache=None):
+        """
+        Parameters
+        ----------
+        cache : dict, optional
+            path -> [size, mtime_ns, sha1] of an earlier run.
+        """
+        self.cache = {} if cache is None else cache
+        self.lookups = 0
+        self.hashed = 0
+
+    def file_digest(self, fpath):
+        self.lookups += 1
+        stat = os.stat(fpath)
+        entry = self.cache.get(fpath)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+
+        sha1 = hashlib.sha1()
+        with open(fpath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        self.hashed += 1
+        self.cache[fpath] = [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+        return sha1.hexdigest()
+
+    def digest(self, paths):
+        """
+        Combined content hash of files and directories. Missing paths
+        contribute a marker, so creating them changes the hash.
+
+        Parameters
+        ----------
+        paths : list of str
+
+        Returns
+        -------
+        str
+        """
+        sha1 = hashlib.sha1()
+        for path in paths:
+            sha1.update(path.encode('utf-8'))
+            if not os.path.exists(path):
+                sha1.update(b'\0missing')
+            for fpath in _iter_files(path):
+                sha1.update(fpath.encode('utf-8'))
+                sha1.update(self.file_digest(fpath).encode('ascii'))
+        return sha1.hexdigest()
+
+    def stats(self):
+        """
+        Hit/miss statistics of the hash cache.
+        """
+        hits = self.lookups - self.hashed
+        return {'hits': hits, 'misses': self.hashed,
+                'hit_rate': hits / self.lookups if self.lookups else None}
+
+
+def _size(paths):
+    """
+    Total size of files and directories in bytes.
+    """
+    return sum(os.path.getsize(f) for path in paths
+               for f in _iter_files(path))
+
+
+class Pipeline(object):
+    """
+    Runs stages in dependency order, concurrently where possible, skipping
+    stages whose inputs did not change.
+    """
+    def __init__(self, stages, fpath_state, n_jobs=None, executor='process',
+                 report_dir=None, profiler=None):
+        """
+        Parameters
+        ----------
+        stages : list of Stage
+            Stages in a valid (topological) order.
+        fpath_state : str
+            JSON file that keeps the input hashes of the last runs.
+        n_jobs : int, optional
+            Maximum number of concurrent stages. Defaults to the number of
+            stages.
+        executor : str
+            'process' or 'thread'. Threads avoid the start up cost of
+            processes but share the GIL, and the measurements of hot
+            functions are per process, so concurrent stages mix theirs.
+        report_dir : str, optional
+            Directory of the JSON reports and profiles, e.g. "logs". No
+            report is written if not given.
+        profiler : str, optional
+            'cprofile' or 'pyinstrument' to profile every stage that runs.
+            Profiles are written to <report_dir>/profiles.
+        """
+        if executor not in EXECUTORS:
+            raise IOError("Executor does not exist. Choose one of "
+                          "{}.".format(", ".join(sorted(EXECUTORS))))
+        if profiler is not None and profiler not in PROFILERS:
+            raise IOError("Profiler does not exist. Choose one of "
+                          "{}.".format(", ".join(PROFILERS)))
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError("Duplicated stage {}.".format(stage.name))
+            self.stages[stage.name] = stage
+        self.fpath_state = fpath_state
+        self.n_jobs = n_jobs or len(stages)
+        self.executor = executor
+        self.report_dir = report_dir
+        self.profiler = profiler
+        self.deps = self._dependencies()
+
+    def _dependencies(self):
+        """
+        Stage name -> names of the stages it waits for.
+        """
+        deps = {}
+        names = list(self.stages)
+        for i, name in enumerate(names):
+            stage = self.stages[name]
+            deps[name] = set(stage.after)
+            for other in names[:i]:
+                if any(_contains(out, path) or _contains(path, out)
+                       for out in self.stages[other].outputs
+                       for path in stage.inputs):
+                    deps[name].add(other)
+            unknown = deps[name] - set(names[:i])
+            if unknown:
+                raise ValueError("Stage {} waits for unknown or later stages "
+                                 "{}.".format(name, sorted(unknown)))
+        return deps
+
+    def read_state(self):
+        """
+        State of the last runs: 'stages' (name -> input hash and time of
+        the last successful run) and 'files' (hash cache of FileHasher).
+        """
+        if not os.path.exists(self.fpath_state):
+            return {'stages': {}, 'files': {}}
+        with open(self.fpath_state, 'r') as f:
+            return json.load(f)
+
+    def write_state(self, state):
+        fdir = os.path.dirname(self.fpath_state)
+        if not os.path.exists(fdir):
+            os.makedirs(fdir)
+        with open(self.fpath_state + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(self.fpath_state + '.tmp', self.fpath_state)
+
+    def _is_current(self, stage, digest, state):
+        if stage.always:
+            return False
+        if not all(os.path.exists(path) for path in stage.outputs):
+            return False
+        return state['stages'].get(stage.name, {}).get('inputs') == digest
+
+    def _ready(self, pending, status):
+        """
+        Pending stages whose dependencies are done, in declaration order.
+        Stages depending on a failed stage are marked as blocked.
+        """
+        ready = []
+        for name in [n for n in self.stages if n in pending]:
+            if any(status.get(d) in ('failed', 'blocked')
+                   for d in self.deps[name]):
+                status[name] = 'blocked'
+                pending.discard(name)
+            elif all(status.get(d) in ('ran', 'skipped')
+                     for d in self.deps[name]):
+                ready.append(name)
+        return ready
+
+    def run(self, force=False):
+        """
+        Run the pipeline.
+
+        Parameters
+        ----------
+        force : bool
+            Run all stages, even if their inputs did not change.
+
+        Returns
+        -------
+        dict
+            Stage name -> 'ran', 'skipped', 'failed' or 'blocked' (a stage
+            it depends on failed).
+        """
+        logger = logging.getLogger(__name__)
+        start = time.time()
+        self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        state = self.read_state()
+        hasher = FileHasher(state['files'])
+        pending = set(self.stages)
+        status = {}
+        metrics = {}
+        running = {}
+
+        with EXECUTORS[self.executor](max_workers=self.n_jobs) as pool:
+            while pending or running:
+                for name in self._ready(pending, status):
+                    pending.discard(name)
+                    submitted = self._submit(pool, name, hasher, state, force)
+                    if submitted is None:
+                        status[name] = 'skipped'
+                        metrics[name] = {'status': 'skipped'}
+                    else:
+                        running[submitted] = name
+                if not running:
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    metrics[name] = self._collect(future, name, state)
+                    status[name] = metrics[name]['status']
+                state['files'] = hasher.cache
+                self.write_state(state)
+
+        logger.info('Hashed {} changed files.'.format(hasher.hashed))
+        state['files'] = hasher.cache
+        self.write_state(state)
+        self._report(start, force, status, metrics, hasher)
+        failed = [n for n, s in status.items() if s in ('failed', 'blocked')]
+        if failed:
+            raise RuntimeError("Stages failed: {}.".format(", ".join(failed)))
+        return status
+
+    def _submit(self, pool, name, hasher, state, force):
+        """
+        Submit a stage unless it is up to date. Returns the future or None.
+        """
+        logger = logging.getLogger(__name__)
+        stage = self.stages[name]
+        digest = hasher.digest(stage.inputs)
+        if not force and self._is_current(stage, digest, state):
+            logger.info('Stage {} is up to date.'.format(name))
+            return None
+
+        logger.info('Starting stage {}.'.format(name))
+        fpath_profile = None
+        if self.profiler is not None:
+            fpath_profile = os.path.join(self.report_dir or os.getcwd(),
+                                         'profiles',
+                                         '{}_{}'.format(self.run_id, name))
+        future = pool.submit(run_profiled, stage.func, stage.kwargs,
+                             self.profiler, fpath_profile)
+        future.digest = digest
+        future.bytes_in = _size(stage.inputs)
+        return future
+
+    def _collect(self, future, name, state):
+        """
+        Record the outcome and the measurements of a finished stage.
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            _, metrics = future.result()
+        except Exception:
+            logger.exception('Stage {} failed.'.format(name))
+            state['stages'].pop(name, None)
+            return {'status': 'failed'}
+        logger.info('Finished stage {} in {:.2f} seconds.'.format(
+            name, metrics['wall']))
+        state['stages'][name] = {'inputs': future.digest,
+                                 'finished': time.time()}
+        metrics.update(status='ran', input_bytes=future.bytes_in,
+                       output_bytes=_size(self.stages[name].outputs))
+        return metrics
+
+    def _report(self, start, force, status, metrics, hasher):
+        """
+        Write the measurements of a run to the report directory.
+        """
+        if self.report_dir is None:
+            return None
+        for name in status:
+            metrics.setdefault(name, {})['status'] = status[name]
+        n_skipped = sum(s == 'skipped' for s in status.values())
+        report = {
+            'run_id': self.run_id,
+            'started': start,
+            'wall': time.time() - start,
+            'force': force,
+            'executor': self.executor,
+            'stages': metrics,
+            'caches': {
+                'stages': {'hits': n_skipped,
+                           'misses': len(status) - n_skipped,
+                           'hit_rate': n_skipped / len(status)
+                           if status else None},
+                'file_hashes': hasher.stats()}}
+        fpath = os.path.join(self.report_dir,
+                             'profile_{}.json'.format(self.run_id))
+        write_report(report, fpath)
+        logging.getLogger(__name__).info('Wrote {}.'.format(fpath))
+        return fpath
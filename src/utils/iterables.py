@@ -0,0 +1,23 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most size elements, lazily.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Any iterable, e.g. a generator.
+    size : int
+        Maximum number of elements per list.
+
+    Returns
+    -------
+    generator of list
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
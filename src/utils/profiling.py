@@ -0,0 +1,296 @@
+"""
+Instrumentation of pipeline stages and hot functions.
+
+Functions decorated with `profiled` record their number of calls, wall
+time, CPU time and the peak resident set size of the process after the
+call (sampled after calls longer than a millisecond). Within a timed
+function, `count` adds the number of rows and bytes read and written;
+counts go to all timed blocks that are active in the current thread or
+task, so a stage includes the counts of the functions it calls. Caches
+register a function returning their hit/miss statistics with
+`register_cache`.
+
+`run_profiled` runs a pipeline stage (in a worker process or thread) and
+returns its measurements together with those of the hot functions it
+called. Each stage records into its own collector, held in a context
+variable, so stages running concurrently in threads of the same process
+do not mix their measurements. Optionally, the stage runs under cProfile
+or pyinstrument and the profile is written next to the report. See
+src.utils.dag for the JSON report written to logs/ after each run.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import contextvars
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+COUNTERS = ['rows_in', 'rows_out', 'bytes_in', 'bytes_out']
+
+# peak RSS is only sampled after calls longer than this (seconds)
+RSS_MIN_WALL = 1e-3
+
+# per process: name -> accumulated measurements, name -> statistics function
+_metrics = {}
+_caches = {}
+_lock = threading.Lock()
+# timed blocks that are active, and the measurements of the running stage
+_stack = contextvars.ContextVar('stack', default=())
+_collector = contextvars.ContextVar('collector', default=None)
+
+
+def peak_rss():
+    """
+    Peak resident set size of the current process in bytes, None if
+    unknown.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def children_cpu_time():
+    """
+    CPU time (user + system) of the terminated child processes, e.g. the
+    workers of a process pool, in seconds.
+    """
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Timer(object):
+    """
+    Context manager that times a block and records it under a name.
+    """
+    __slots__ = ['name', 'counters', 'wall', 'cpu', 'rss', '_token']
+
+    def __init__(self, name):
+        """
+        Parameters
+        ----------
+        name : str or None
+            Name of the measurements. If None, the block is only measured
+            (wall, cpu, rss and counters attributes after the block), not
+            recorded.
+        """
+        self.name = name
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def __enter__(self):
+        self._token = _stack.set(_stack.get() + (self,))
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+        _stack.reset(self._token)
+        # getrusage costs about as much as a short call of a hot function
+        self.rss = peak_rss() if self.wall > RSS_MIN_WALL else None
+        if self.name is None:
+            return False
+        metrics = _collector.get()
+        with _lock:
+            if metrics is None:
+                metrics = _metrics
+            entry = metrics.get(self.name)
+            if entry is None:
+                entry = metrics[self.name] = dict(
+                    calls=0, wall=0., cpu=0., peak_rss=None,
+                    **dict.fromkeys(COUNTERS, 0))
+            entry['calls'] += 1
+            entry['wall'] += self.wall
+            entry['cpu'] += self.cpu
+            if self.rss is not None:
+                entry['peak_rss'] = self.rss
+            for key, value in self.counters.items():
+                entry[key] += value
+        return False
+
+
+def profiled(func):
+    """
+    Decorator that records calls of a function under its qualified name,
+    e.g. "src.data.transform.CSSETransformer.raw2processed".
+    """
+    name = '{}.{}'.format(func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with Timer(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def count(**counters):
+    """
+    Add rows and bytes read or written (rows_in, rows_out, bytes_in,
+    bytes_out) to the active timed blocks. Does nothing outside of them.
+    """
+    for key in counters:
+        if key not in COUNTERS:
+            raise IOError("Counter does not exist. Choose one of "
+                          "{}.".format(", ".join(COUNTERS)))
+    for block in _stack.get():
+        for key, value in counters.items():
+            block.counters[key] += int(value)
+
+
+def register_cache(name, stats):
+    """
+    Register a cache whose statistics are reported with the measurements.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache in the report.
+    stats : callable
+        Returns a dict of statistics, e.g. hits, misses and hit_rate.
+    """
+    _caches[name] = stats
+
+
+def snapshot(metrics=None):
+    """
+    Measurements of the current process, or of a collector.
+
+    Parameters
+    ----------
+    metrics : dict, optional
+        Collector of a stage (see run_profiled). Defaults to the
+        measurements recorded outside of stages.
+
+    Returns
+    -------
+    dict
+        'functions': name -> calls, wall, cpu, peak_rss and counters.
+        'caches': name -> statistics of the registered caches.
+    """
+    if metrics is None:
+        metrics = _metrics
+    with _lock:
+        functions = {name: dict(entry) for name, entry in metrics.items()}
+    return {'functions': functions,
+            'caches': {name: stats() for name, stats in _caches.items()}}
+
+
+def reset():
+    """
+    Forget the measurements recorded outside of stages.
+    """
+    with _lock:
+        _metrics.clear()
+
+
+def _start_profiler(profiler):
+    if profiler is None:
+        return None
+    if profiler not in PROFILERS:
+        raise IOError("Profiler does not exist. Choose one of "
+                      "{}.".format(", ".join(PROFILERS)))
+    # only imported when profiling; pyinstrument is optional
+    if profiler == 'cprofile':
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+    else:
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+    return prof
+
+
+def _stop_profiler(prof, fpath):
+    """
+    Stop a profiler and write its profile. Returns the path of the file.
+    """
+    if prof is None:
+        return None
+    fdir = os.path.dirname(fpath)
+    if fdir and not os.path.exists(fdir):
+        os.makedirs(fdir)
+    if hasattr(prof, 'dump_stats'):
+        prof.disable()
+        fpath += '.prof'
+        prof.dump_stats(fpath)
+    else:
+        prof.stop()
+        fpath += '.html'
+        with open(fpath, 'w') as f:
+            f.write(prof.output_html())
+    return fpath
+
+
+def run_profiled(func, kwargs=None, profiler=None, fpath_profile=None):
+    """
+    Run a function, e.g. a pipeline stage, and measure it.
+
+    Parameters
+    ----------
+    func : callable
+        Called as func(**kwargs).
+    kwargs : dict, optional
+        Keyword arguments of func.
+    profiler : str, optional
+        'cprofile' or 'pyinstrument' to profile the call.
+    fpath_profile : str, optional
+        Path of the profile without extension (.prof for cProfile, to be
+        read with pstats or snakeviz; .html for pyinstrument).
+
+    Returns
+    -------
+    result
+        Return value of func.
+    metrics : dict
+        wall, cpu, cpu_children (terminated child processes), peak_rss
+        (of the process, which may have run other stages before), the
+        counters, and 'functions' and 'caches' as in snapshot. 'profile' is
+        the path of the profile, if any.
+    """
+    collector = {}
+    token = _collector.set(collector)
+    try:
+        cpu_children = children_cpu_time()
+        prof = _start_profiler(profiler)
+        with Timer(None) as stage:
+            result = func(**(kwargs or {}))
+        profile = _stop_profiler(prof, fpath_profile or 'profile')
+    finally:
+        _collector.reset(token)
+
+    metrics = snapshot(collector)
+    metrics.update(stage.counters, wall=stage.wall, cpu=stage.cpu,
+                   peak_rss=stage.rss or peak_rss(), profile=profile,
+                   cpu_children=children_cpu_time() - cpu_children)
+    return result, metrics
+
+
+def write_report(report, fpath):
+    """
+    Atomically write a report as JSON.
+
+    Parameters
+    ----------
+    report : dict
+        Measurements, e.g. of a pipeline run.
+    fpath : str
+        Path of the JSON file.
+    """
+    fdir = os.path.dirname(fpath)
+    if fdir and not os.path.exists(fdir):
+        os.makedirs(fdir)
+    with open(fpath + '.tmp', 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    os.replace(fpath + '.tmp', fpath)
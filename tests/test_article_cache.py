@@ -0,0 +1,48 @@
+"""
+The running size total of ArticleCache against summing the sizes of the
+stored objects, through stores, replacements, evictions and reopening.
+"""
+from src.data.article_cache import ArticleCache
+
+
+def page(n):
+    return ('<html><p>Article {}.</p></html>'.format(n) * (n + 1)).encode()
+
+
+def summed_size(cache):
+    return cache.db.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+
+def test_size_is_kept_up_to_date(tmp_path):
+    dirname = str(tmp_path / 'cache')
+    with ArticleCache(dirname) as cache:
+        for n in range(10):
+            cache.store('http://example.com/{}'.format(n), page(n),
+                        'Article {}.'.format(n))
+            assert cache.size() == summed_size(cache)
+        # same content, other URL and text: the object is replaced
+        cache.store('http://example.com/other', page(3), 'Other text.')
+        assert cache.size() == summed_size(cache)
+        assert cache.stats()['n_objects'] == 10
+
+        size = cache.size()
+        assert cache.evict(max_bytes=size // 2) > 0
+        assert cache.size() == summed_size(cache) <= size // 2
+        assert cache.lookup('http://example.com/0') is None
+
+    # reopened, the total is summed once
+    with ArticleCache(dirname) as cache:
+        assert cache.size() == summed_size(cache) > 0
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    with ArticleCache(str(tmp_path / 'cache')) as cache:
+        for n in range(3):
+            cache.store('http://example.com/{}'.format(n), page(n), '')
+        cache.lookup('http://example.com/0')
+        cache.max_bytes = cache.size()
+        cache.store('http://example.com/3', page(3), '')
+        assert cache.lookup('http://example.com/0') is not None
+        assert cache.lookup('http://example.com/1') is None
+        assert cache.size() == summed_size(cache) <= cache.max_bytes
@@ -0,0 +1,140 @@
+"""
+ArticleFetcher against a local aiohttp server: rate limiting, redirects,
+revalidation of cached pages, missing pages and the per-host limit.
+"""
+import time
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from src.data.articles import ArticleFetcher
+from src.data.article_cache import ArticleCache
+
+# seconds the server asks to wait after a 429
+RETRY_AFTER = 1
+
+
+class Articles(object):
+    """
+    Local article server, recording the requests it receives.
+    """
+    def __init__(self):
+        self.log = []
+        self.times = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.n_missing = 0
+        self.app = web.Application()
+        self.app.router.add_get('/page/{n}', self.page)
+        self.app.router.add_get('/limited', self.limited)
+        self.app.router.add_get('/moved', self.moved)
+        self.app.router.add_get('/missing', self.missing)
+        self.app.router.add_get('/slow/{n}', self.slow)
+
+    async def page(self, request):
+        """
+        Article n, with its ETag; 304 if the client has the current version.
+        """
+        n = request.match_info['n']
+        etag = '"v{}"'.format(n)
+        self.log.append((request.path, request.headers.get('If-None-Match')))
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text='<p>Article {}.</p>'.format(n),
+                            content_type='text/html', headers={'ETag': etag})
+
+    async def limited(self, request):
+        """
+        Too Many Requests on the first request, the article afterwards.
+        """
+        self.times.append(time.monotonic())
+        if len(self.times) == 1:
+            return web.Response(status=429,
+                                headers={'Retry-After': str(RETRY_AFTER)})
+        return web.Response(text='<p>Finally.</p>', content_type='text/html')
+
+    async def moved(self, request):
+        raise web.HTTPFound('/page/1')
+
+    async def missing(self, request):
+        self.n_missing += 1
+        raise web.HTTPNotFound()
+
+    async def slow(self, request):
+        """
+        Article that takes a while, recording the requests in flight.
+        """
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.in_flight -= 1
+        return web.Response(text='<p>Slow.</p>', content_type='text/html')
+
+
+def fetch(*batches, **kwargs):
+    """
+    Fetch batches of paths one after the other from one test server.
+
+    Returns
+    -------
+    results : list of list of dict
+        Per batch, see ArticleFetcher.fetch_all.
+    articles : Articles
+        The server with its records.
+    """
+    articles = Articles()
+
+    async def main():
+        async with TestServer(articles.app) as server:
+            fetcher = ArticleFetcher(n_parsers=0, backoff=0.01, **kwargs)
+            return [await fetcher.fetch_all(
+                [str(server.make_url(path)) for path in paths])
+                for paths in batches]
+    return asyncio.run(main()), articles
+
+
+def test_retry_after_429():
+    [(result,)], articles = fetch(['/limited'])
+    assert result['status'] == 200
+    assert result['error'] is None
+    assert result['text'] == 'Finally.'
+    first, second = articles.times
+    assert second - first >= RETRY_AFTER * 0.9
+
+
+def test_redirect():
+    [(result,)], _ = fetch(['/moved'])
+    assert result['status'] == 200
+    assert result['final_url'].endswith('/page/1')
+    assert result['text'] == 'Article 1.'
+
+
+def test_not_found_is_not_retried():
+    [(result,)], articles = fetch(['/missing'], retries=3)
+    assert articles.n_missing == 1
+    assert result['status'] == 404
+    assert result['error'] == 'HTTP 404'
+    assert result['text'] is None
+
+
+def test_revalidation(tmp_path):
+    # entries are stale immediately, so the second run revalidates
+    with ArticleCache(str(tmp_path / 'cache'), max_age=0) as cache:
+        [(first,), (second,)], articles = fetch(['/page/7'], ['/page/7'],
+                                                cache=cache)
+        assert cache.revalidated == 1
+
+    assert not first['cached']
+    assert articles.log == [('/page/7', None), ('/page/7', '"v7"')]
+    assert second['status'] == 304
+    assert second['error'] is None
+    assert second['cached']
+    assert second['text'] == first['text'] == 'Article 7.'
+
+
+def test_per_host_limit():
+    paths = ['/slow/{}'.format(i) for i in range(12)]
+    [results], articles = fetch(paths, concurrency=8, per_host=2)
+    assert all(result['error'] is None for result in results)
+    assert articles.max_in_flight == 2
@@ -0,0 +1,79 @@
+"""
+Wild cluster bootstrap t statistics against refitting the model on every
+bootstrap sample.
+"""
+import numpy as np
+import pytest
+from src.models.train_model import FixedEffects, DEPENDENT
+from src.models.bootstrap import WildClusterBootstrap, bootstrap_tstats, \
+    draw_weights
+
+N_TIMES = 12
+N_COUNTIES = 30
+REPS = 20
+
+# five counties per state
+STATES = np.repeat(np.arange(1, 7), 5) * 1000 + 1
+
+EFFECTS = [(False, False), (True, False), (False, True), (True, True)]
+
+
+def panel_data(balanced):
+    rng = np.random.default_rng(0)
+    shape = (N_TIMES, N_COUNTIES)
+    x = rng.normal(size=shape)
+    z = rng.normal(size=shape)
+    y = 0.5 * x + rng.normal(size=shape) + rng.normal(size=N_COUNTIES) + \
+        rng.normal(size=(N_TIMES, 1))
+    if not balanced:
+        y[rng.random(shape) < 0.15] = np.nan
+    return y, {'x': x, 'z': z}
+
+
+def refit_tstats(boot, y, exog, param, v, effects, clusters):
+    """
+    t statistics of the restricted wild cluster bootstrap by refitting the
+    model on y - u_r * (1 - v_g) for every replication.
+    """
+    restricted = [name for name in boot.names if name != param]
+    xx, xy = boot.panel.cross_products(restricted, DEPENDENT)
+    resid = boot.panel.residuals(DEPENDENT, restricted,
+                                 np.linalg.solve(xx, xy))
+    codes = np.broadcast_to(boot.codes, y.shape)
+    tstats = []
+    for rep in range(v.shape[1]):
+        sample = y - resid * (1 - v[codes, rep])
+        model = FixedEffects(sample, exog, *effects)
+        res = model.fit('clustered', clusters=clusters)
+        tstats.append(res.tstats[param])
+    return np.array(tstats)
+
+
+@pytest.mark.parametrize('clusters', [STATES, 'entity', 'time'],
+                         ids=['state', 'entity', 'time'])
+@pytest.mark.parametrize('effects', EFFECTS,
+                         ids=['none', 'entity', 'time', 'both'])
+@pytest.mark.parametrize('balanced', [True, False],
+                         ids=['balanced', 'unbalanced'])
+def test_tstats_equal_refit(balanced, effects, clusters):
+    y, exog = panel_data(balanced)
+    model = FixedEffects(y, exog, *effects)
+    boot = WildClusterBootstrap.from_model(model, clusters)
+    v = draw_weights(np.random.default_rng(1), boot.n_clusters, REPS)
+    for param in ['x', 'z']:
+        tstats = bootstrap_tstats(np.random.default_rng(1), REPS,
+                                  [boot.prepare(param)], boot.scale,
+                                  boot.n_clusters)[0]
+        expected = refit_tstats(boot, y, exog, param, v, effects, clusters)
+        np.testing.assert_allclose(tstats, expected, rtol=1e-8, atol=1e-8)
+
+
+def test_results_do_not_depend_on_workers():
+    y, exog = panel_data(balanced=True)
+    boot = WildClusterBootstrap.from_model(
+        FixedEffects(y, exog, time_effects=True), STATES)
+    one = boot.test(reps=50, seed=3, n_jobs=1, batch_size=20)
+    draws = boot.draws
+    two = boot.test(reps=50, seed=3, n_jobs=2, batch_size=20)
+    assert one.equals(two)
+    assert draws.equals(boot.draws)
@@ -0,0 +1,89 @@
+"""
+Derived metrics appended day by day (CSSEFeatures.build with append=True)
+against a full rebuild, in temporary data directories.
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from src.data.transform import write_ds
+from src.features import build_features
+from src.features.build_features import CSSEFeatures
+
+COUNTY = np.array([1001, 1003, 6037, 36061, 72001, 80036, 99999])
+N_TIMES = 40
+N_OLD = 25
+
+
+@pytest.fixture
+def dataset():
+    """
+    Cumulative counts that start at zero, so growth rates are undefined for
+    the first days.
+    """
+    rng = np.random.default_rng(0)
+    shape = (N_TIMES, len(COUNTY))
+    new = rng.integers(0, 20, shape) * (rng.random(shape) > 0.3)
+    new[:5] = 0
+    return xr.Dataset(
+        {'confirmed': (['time', 'county'], np.cumsum(new, axis=0)),
+         'deaths': (['time', 'county'], np.cumsum(new // 10, axis=0))},
+        coords={'time': pd.date_range('2020-03-01', periods=N_TIMES).values,
+                'county': COUNTY})
+
+
+@pytest.fixture(autouse=True)
+def population(monkeypatch):
+    """
+    County populations instead of the POPEST covariates; unknown for the
+    entities without a state.
+    """
+    df = pd.DataFrame({'population': [55869., 223234., 1e7, 1.6e6, 18000.]},
+                      index=COUNTY[:5])
+    monkeypatch.setattr(build_features, 'read_covariates',
+                        lambda name, columns=None: df)
+
+
+def relocated(root):
+    """
+    CSSEFeatures reading and writing the data directory below root.
+    """
+    features = CSSEFeatures('csse')
+    features.processed_dir = os.path.join(str(root), 'processed')
+    features.processed_dir_csse = os.path.join(features.processed_dir,
+                                               'csse')
+    fdir = os.path.join(features.processed_dir_csse, 'US')
+    os.makedirs(fdir)
+    features.fpath_features = os.path.join(fdir, features.fname_features)
+    return features
+
+
+def write_dataset(features, ds):
+    """
+    Write the dataset that features are built from.
+    """
+    write_ds(os.path.join(features.processed_dir_csse, 'US',
+                          features.fname_ds), ds, features.time_chunk)
+
+
+@pytest.mark.parametrize('n_new', [1, 3, 10], ids=['1d', '3d', '10d'])
+def test_append_equals_rebuild(dataset, tmp_path, n_new):
+    n_times = N_OLD + n_new
+
+    appended = relocated(tmp_path / 'appended')
+    write_dataset(appended, dataset.isel(time=slice(N_OLD)))
+    appended.build()
+    inode = os.stat(appended.fpath_features).st_ino
+    write_dataset(appended, dataset.isel(time=slice(n_times)))
+    appended.build(append=True)
+    # appended in place, not rewritten
+    assert os.stat(appended.fpath_features).st_ino == inode
+
+    full = relocated(tmp_path / 'full')
+    write_dataset(full, dataset.isel(time=slice(n_times)))
+    full.build(append=False)
+
+    with appended.read_features() as a, full.read_features() as b:
+        assert a.dims['time'] == n_times
+        xr.testing.assert_equal(a.load(), b.load())
@@ -0,0 +1,74 @@
+"""
+CSSECube built in a temporary directory against the dataset it is built
+from.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from src.data.cube import CSSECube, NO_STATE, state_fips
+
+# counties in FIPS order, with the special CSSE entities
+COUNTY = np.array([60, 1001, 1003, 6037, 36061, 72001, 80001, 80036, 88888,
+                   90036, 99999])
+TIME = pd.date_range('2020-03-01', periods=15).values
+
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    shape = (len(TIME), len(COUNTY))
+    return xr.Dataset(
+        {var: (['time', 'county'],
+               np.cumsum(rng.integers(0, 50, shape), axis=0))
+         for var in CSSECube.variables},
+        coords={'time': TIME, 'county': COUNTY})
+
+
+@pytest.fixture
+def cube(dataset, tmp_path):
+    cube = CSSECube('csse')
+    cube.cube_dir = str(tmp_path / 'cube')
+    return cube.build(dataset).open()
+
+
+def test_state_fips():
+    np.testing.assert_array_equal(
+        state_fips(COUNTY),
+        [60, 1, 1, 6, 36, 72, 1, 36, NO_STATE, 36, NO_STATE])
+
+
+def test_states_are_contiguous(cube, dataset):
+    for state in np.unique(state_fips(COUNTY)):
+        values, time, county = cube.sel('confirmed', state=state)
+        expected = COUNTY[state_fips(COUNTY) == state]
+        assert sorted(county) == sorted(expected)
+        np.testing.assert_array_equal(
+            values, dataset['confirmed'].sel(county=county).values)
+        # a view of the memory map
+        assert not values.flags.owndata
+
+
+def test_select_counties_and_dates(cube, dataset):
+    counties = [36061, 1001, 88888]
+    values, time, county = cube.sel('deaths', counties=counties,
+                                    start='2020-03-03', end='2020-03-10')
+    expected = dataset['deaths'].sel(county=counties,
+                                     time=slice('2020-03-03', '2020-03-10'))
+    np.testing.assert_array_equal(county, counties)
+    np.testing.assert_array_equal(time, expected['time'].values)
+    np.testing.assert_array_equal(values, expected.values)
+
+
+def test_unknown_keys(cube):
+    with pytest.raises(KeyError):
+        cube.columns([1005])
+    with pytest.raises(KeyError):
+        cube.state_slice(88)
+
+
+def test_values_must_fit(dataset, tmp_path):
+    cube = CSSECube('csse')
+    cube.cube_dir = str(tmp_path / 'cube')
+    with pytest.raises(ValueError):
+        cube.build(dataset * 1000, dtype=np.int8)
@@ -0,0 +1,161 @@
+"""
+Pipeline runs in a temporary directory with thread stages that copy and
+combine files: skipping on unchanged content, dependency inference,
+blocked stages and the report.
+"""
+import os
+import glob
+import json
+import pytest
+from src.utils.dag import Stage, Pipeline, FileHasher
+from src.utils.profiling import count
+
+
+def copy(src, dst):
+    with open(src) as f:
+        text = f.read()
+    write(dst, text.upper())
+    count(rows_in=text.count('\n'), bytes_out=len(text))
+
+
+def combine(srcs, dst):
+    text = ''
+    for src in srcs:
+        with open(src) as f:
+            text += f.read()
+    write(dst, text)
+
+
+def fail():
+    raise RuntimeError('stage failed')
+
+
+def write(fpath, text):
+    if not os.path.exists(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    with open(fpath, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def files(tmp_path):
+    """
+    Two raw files and the paths of the stages' outputs.
+    """
+    paths = {name: str(tmp_path / name) for name in
+             ['raw/a.txt', 'raw/b.txt', 'interim/a.txt', 'interim/b.txt',
+              'processed/ab.txt', 'state.json', 'logs']}
+    write(paths['raw/a.txt'], 'a\n')
+    write(paths['raw/b.txt'], 'b\n')
+    return paths
+
+
+def pipeline(paths, **kwargs):
+    """
+    copy a, copy b -> combine both interim files (a directory input).
+    """
+    interim = os.path.dirname(paths['interim/a.txt'])
+    stages = [
+        Stage('copy_a', copy, [paths['raw/a.txt']], [paths['interim/a.txt']],
+              src=paths['raw/a.txt'], dst=paths['interim/a.txt']),
+        Stage('copy_b', copy, [paths['raw/b.txt']], [paths['interim/b.txt']],
+              src=paths['raw/b.txt'], dst=paths['interim/b.txt']),
+        Stage('combine', combine, [interim], [paths['processed/ab.txt']],
+              srcs=[paths['interim/a.txt'], paths['interim/b.txt']],
+              dst=paths['processed/ab.txt'])]
+    return Pipeline(stages, paths['state.json'], executor='thread',
+                    **kwargs)
+
+
+def test_dependencies(files):
+    assert pipeline(files).deps == {'copy_a': set(), 'copy_b': set(),
+                                    'combine': {'copy_a', 'copy_b'}}
+
+
+def test_invalid_dependencies(files):
+    with pytest.raises(ValueError):
+        Pipeline([Stage('a', fail, after=['b']), Stage('b', fail)],
+                 files['state.json'])
+    with pytest.raises(ValueError):
+        Pipeline([Stage('a', fail), Stage('a', fail)], files['state.json'])
+
+
+def test_unchanged_stages_are_skipped(files):
+    assert pipeline(files).run() == dict.fromkeys(
+        ['copy_a', 'copy_b', 'combine'], 'ran')
+    with open(files['processed/ab.txt']) as f:
+        assert f.read() == 'A\nB\n'
+    assert pipeline(files).run() == dict.fromkeys(
+        ['copy_a', 'copy_b', 'combine'], 'skipped')
+
+    write(files['raw/a.txt'], 'a\nc\n')
+    assert pipeline(files).run() == {'copy_a': 'ran', 'copy_b': 'skipped',
+                                     'combine': 'ran'}
+    with open(files['processed/ab.txt']) as f:
+        assert f.read() == 'A\nC\nB\n'
+
+
+def test_same_content_is_skipped(files):
+    pipeline(files).run()
+    # rewritten with the same content: hashed again, but not run
+    write(files['raw/b.txt'], 'b\n')
+    os.utime(files['raw/b.txt'], ns=(1, 1))
+    assert set(pipeline(files).run().values()) == {'skipped'}
+
+
+def test_missing_outputs_are_rebuilt(files):
+    pipeline(files).run()
+    os.remove(files['processed/ab.txt'])
+    assert pipeline(files).run() == {'copy_a': 'skipped',
+                                     'copy_b': 'skipped', 'combine': 'ran'}
+    assert pipeline(files).run(force=True) == dict.fromkeys(
+        ['copy_a', 'copy_b', 'combine'], 'ran')
+
+
+def test_failed_stages_block_their_dependents(files):
+    dag = pipeline(files, report_dir=files['logs'])
+    dag.stages['copy_b'].func = fail
+    dag.stages['copy_b'].kwargs = {}
+    with pytest.raises(RuntimeError):
+        dag.run()
+    fpath, = glob.glob(os.path.join(files['logs'], 'profile_*.json'))
+    with open(fpath) as f:
+        report = json.load(f)
+    assert {name: stage['status'] for name, stage in
+            report['stages'].items()} == {'copy_a': 'ran',
+                                          'copy_b': 'failed',
+                                          'combine': 'blocked'}
+    # the failed stage runs again, the others are up to date
+    assert pipeline(files).run() == {'copy_a': 'skipped', 'copy_b': 'ran',
+                                     'combine': 'ran'}
+
+
+def test_report(files):
+    pipeline(files, report_dir=files['logs']).run()
+    fpath, = glob.glob(os.path.join(files['logs'], 'profile_*.json'))
+    with open(fpath) as f:
+        report = json.load(f)
+    copy_a = report['stages']['copy_a']
+    assert copy_a['status'] == 'ran'
+    assert copy_a['rows_in'] == 1
+    assert copy_a['bytes_out'] == 2
+    assert copy_a['input_bytes'] == copy_a['output_bytes'] == 2
+    assert report['stages']['combine']['input_bytes'] == 4
+    assert report['caches']['stages'] == {'hits': 0, 'misses': 3,
+                                          'hit_rate': 0.}
+    assert report['caches']['file_hashes']['misses'] == 4
+
+
+def test_file_hasher(files):
+    hasher = FileHasher()
+    paths = [files['raw/a.txt'], files['raw/b.txt']]
+    digest = hasher.digest(paths)
+    cached = FileHasher(hasher.cache)
+    assert cached.digest(paths) == digest
+    assert cached.stats() == {'hits': 2, 'misses': 0, 'hit_rate': 1.}
+
+    # a missing path changes the hash
+    assert hasher.digest(paths + [files['processed/ab.txt']]) != digest
+    write(files['raw/a.txt'], 'x\n')
+    assert cached.digest(paths) != digest
+    assert cached.hashed == 1
@@ -0,0 +1,206 @@
+"""
+Incremental CSSE refresh against a local HTTP server that serves the raw
+files with ETags, like the CSSE repository on GitHub.
+"""
+import os
+import hashlib
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import pandas as pd
+import pytest
+from src.data.structure import CSSE
+from src.data.reader import CSSEReader, date_columns
+from src.data.download import CSSEDownloader
+from src.data.transform import CSSETransformer
+
+# size of the served raw files
+N_COUNTIES = 40
+N_DATES = 10
+N_NEW_DATES = 3
+
+
+class ETagHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files with a content hash as ETag and answers 304 (Not Modified)
+    to a matching If-None-Match. Responses are recorded in log.
+    """
+    log = None
+
+    def do_GET(self):
+        fpath = self.translate_path(self.path)
+        if not os.path.isfile(fpath):
+            self.send_error(404)
+            return
+        with open(fpath, 'rb') as f:
+            body = f.read()
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        status = 304 if self.headers.get('If-None-Match') == etag else 200
+        self.log.append((os.path.basename(fpath), status))
+
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def publish(fdir, n_dates):
+    """
+    Write raw CSSE files with the first n_dates dates of the bundled data,
+    in the layout of the CSSE repository (no index column).
+    """
+    csse = CSSE('csse')
+    for fname in [csse.fname_confirmed_raw, csse.fname_deaths_raw]:
+        raw = pd.read_csv(os.path.join(csse.raw_dir_csse, 'US', fname),
+                          index_col=0, nrows=N_COUNTIES)
+        dates = list(date_columns(raw.columns).index)
+        keys = [col for col in raw.columns if col not in dates]
+        raw[keys + dates[:n_dates]].to_csv(os.path.join(fdir, fname),
+                                           index=False)
+
+
+def relocate(obj, root):
+    """
+    Point a CSSE data object to the data directories below root.
+    """
+    obj.project_dir = root
+    obj.raw_dir = os.path.join(root, 'data', 'raw')
+    obj.processed_dir = os.path.join(root, 'data', 'processed')
+    obj.raw_dir_csse = os.path.join(obj.raw_dir, obj.dirname)
+    obj.processed_dir_csse = os.path.join(obj.processed_dir, obj.dirname)
+    if isinstance(obj, CSSEDownloader):
+        obj.fpath_manifest = os.path.join(obj.raw_dir_csse,
+                                          obj.fname_manifest)
+    for fdir in [os.path.join(obj.raw_dir_csse, 'US'),
+                 os.path.join(obj.processed_dir_csse, 'US')]:
+        if not os.path.exists(fdir):
+            os.makedirs(fdir)
+    return obj
+
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    Local HTTP server of a directory. Yields the directory, the URL and the
+    log of (file name, status) of the responses.
+    """
+    fdir = tmp_path / 'www'
+    fdir.mkdir()
+    log = []
+    handler = type('Handler', (ETagHandler,), {'log': log})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0),
+                                partial(handler, directory=str(fdir)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield str(fdir), 'http://127.0.0.1:{}'.format(httpd.server_port), log
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def project(server, tmp_path):
+    """
+    Project directory after a full download and transformation of the
+    served files. Returns the root and a downloader.
+    """
+    fdir, url, log = server
+    root = str(tmp_path / 'project')
+    publish(fdir, N_DATES)
+    downloader = relocate(CSSEDownloader('csse', web_dir=url), root)
+    assert downloader.save_data(incremental=True) == \
+        {'confirmed': None, 'deaths': None}
+    relocate(CSSETransformer('csse'), root).raw2processed()
+    del log[:]
+    return root, downloader
+
+
+def processed_files(root):
+    csse = CSSE('csse')
+    fdir = os.path.join(root, 'data', 'processed', 'csse', 'US')
+    return [os.path.join(fdir, fname) for fname in
+            [csse.fname_confirmed_processed, csse.fname_deaths_processed]]
+
+
+def test_unchanged_files_are_skipped(server, project):
+    _, _, log = server
+    root, downloader = project
+    before = [open(f, 'rb').read() for f in processed_files(root)]
+
+    updated = downloader.save_data(incremental=True)
+
+    assert updated == {'confirmed': [], 'deaths': []}
+    assert sorted(log) == sorted(
+        (fname, 304) for fname in downloader.fnames_raw.values())
+    assert [open(f, 'rb').read() for f in processed_files(root)] == before
+
+
+def test_new_dates_are_appended(server, project, tmp_path):
+    fdir, url, log = server
+    root, downloader = project
+    publish(fdir, N_DATES + N_NEW_DATES)
+
+    updated = downloader.save_data(incremental=True)
+
+    assert sorted(log) == sorted(
+        (fname, 200) for fname in downloader.fnames_raw.values())
+    for var in ['confirmed', 'deaths']:
+        assert len(updated[var]) == N_NEW_DATES
+    manifest = downloader.read_manifest()
+    assert manifest['confirmed']['last_date'] == \
+        max(updated['confirmed']).strftime('%Y-%m-%d')
+
+    # the appended time series equal those of a full transformation
+    full = str(tmp_path / 'full')
+    relocate(CSSEDownloader('csse', web_dir=url), full).save_data()
+    relocate(CSSETransformer('csse'), full).raw2processed()
+    for var in ['confirmed', 'deaths']:
+        appended = relocate(CSSEReader('csse'), root).read_processed(var)
+        expected = relocate(CSSEReader('csse'), full).read_processed(var)
+        assert len(appended) == N_DATES + N_NEW_DATES
+        pd.testing.assert_frame_equal(appended, expected,
+                                      check_dtype=False)
+
+
+def test_new_dates_are_appended_to_parquet(server, project, tmp_path):
+    fdir, url, log = server
+    root, downloader = project
+    relocate(CSSETransformer('csse', backend='parquet'), root).raw2processed()
+    publish(fdir, N_DATES + N_NEW_DATES)
+
+    downloader.save_data(incremental=True)
+
+    full = str(tmp_path / 'full')
+    relocate(CSSEDownloader('csse', web_dir=url), full).save_data()
+    relocate(CSSETransformer('csse', backend='parquet'), full).raw2processed()
+    for var in ['confirmed', 'deaths']:
+        appended = relocate(CSSEReader('csse', backend='parquet'),
+                            root).read_processed(var)
+        expected = relocate(CSSEReader('csse', backend='parquet'),
+                            full).read_processed(var)
+        assert len(appended) == N_DATES + N_NEW_DATES
+        pd.testing.assert_frame_equal(appended, expected)
+
+
+def test_stale_parquet_is_removed(server, project):
+    fdir, url, log = server
+    root, downloader = project
+    relocate(CSSETransformer('csse', backend='parquet'), root).raw2processed()
+    publish(fdir, N_DATES + N_NEW_DATES)
+    for fpath in processed_files(root):
+        os.remove(fpath)
+
+    updated = downloader.save_data(incremental=True)
+
+    assert updated == {'confirmed': None, 'deaths': None}
+    for fpath in processed_files(root):
+        assert not os.path.exists(os.path.splitext(fpath)[0] + '.parquet')
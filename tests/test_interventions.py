@@ -0,0 +1,111 @@
+"""
+InterventionIndex against checking every intervention for every state and
+day.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.interventions import InterventionIndex, SCHEMA, TYPES
+from src.data.cube import state_fips
+
+STATES = [1, 6, 36, 72]
+DAYS = pd.date_range('2020-02-25', '2020-05-10').values
+
+
+def random_interventions(n=40, seed=0):
+    """
+    Interventions with overlaps, one-day spells and open ends.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2020-03-01') + pd.to_timedelta(
+        rng.integers(0, 60, n), unit='D')
+    length = pd.to_timedelta(rng.integers(0, 30, n), unit='D')
+    end = pd.Series(start + length).where(rng.random(n) > 0.2)
+    df = pd.DataFrame({
+        'state': rng.choice(STATES[:3], n),
+        'type': pd.Categorical(rng.choice(TYPES[:4], n), categories=TYPES),
+        'start': start, 'end': end.values,
+        'stringency': rng.integers(1, 5, n) / 4.})
+    return df.astype(SCHEMA)
+
+
+def naive_active(df, states, days):
+    """
+    Boolean array (state-day pair, intervention) by looping.
+    """
+    active = np.zeros((len(states), len(df)), dtype=bool)
+    for i, (state, day) in enumerate(zip(states, days)):
+        for j, row in enumerate(df.itertuples()):
+            active[i, j] = row.state == state and row.start <= day and \
+                (pd.isna(row.end) or day <= row.end)
+    return active
+
+
+def query_pairs():
+    states = np.repeat(STATES + [99], len(DAYS))
+    days = np.tile(DAYS, len(STATES) + 1)
+    return states, days
+
+
+def test_active_equals_loop():
+    df = random_interventions()
+    index = InterventionIndex(df)
+    states, days = query_pairs()
+    active = index.active(states, days)
+    np.testing.assert_array_equal(active.toarray(),
+                                  naive_active(df, states, pd.to_datetime(
+                                      days)))
+
+
+def test_active_broadcasts():
+    index = InterventionIndex(random_interventions())
+    states = np.array(STATES)
+    active = index.active(states[None, :], DAYS[:, None])
+    expected = index.active(np.tile(states, len(DAYS)),
+                            np.repeat(DAYS, len(states)))
+    assert (active != expected).nnz == 0
+
+
+@pytest.mark.parametrize('types', [None, ['stay_at_home', TYPES[0]]],
+                         ids=['all', 'some'])
+def test_treatment_equals_loop(types):
+    df = random_interventions()
+    index = InterventionIndex(df)
+    states, days = query_pairs()
+    active = naive_active(df, states, pd.to_datetime(days))
+    if types is not None:
+        active &= df['type'].isin(types).values[None, :]
+
+    indicator = index.treatment(states, days, types)
+    np.testing.assert_array_equal(indicator, active.any(axis=1))
+    stringency = index.treatment(states, days, types, value='stringency')
+    expected = np.where(active, df['stringency'].values[None, :], 0.)
+    np.testing.assert_array_equal(stringency, expected.max(axis=1))
+
+
+def test_treatment_arrays_of_counties():
+    df = random_interventions()
+    index = InterventionIndex(df)
+    county = np.array([1001, 6037, 1003, 36061, 72001, 99001])
+    arrays = index.treatment_arrays(DAYS, county, types=['stay_at_home'])
+    treated = arrays['stay_at_home']
+    assert treated.shape == (len(DAYS), len(county))
+    for j, state in enumerate(state_fips(county)):
+        expected = index.treatment(np.full(len(DAYS), state), DAYS,
+                                   ['stay_at_home'])
+        np.testing.assert_array_equal(treated[:, j], expected)
+    # 99001 belongs to no state
+    assert treated[:, -1].sum() == 0
+
+
+def test_start_dates():
+    df = random_interventions()
+    index = InterventionIndex(df)
+    starts = index.start_dates(['school_closure'])
+    for state in STATES:
+        rows = df[(df['state'] == state) &
+                  (df['type'] == 'school_closure')]
+        if len(rows):
+            assert starts[state] == rows['start'].min()
+        else:
+            assert state not in starts.index
@@ -0,0 +1,145 @@
+"""
+Rolling-window regressions against one Panel per window, and event-study
+dummies against a loop over counties and dates.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.models.train_model import Panel, sample
+from src.models.rolling import RollingRegression, event_study, event_name, \
+    state_event_dates
+
+N_TIMES = 30
+N_COUNTIES = 12
+WINDOW = 10
+STEP = 4
+
+TIME = pd.date_range('2020-03-01', periods=N_TIMES).values
+
+EFFECTS = [(False, False), (True, False), (False, True), (True, True)]
+
+# event date per county, NaT for the controls
+EVENTS = np.array(['2020-03-06', '2020-03-12', 'NaT', '2020-02-20',
+                   '2020-03-28', '2020-04-10', 'NaT', '2020-03-01',
+                   '2020-03-15', '2020-03-15', '2020-03-30', 'NaT'],
+                  dtype='datetime64[ns]')
+
+
+def rolling_variables(balanced):
+    rng = np.random.default_rng(0)
+    shape = (N_TIMES, N_COUNTIES)
+    x = rng.normal(size=shape) + np.linspace(0, 3, N_TIMES)[:, None]
+    population = rng.normal(size=N_COUNTIES)
+    y = 0.5 * x + 0.2 * population + rng.normal(size=shape)
+    if not balanced:
+        y[rng.random(shape) < 0.15] = np.nan
+    return {'y': y, 'x': x, 'population': population}
+
+
+def window_fits(variables, exog, effects):
+    """
+    Estimates of every window from a Panel of its observations.
+    """
+    rows = []
+    for lo in range(0, N_TIMES - WINDOW + 1, STEP):
+        window = {name: x[lo:lo + WINDOW] if np.ndim(x) == 2 else x
+                  for name, x in variables.items() if name in ['y'] + exog}
+        shape = (WINDOW, N_COUNTIES)
+        panel = Panel(window, shape, sample(window.values(), shape),
+                      *effects)
+        res = panel.fit('y', exog, drop_absorbed=True)
+        for name in res.params.index:
+            rows.append((TIME[lo], name, res.params[name],
+                         res.std_errors[name], res.nobs, res.rsquared))
+    return pd.DataFrame(rows, columns=['start', 'parameter', 'estimate',
+                                       'std_error', 'nobs', 'rsquared'])
+
+
+@pytest.mark.parametrize('effects', EFFECTS,
+                         ids=['none', 'entity', 'time', 'both'])
+@pytest.mark.parametrize('balanced', [True, False],
+                         ids=['balanced', 'unbalanced'])
+def test_windows_equal_panel_fits(balanced, effects):
+    variables = rolling_variables(balanced)
+    exog = ['x', 'population']
+    rolling = RollingRegression(variables, WINDOW, STEP, time=TIME,
+                                entity_effects=effects[0],
+                                time_effects=effects[1], drop_absorbed=True)
+    df = rolling.fit('y', exog)
+    expected = window_fits(variables, exog, effects)
+
+    assert list(df['start']) == list(expected['start'])
+    assert list(df['parameter']) == list(expected['parameter'])
+    for col in ['estimate', 'std_error', 'rsquared']:
+        np.testing.assert_allclose(df[col], expected[col], rtol=1e-7,
+                                   atol=1e-10)
+    assert list(df['nobs']) == list(expected['nobs'])
+
+
+def test_estimates_can_be_collected():
+    rolling = RollingRegression(rolling_variables(balanced=True), WINDOW,
+                                STEP, entity_effects=True)
+    estimates = list(rolling._estimates('y', ['x'], None))
+    expected = window_fits(rolling_variables(balanced=True), ['x'],
+                           (True, False))
+    params = np.concatenate([estimate()['params']
+                             for _, _, estimate in estimates])
+    np.testing.assert_allclose(params, expected['estimate'], rtol=1e-8)
+
+
+def naive_event_study(time, dates, leads, lags, reference, bin_endpoints):
+    """
+    Event-study dummies by looping over counties and dates.
+    """
+    dummies = {}
+    for period in range(-leads, lags + 1):
+        if period == reference:
+            continue
+        x = np.zeros((len(time), len(dates)))
+        for j, date in enumerate(dates):
+            if pd.isna(date):
+                continue
+            for i, day in enumerate(time):
+                k = (pd.Timestamp(day) - pd.Timestamp(date)).days
+                if k == period or \
+                        (bin_endpoints and period == -leads and k < period) \
+                        or (bin_endpoints and period == lags and k > period):
+                    x[i, j] = 1.
+        dummies[event_name(period)] = x
+    return dummies
+
+
+@pytest.mark.parametrize('bin_endpoints', [True, False],
+                         ids=['binned', 'unbinned'])
+def test_event_study_equals_loop(bin_endpoints):
+    dummies = event_study(TIME, EVENTS, leads=4, lags=6, reference=-1,
+                          bin_endpoints=bin_endpoints)
+    expected = naive_event_study(TIME, EVENTS, 4, 6, -1, bin_endpoints)
+    assert list(dummies) == list(expected)
+    for name, x in dummies.items():
+        np.testing.assert_array_equal(x.toarray(), expected[name])
+
+
+@pytest.mark.parametrize('effects', EFFECTS[1:],
+                         ids=['entity', 'time', 'both'])
+def test_sparse_dummies_equal_dense(effects):
+    rng = np.random.default_rng(1)
+    dummies = event_study(TIME, EVENTS, leads=3, lags=3)
+    y = rng.normal(size=(N_TIMES, N_COUNTIES)) + \
+        sum(dummies.values()).toarray()
+    kwargs = dict(window=WINDOW, step=STEP, entity_effects=effects[0],
+                  time_effects=effects[1], drop_absorbed=True)
+    exog = list(dummies)
+    sparse_fit = RollingRegression(dict(dummies, y=y), **kwargs).fit('y',
+                                                                     exog)
+    dense = {name: x.toarray() for name, x in dummies.items()}
+    dense_fit = RollingRegression(dict(dense, y=y), **kwargs).fit('y', exog)
+    pd.testing.assert_frame_equal(sparse_fit, dense_fit, rtol=1e-8)
+
+
+def test_state_event_dates():
+    county = np.array([1001, 1003, 6037, 36061])
+    dates = state_event_dates(county, {1: '2020-03-20', 36: '2020-03-22'})
+    expected = np.array(['2020-03-20', '2020-03-20', 'NaT', '2020-03-22'],
+                        dtype='datetime64[ns]')
+    np.testing.assert_array_equal(dates, expected)
@@ -0,0 +1,23 @@
+"""
+The stem cache shared by the text feature functions, saved to and loaded
+from a temporary directory.
+"""
+from src.features import sentiments
+
+TEXT = 'Runners were running 12 races, and the runner ran again.'
+
+
+def test_stem_cache_survives_restart(tmp_path):
+    cache = sentiments.get_resource('stem_cache')
+    cache.clear()
+    tokens = sentiments.normalize_text(TEXT)
+    assert cache.stats()['hits'] < len(tokens)
+    sentiments.save_caches(str(tmp_path / 'cache'))
+
+    # a restarted process starts empty and loads the saved stems
+    cache.clear()
+    sentiments.load_caches(str(tmp_path / 'cache'))
+    assert sentiments.normalize_text(TEXT) == tokens
+    stats = sentiments.cache_stats()['stem']
+    assert stats['misses'] == 0
+    assert stats['hits'] == len(tokens)
@@ -0,0 +1,109 @@
+"""
+SpecificationGrid against fitting every specification on its own.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.models.train_model import FixedEffects
+from src.models.specifications import SpecificationGrid, EFFECTS, \
+    specification_grid, lag, window_slice
+
+N_TIMES = 20
+N_COUNTIES = 15
+
+# five counties per state
+STATES = np.repeat(np.arange(1, 4), 5)
+
+TIME = pd.date_range('2020-03-01', periods=N_TIMES).values
+
+
+def grid_variables(balanced):
+    rng = np.random.default_rng(0)
+    shape = (N_TIMES, N_COUNTIES)
+    confirmed = rng.normal(size=shape)
+    population = rng.normal(size=N_COUNTIES)
+    deaths = 0.3 * confirmed + 0.2 * population + rng.normal(size=shape)
+    if not balanced:
+        deaths[rng.random(shape) < 0.1] = np.nan
+        confirmed[rng.random(shape) < 0.1] = np.nan
+    return {'deaths': deaths, 'confirmed': confirmed,
+            'population': population}
+
+
+def windowed(variables, name, periods, rows):
+    """
+    Lagged variable in the rows of a window; county level variables as
+    they are.
+    """
+    x = variables[name]
+    return lag(x, periods)[rows] if np.ndim(x) == 2 else x
+
+
+def direct_fit(variables, spec, cov_type, common=()):
+    """
+    Fit one specification with FixedEffects, dropping the observations
+    where a regressor of common is missing, too.
+    """
+    rows = window_slice(TIME, spec.window)
+    y = windowed(variables, spec.dependent, 0, rows).copy()
+    for name in common:
+        x = windowed(variables, name, spec.lag, rows)
+        y[~np.isfinite(np.broadcast_to(x, y.shape))] = np.nan
+    exog = {}
+    for name in spec.exog:
+        x = windowed(variables, name, spec.lag, rows)
+        lagged = np.ndim(variables[name]) == 2 and spec.lag > 0
+        exog['L{}.{}'.format(spec.lag, name) if lagged else name] = x
+    model = FixedEffects(y, exog, *EFFECTS[spec.effects],
+                         drop_absorbed=True)
+    states = STATES if cov_type == 'clustered' else 'entity'
+    return model.fit(cov_type, clusters=states)
+
+
+def grid_specs():
+    return specification_grid(
+        ['deaths'], [['population'], ['confirmed'],
+                     ['confirmed', 'population']],
+        effects=list(EFFECTS), lags=[0, 3],
+        windows=[None, ('2020-03-05', '2020-03-18')])
+
+
+@pytest.mark.parametrize('common_sample', [False, True],
+                         ids=['own', 'common'])
+@pytest.mark.parametrize('cov_type', ['unadjusted', 'clustered'])
+@pytest.mark.parametrize('balanced', [True, False],
+                         ids=['balanced', 'unbalanced'])
+def test_grid_equals_direct_fits(balanced, cov_type, common_sample):
+    variables = grid_variables(balanced)
+    grid = SpecificationGrid(variables, time=TIME, cov_type=cov_type,
+                             common_sample=common_sample, clusters=STATES)
+    specs = grid_specs()
+    df = grid.fit(specs, n_jobs=1)
+
+    common = ['confirmed', 'population'] if common_sample else ()
+    for i, spec in enumerate(specs):
+        res = direct_fit(variables, spec, cov_type, common)
+        rows = df[df['spec'] == i].set_index('parameter')
+        assert list(rows.index) == list(res.params.index)
+        np.testing.assert_allclose(rows['estimate'], res.params, rtol=1e-8)
+        np.testing.assert_allclose(rows['std_error'], res.std_errors,
+                                   rtol=1e-8)
+        np.testing.assert_allclose(rows['pvalue'], res.pvalues, rtol=1e-6,
+                                   atol=1e-12)
+        assert (rows['nobs'] == res.nobs).all()
+        np.testing.assert_allclose(rows['rsquared'], res.rsquared,
+                                   rtol=1e-8)
+
+
+def test_results_do_not_depend_on_workers():
+    grid = SpecificationGrid(grid_variables(balanced=False), time=TIME)
+    one = grid.fit(grid_specs(), n_jobs=1)
+    two = grid.fit(grid_specs(), n_jobs=2)
+    pd.testing.assert_frame_equal(one, two)
+
+
+def test_samples_are_shared():
+    grid = SpecificationGrid(grid_variables(balanced=True), time=TIME,
+                             common_sample=True)
+    # one sample per effects, lag and window
+    assert len(grid.samples(grid_specs())) == len(EFFECTS) * 2 * 2
@@ -0,0 +1,114 @@
+"""
+FixedEffects against linearmodels.PanelOLS on small synthetic panels.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from linearmodels import PanelOLS
+from src.models.train_model import FixedEffects, demean, inverse
+
+N_TIMES = 10
+N_COUNTIES = 25
+
+# five counties per state
+STATES = np.repeat(np.arange(1, 6), 5)
+
+EFFECTS = [(False, False), (True, False), (False, True), (True, True)]
+
+COV_TYPES = [('unadjusted', None), ('robust', None),
+             ('clustered', 'entity'), ('clustered', 'time'),
+             ('clustered', 'state')]
+
+
+def panel_data(balanced):
+    """
+    Dependent variable, a (time, county) regressor and a county level
+    regressor.
+    """
+    rng = np.random.default_rng(0)
+    shape = (N_TIMES, N_COUNTIES)
+    x = rng.normal(size=shape)
+    population = rng.normal(size=N_COUNTIES)
+    y = x + 0.5 * population + rng.normal(size=shape) + \
+        rng.normal(size=(N_TIMES, 1))
+    if not balanced:
+        y[rng.random(shape) < 0.2] = np.nan
+    return y, x, population
+
+
+def long_frame(y, x, population):
+    """
+    The variables in the long (county, time) format of PanelOLS.
+    """
+    index = pd.MultiIndex.from_product(
+        [range(N_COUNTIES), pd.date_range('2020-03-01', periods=N_TIMES)],
+        names=['county', 'time'])
+    df = pd.DataFrame({'y': y.T.ravel(), 'x': x.T.ravel(),
+                       'population': np.repeat(population, N_TIMES),
+                       'state': np.repeat(STATES, N_TIMES)}, index=index)
+    df['const'] = 1.
+    return df.dropna()
+
+
+@pytest.mark.parametrize('cov_type,clusters', COV_TYPES,
+                         ids=[c or t for t, c in COV_TYPES])
+@pytest.mark.parametrize('effects', EFFECTS,
+                         ids=['none', 'entity', 'time', 'both'])
+@pytest.mark.parametrize('balanced', [True, False],
+                         ids=['balanced', 'unbalanced'])
+def test_equals_panelols(balanced, effects, cov_type, clusters):
+    entity_effects, time_effects = effects
+    y, x, population = panel_data(balanced)
+    exog = {'x': x}
+    if not entity_effects:
+        exog['population'] = population
+    df = long_frame(y, x, population)
+
+    kwargs = {}
+    if clusters == 'state':
+        kwargs['clusters'] = df[['state']]
+    elif clusters is not None:
+        kwargs['cluster_entity'] = clusters == 'entity'
+        kwargs['cluster_time'] = clusters == 'time'
+    expected = PanelOLS(df['y'], df[['const'] + list(exog)],
+                        entity_effects=entity_effects,
+                        time_effects=time_effects).fit(cov_type=cov_type,
+                                                       **kwargs)
+    model = FixedEffects(y, exog, entity_effects, time_effects)
+    res = model.fit(cov_type, clusters=STATES if clusters == 'state' else
+                    clusters or 'entity')
+
+    assert res.nobs == expected.nobs
+    assert res.df_resid == expected.df_resid
+    np.testing.assert_allclose(res.params, expected.params, rtol=1e-8)
+    np.testing.assert_allclose(res.std_errors, expected.std_errors,
+                               rtol=1e-8)
+    np.testing.assert_allclose(res.pvalues, expected.pvalues, rtol=1e-6,
+                               atol=1e-12)
+    np.testing.assert_allclose(res.rsquared, expected.rsquared, rtol=1e-8)
+
+
+def test_demean_keeps_compact_shapes():
+    rng = np.random.default_rng(0)
+    county = rng.normal(size=(1, N_COUNTIES))
+    demeaned = demean(county, entity_effects=False, time_effects=True)
+    assert demeaned.shape == (1, N_COUNTIES)
+    np.testing.assert_allclose(demeaned.sum(), 0., atol=1e-12)
+
+
+def test_absorbed_regressor():
+    y, x, population = panel_data(balanced=True)
+    exog = {'x': x, 'population': population}
+    with pytest.raises(ValueError):
+        FixedEffects(y, exog, entity_effects=True).fit()
+    res = FixedEffects(y, exog, entity_effects=True,
+                       drop_absorbed=True).fit()
+    assert list(res.params.index) == ['const', 'x']
+
+
+def test_collinear_regressors():
+    y, x, _ = panel_data(balanced=True)
+    with pytest.raises(np.linalg.LinAlgError):
+        FixedEffects(y, {'x': x, 'twice': 2 * x}).fit()
+    with pytest.raises(np.linalg.LinAlgError):
+        inverse(np.zeros((1, 1)), ['zero'])